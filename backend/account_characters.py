@@ -0,0 +1,89 @@
+import asyncio
+from typing import Dict, List, Optional
+
+import aiomysql
+
+from cache import TTLCache
+from config import ACCOUNT_CHARS_CACHE_TTL, ACCOUNT_CHARS_CACHE_MAXSIZE, ACCOUNT_CHARS_PARTIAL_TTL
+from db import fetch_all, db_pools
+
+
+# auth account_id -> lista de personajes de todos los realms
+_cache = TTLCache(maxsize=ACCOUNT_CHARS_CACHE_MAXSIZE, ttl=ACCOUNT_CHARS_CACHE_TTL)
+# fills en curso por cuenta (peticiones concurrentes comparten el mismo fan-out)
+_inflight: Dict[int, asyncio.Task] = {}
+
+
+def _serialize_character(row: dict, realm_id: Optional[int], realm_name: Optional[str]) -> dict:
+    return {
+        'realm_id': realm_id,
+        'realm_name': realm_name,
+        'guid': int(row.get('guid') or 0),
+        'name': row.get('name'),
+        'level': int(row.get('level') or 0),
+        'race': int(row.get('race') or 0),
+        'class': int(row.get('class') or 0),
+        'gender': int(row.get('gender') or 0),
+    }
+
+
+async def _fetch_realm(realm: dict, account_id: int) -> Optional[list]:
+    """Personajes de la cuenta en un realm; None si la DB del realm falló."""
+    realm_id = realm.get('realm_id')
+    realm_name = realm.get('name') or f'Realm {realm_id}'
+    try:
+        pool = await db_pools.get_realm_pool(realm)
+        if pool is None:
+            return []
+        async with pool.connection() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cur:
+                await cur.execute('SELECT guid, name, level, race, class, gender FROM characters WHERE account = %s', (account_id,))
+                rows = await cur.fetchall()
+    except Exception:
+        return None
+    return [_serialize_character(r, realm_id, realm_name) for r in (rows or [])]
+
+
+async def _fill(account_id: int) -> list:
+    realms = await fetch_all('cms', 'SELECT realm_id, name, char_db_host, char_db_port, char_db_user, char_db_password, char_db_name FROM realms ORDER BY realm_id ASC') or []
+    if realms:
+        chunks = await asyncio.gather(*[_fetch_realm(r, account_id) for r in realms])
+        characters = [c for chunk in chunks if chunk for c in chunk]
+        if any(chunk is None for chunk in chunks):
+            # lista incompleta: se devuelve lo que hay pero se vuelve a pedir pronto
+            _cache.set(account_id, characters, ttl=ACCOUNT_CHARS_PARTIAL_TTL)
+            return characters
+    else:
+        # sin realms registrados: instalación de un solo realm con el pool global 'characters'
+        rows = await fetch_all('characters', 'SELECT guid, name, level, race, class, gender FROM characters WHERE account = %s', (account_id,)) or []
+        characters = [_serialize_character(r, None, None) for r in rows]
+    _cache.set(account_id, characters)
+    return characters
+
+
+async def get_account_characters(account_id: int, refresh: bool = False) -> List[dict]:
+    """Characters of an auth account across all realms, cached for ACCOUNT_CHARS_CACHE_TTL.
+
+    `refresh=True` skips the cache and re-runs the fan-out.
+    """
+    if not refresh:
+        cached = _cache.get(account_id)
+        if cached is not None:
+            return cached
+    task = _inflight.get(account_id)
+    if task is None:
+        task = asyncio.create_task(_fill(account_id))
+        _inflight[account_id] = task
+        task.add_done_callback(lambda _t: _inflight.pop(account_id, None))
+    return await asyncio.shield(task)
+
+
+async def get_realm_characters(account_id: int, realm_id: Optional[int], refresh: bool = False) -> List[dict]:
+    characters = await get_account_characters(account_id, refresh=refresh)
+    if realm_id is None:
+        return characters
+    return [c for c in characters if c['realm_id'] in (realm_id, None)]
+
+
+def invalidate(account_id: int) -> None:
+    _cache.pop(account_id)
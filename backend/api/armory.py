@@ -1,9 +1,23 @@
-from fastapi import APIRouter, HTTPException
-from db import fetch_one
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from typing import List, Optional
+from db import fetch_one, db_pools
+from character_index import character_index
+from cache import TTLCache
+from world_items import get_item_templates
+from config import ARMORY_CACHE_TTL_ONLINE, ARMORY_CACHE_TTL_OFFLINE, ARMORY_CACHE_MAXSIZE, ARMORY_BATCH_MAX
 import aiomysql
+import hashlib
+import json
 
 router = APIRouter(prefix="/armory", tags=["armory"])
 
+
+class ArmoryBatchRequest(BaseModel):
+    guids: List[int]
+
 SLOT_NAMES = {
     0: "head",
     1: "neck",
@@ -36,115 +50,252 @@ POWER_KEYS = [
     ("power7", "runic_power"),
 ]
 
-@router.get('/{realm_id}/{guid}')
-async def character_armory(realm_id: int, guid: int):
-    # Obtener datos de conexión del realm
-    realm = await fetch_one('cms', 'SELECT realm_id, name, char_db_host, char_db_port, char_db_user, char_db_password, char_db_name FROM realms WHERE realm_id = %s', (realm_id,))
-    if not realm:
-        raise HTTPException(status_code=404, detail='Realm no encontrado')
-    host = realm.get('char_db_host')
-    port = realm.get('char_db_port') or 3306
-    user = realm.get('char_db_user')
-    password = realm.get('char_db_password') or ''
-    dbname = realm.get('char_db_name')
-    if not host or not user or not dbname:
-        raise HTTPException(status_code=503, detail='Realm sin datos de conexión')
+CHARACTER_COLUMNS = 'guid, name, level, race, class, gender, online, health, power1, power2, power3, power4, power5, power6, power7, totalKills, todayKills, yesterdayKills'
+# fallback sin algunas columnas de poder si difiere
+CHARACTER_COLUMNS_FALLBACK = 'guid, name, level, race, class, gender, online, health, totalKills, todayKills, yesterdayKills'
+
+
+def _serialize_character(row: dict) -> dict:
+    powers = {}
+    for col, label in POWER_KEYS:
+        if col in row:
+            powers[label] = row.get(col)
+    return {
+        'guid': row.get('guid'),
+        'name': row.get('name'),
+        'level': row.get('level'),
+        'race': row.get('race'),
+        'class': row.get('class'),
+        'gender': row.get('gender'),
+        'online': bool(row.get('online')),
+        'health': row.get('health'),
+        'powers': powers,
+        'totalKills': row.get('totalKills'),
+        'todayKills': row.get('todayKills'),
+        'yesterdayKills': row.get('yesterdayKills'),
+    }
+
+
+def _serialize_equipment_set(eq: dict) -> dict:
+    # typical structure has item0..item18
+    slots = []
+    for slot_id in range(0, 19):
+        col = f'item{slot_id}'
+        if col in eq:
+            item_guid = eq.get(col)
+            if item_guid and int(item_guid) != 0:
+                slots.append({'slot_id': slot_id, 'slot_name': SLOT_NAMES.get(slot_id, f'slot_{slot_id}'), 'item_guid': item_guid})
+    return {
+        'setguid': eq.get('setguid'),
+        'index': eq.get('setindex'),
+        'name': eq.get('name'),
+        'icon': eq.get('iconname'),
+        'ignore_mask': eq.get('ignore_mask'),
+        'slots': slots
+    }
+
+
+def _serialize_arena_team(t: dict) -> dict:
+    sg = t.get('seasonGames') or 0
+    sw = t.get('seasonWins') or 0
+    wg = t.get('weekGames') or 0
+    ww = t.get('weekWins') or 0
+    return {
+        'id': t.get('arenaTeamId'),
+        'name': t.get('name'),
+        'type': t.get('type'),
+        'personalRating': t.get('personalRating'),
+        'seasonGames': sg,
+        'seasonWins': sw,
+        'seasonWinRatio': round((float(sw)/sg) if sg>0 else 0.0, 4),
+        'weekGames': wg,
+        'weekWins': ww,
+        'weekWinRatio': round((float(ww)/wg) if wg>0 else 0.0, 4),
+    }
 
-    try:
-        conn = await aiomysql.connect(host=host, port=int(port), user=user, password=password, db=dbname)
-    except Exception as e:
-        raise HTTPException(status_code=503, detail=f'No se pudo conectar al realm: {e}')
 
-    character = None
-    equipment_sets = []
-    arena_teams = []
+async def _load_armory_rows(cur, guids: list) -> tuple[dict, dict, dict, dict]:
+    """Load characters, equipment sets, item entries and arena teams for `guids` with IN (...) queries.
+
+    Returns (characters, equipment_sets, arena_teams, item_entries); the first three are keyed by guid.
+    """
+    placeholders = ','.join(['%s'] * len(guids))
+    params = tuple(guids)
+    try:
+        await cur.execute(f'SELECT {CHARACTER_COLUMNS} FROM characters WHERE guid IN ({placeholders})', params)
+    except Exception:
+        await cur.execute(f'SELECT {CHARACTER_COLUMNS_FALLBACK} FROM characters WHERE guid IN ({placeholders})', params)
+    characters = {int(r['guid']): _serialize_character(r) for r in (await cur.fetchall() or [])}
+    equipment_sets = {g: [] for g in characters}
+    arena_teams = {g: [] for g in characters}
+    item_entries = {}
+    if not characters:
+        return characters, equipment_sets, arena_teams, item_entries
+    # Equipment sets
     try:
-        async with conn.cursor(aiomysql.DictCursor) as cur:
-            # Datos básicos del personaje (column names may vary slightly per core; adjust if needed)
-            try:
-                await cur.execute('SELECT guid, name, level, race, class, gender, health, power1, power2, power3, power4, power5, power6, power7, totalKills, todayKills, yesterdayKills FROM characters WHERE guid = %s', (guid,))
-            except Exception:
-                # fallback sin algunas columnas de poder si difiere
-                await cur.execute('SELECT guid, name, level, race, class, gender, health, totalKills, todayKills, yesterdayKills FROM characters WHERE guid = %s', (guid,))
-            row = await cur.fetchone()
-            if not row:
-                raise HTTPException(status_code=404, detail='Personaje no encontrado')
-            powers = {}
-            for col, label in POWER_KEYS:
-                if col in row:
-                    powers[label] = row.get(col)
-            character = {
-                'guid': row.get('guid'),
-                'name': row.get('name'),
-                'level': row.get('level'),
-                'race': row.get('race'),
-                'class': row.get('class'),
-                'gender': row.get('gender'),
-                'health': row.get('health'),
-                'powers': powers,
-                'totalKills': row.get('totalKills'),
-                'todayKills': row.get('todayKills'),
-                'yesterdayKills': row.get('yesterdayKills'),
-            }
-            # Equipment sets
-            try:
-                await cur.execute('SELECT * FROM character_equipmentsets WHERE guid = %s ORDER BY setindex ASC', (guid,))
-                eq_rows = await cur.fetchall()
-                if eq_rows:
-                    for eq in eq_rows:
-                        # typical structure has item0..item18
-                        slots = []
-                        for slot_id in range(0, 19):
-                            col = f'item{slot_id}'
-                            if col in eq:
-                                item_guid = eq.get(col)
-                                if item_guid and int(item_guid) != 0:
-                                    slots.append({'slot_id': slot_id, 'slot_name': SLOT_NAMES.get(slot_id, f'slot_{slot_id}'), 'item_guid': item_guid})
-                        equipment_sets.append({
-                            'setguid': eq.get('setguid'),
-                            'index': eq.get('setindex'),
-                            'name': eq.get('name'),
-                            'icon': eq.get('iconname'),
-                            'ignore_mask': eq.get('ignore_mask'),
-                            'slots': slots
-                        })
-            except Exception:
-                equipment_sets = []
-            # Arena teams del personaje
-            try:
-                await cur.execute('SELECT atm.arenaTeamId, at.name, at.type, atm.personalRating, atm.seasonGames, atm.seasonWins, atm.weekGames, atm.weekWins FROM arena_team_member atm JOIN arena_team at ON at.arenaTeamId = atm.arenaTeamId WHERE atm.guid = %s', (guid,))
-                team_rows = await cur.fetchall()
-                if team_rows:
-                    for t in team_rows:
-                        sg = t.get('seasonGames') or 0
-                        sw = t.get('seasonWins') or 0
-                        wg = t.get('weekGames') or 0
-                        ww = t.get('weekWins') or 0
-                        arena_teams.append({
-                            'id': t.get('arenaTeamId'),
-                            'name': t.get('name'),
-                            'type': t.get('type'),
-                            'personalRating': t.get('personalRating'),
-                            'seasonGames': sg,
-                            'seasonWins': sw,
-                            'seasonWinRatio': round((float(sw)/sg) if sg>0 else 0.0, 4),
-                            'weekGames': wg,
-                            'weekWins': ww,
-                            'weekWinRatio': round((float(ww)/wg) if wg>0 else 0.0, 4),
-                        })
-            except Exception:
-                arena_teams = []
-    finally:
-        conn.close()
+        await cur.execute(f'SELECT * FROM character_equipmentsets WHERE guid IN ({placeholders}) ORDER BY guid ASC, setindex ASC', params)
+        for eq in (await cur.fetchall() or []):
+            equipment_sets.setdefault(int(eq['guid']), []).append(_serialize_equipment_set(eq))
+    except Exception:
+        equipment_sets = {g: [] for g in characters}
+    # item_guid -> itemEntry (una sola consulta para todos los sets)
+    item_guids = {int(sl['item_guid']) for sets in equipment_sets.values() for eq in sets for sl in eq['slots']}
+    if item_guids:
         try:
-            await conn.wait_closed()
+            item_placeholders = ','.join(['%s'] * len(item_guids))
+            await cur.execute(f'SELECT guid, itemEntry FROM item_instance WHERE guid IN ({item_placeholders})', tuple(item_guids))
+            item_entries = {int(r['guid']): int(r['itemEntry']) for r in (await cur.fetchall() or [])}
         except Exception:
-            pass
+            item_entries = {}
+    # Arena teams
+    try:
+        await cur.execute(f'SELECT atm.guid, atm.arenaTeamId, at.name, at.type, atm.personalRating, atm.seasonGames, atm.seasonWins, atm.weekGames, atm.weekWins FROM arena_team_member atm JOIN arena_team at ON at.arenaTeamId = atm.arenaTeamId WHERE atm.guid IN ({placeholders})', params)
+        for t in (await cur.fetchall() or []):
+            arena_teams.setdefault(int(t['guid']), []).append(_serialize_arena_team(t))
+    except Exception:
+        arena_teams = {g: [] for g in characters}
+    return characters, equipment_sets, arena_teams, item_entries
 
-    return {
+
+async def _resolve_equipment_items(equipment_sets: list, item_entries: dict) -> None:
+    """Add item_entry + item_template info to every slot (templates come from the world item LRU)."""
+    if not item_entries:
+        return
+    try:
+        templates = await get_item_templates(item_entries.values())
+    except Exception:
+        templates = {}
+    for eq in equipment_sets:
+        for sl in eq['slots']:
+            entry = item_entries.get(int(sl['item_guid']))
+            sl['item_entry'] = entry
+            sl['item'] = templates.get(entry) if entry else None
+
+
+# (realm_id, guid) -> (etag, payload, ttl)
+_armory_cache = TTLCache(maxsize=ARMORY_CACHE_MAXSIZE, ttl=ARMORY_CACHE_TTL_OFFLINE)
+
+
+def _make_etag(data: dict) -> str:
+    raw = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+    return '"' + hashlib.sha1(raw.encode('utf-8')).hexdigest() + '"'
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+
+def _cache_armory(realm: dict, character: dict, equipment_sets: list, arena_teams: list) -> tuple:
+    realm_id = realm.get('realm_id')
+    data = jsonable_encoder({
         'realm_id': realm_id,
         'realm_name': realm.get('name'),
         'character': character,
         'equipment_sets': equipment_sets,
         'arena_teams': arena_teams
+    })
+    ttl = ARMORY_CACHE_TTL_ONLINE if character.get('online') else ARMORY_CACHE_TTL_OFFLINE
+    entry = (_make_etag(data), data, ttl)
+    _armory_cache.set((realm_id, int(character['guid'])), entry, ttl=ttl)
+    return entry
+
+
+async def _get_realm_pool(realm_id: int):
+    realm = await fetch_one('cms', 'SELECT realm_id, name, char_db_host, char_db_port, char_db_user, char_db_password, char_db_name FROM realms WHERE realm_id = %s', (realm_id,))
+    if not realm:
+        raise HTTPException(status_code=404, detail='Realm no encontrado')
+    try:
+        pool = await db_pools.get_realm_pool(realm)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f'No se pudo conectar al realm: {e}')
+    if pool is None:
+        raise HTTPException(status_code=503, detail='Realm sin datos de conexión')
+    return realm, pool
+
+
+def _armory_response(request: Request, etag: str, data: dict, ttl: int) -> Response:
+    headers = {'ETag': etag, 'Cache-Control': f'public, max-age={ttl}'}
+    if _etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(data, headers=headers)
+
+
+@router.get('/search')
+async def search_characters(q: str, realm_id: Optional[int] = None, limit: int = 20):
+    """Búsqueda de personajes por prefijo de nombre en todos los realms (índice en memoria)."""
+    if len(q.strip()) < 2:
+        raise HTTPException(status_code=400, detail='Búsqueda demasiado corta')
+    if limit < 1: limit = 1
+    if limit > 100: limit = 100
+    await character_index.ensure_built()
+    return {'items': character_index.search(q, limit=limit, realm_id=realm_id)}
+
+
+@router.post('/{realm_id}/batch')
+async def character_armory_batch(realm_id: int, payload: ArmoryBatchRequest):
+    """Armory de varios personajes del mismo realm (rosters de guild / equipos de arena).
+
+    Los personajes en cache no se consultan; el resto se carga con consultas IN (...) en una sola conexión.
+    """
+    guids = list(dict.fromkeys(int(g) for g in payload.guids))
+    if not guids:
+        raise HTTPException(status_code=400, detail='Lista de guids vacía')
+    if len(guids) > ARMORY_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f'Máximo {ARMORY_BATCH_MAX} guids por consulta')
+
+    characters = {}
+    missing = []
+    for guid in guids:
+        cached = _armory_cache.get((realm_id, guid))
+        if cached:
+            characters[guid] = cached[1]
+        else:
+            missing.append(guid)
+
+    realm_name = next((c.get('realm_name') for c in characters.values()), None)
+    if missing:
+        realm, pool = await _get_realm_pool(realm_id)
+        realm_name = realm.get('name')
+        try:
+            async with pool.connection() as conn:
+                async with conn.cursor(aiomysql.DictCursor) as cur:
+                    chars, eq_sets, teams, item_entries = await _load_armory_rows(cur, missing)
+        except Exception as e:
+            raise HTTPException(status_code=503, detail=f'Error consultando realm: {e}')
+        await _resolve_equipment_items([eq for sets in eq_sets.values() for eq in sets], item_entries)
+        for guid, character in chars.items():
+            _, data, _ = _cache_armory(realm, character, eq_sets.get(guid, []), teams.get(guid, []))
+            characters[guid] = data
+
+    return {
+        'realm_id': realm_id,
+        'realm_name': realm_name,
+        'characters': {str(g): characters[g] for g in guids if g in characters},
+        'not_found': [g for g in guids if g not in characters],
     }
+
+
+@router.get('/{realm_id}/{guid}')
+async def character_armory(realm_id: int, guid: int, request: Request):
+    # Cache hit => sin conexión al realm (y 304 si el cliente ya tiene la versión)
+    cached = _armory_cache.get((realm_id, guid))
+    if cached:
+        return _armory_response(request, *cached)
+
+    realm, pool = await _get_realm_pool(realm_id)
+    try:
+        async with pool.connection() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cur:
+                chars, eq_sets, teams, item_entries = await _load_armory_rows(cur, [guid])
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f'Error consultando realm: {e}')
+    character = chars.get(guid)
+    if not character:
+        raise HTTPException(status_code=404, detail='Personaje no encontrado')
+    equipment_sets = eq_sets.get(guid, [])
+    await _resolve_equipment_items(equipment_sets, item_entries)
+    etag, data, ttl = _cache_armory(realm, character, equipment_sets, teams.get(guid, []))
+    return _armory_response(request, etag, data, ttl)
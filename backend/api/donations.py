@@ -14,6 +14,7 @@ PAYPAL_API_BASE = os.getenv('PAYPAL_API_BASE', 'https://api-m.sandbox.paypal.com
 DONATION_CREDITS_RATE = int(os.getenv('DONATION_CREDITS_RATE', '100'))  # credits por 1 unidad monetaria
 DONATION_ALLOWED_CURRENCIES = set((os.getenv('DONATION_ALLOWED_CURRENCIES', 'USD,EUR').split(',')))
 PAYPAL_WEBHOOK_ID = os.getenv('PAYPAL_WEBHOOK_ID', '')  # para validación de firma (si se configura)
+PAYPAL_TOKEN_REFRESH_MARGIN = int(os.getenv('PAYPAL_TOKEN_REFRESH_MARGIN', '300'))  # segundos antes de expirar en que se renueva el token
 
 # ---- Bold Config ----
 BOLD_API_KEY = os.getenv('BOLD_API_KEY','')
@@ -84,22 +85,61 @@ class BoldWebhookResponse(BaseModel):
     status: str
 
 # ---------------- Utilities ----------------
+import asyncio
 import aiohttp
+from http_client import http_clients
+
+# token OAuth cacheado por proceso: {'token': str, 'expires_at': monotonic}
+_paypal_token = {'token': None, 'expires_at': 0.0}
+_paypal_token_lock = asyncio.Lock()
+
+def _paypal_cached_token() -> Optional[str]:
+    if _paypal_token['token'] and time.monotonic() < _paypal_token['expires_at']:
+        return _paypal_token['token']
+    return None
+
+def _paypal_invalidate_token(token: Optional[str]) -> None:
+    if token and _paypal_token['token'] == token:
+        _paypal_token['token'] = None
 
 async def _paypal_get_access_token() -> str:
+    """Access token de PayPal, reutilizado hasta PAYPAL_TOKEN_REFRESH_MARGIN segundos antes
+    de su `expires_in`. Las renovaciones concurrentes esperan a una sola petición."""
+    token = _paypal_cached_token()
+    if token:
+        return token
     if not PAYPAL_CLIENT_ID or not PAYPAL_CLIENT_SECRET:
         raise HTTPException(status_code=500, detail='PayPal no configurado')
-    auth = aiohttp.BasicAuth(PAYPAL_CLIENT_ID, PAYPAL_CLIENT_SECRET)
-    async with aiohttp.ClientSession() as session:
-        async with session.post(f"{PAYPAL_API_BASE}/v1/oauth2/token", data={'grant_type':'client_credentials'}, auth=auth) as resp:
+    async with _paypal_token_lock:
+        token = _paypal_cached_token()
+        if token:
+            return token
+        auth = aiohttp.BasicAuth(PAYPAL_CLIENT_ID, PAYPAL_CLIENT_SECRET)
+        async with http_clients.get('paypal').post(f"{PAYPAL_API_BASE}/v1/oauth2/token", data={'grant_type':'client_credentials'}, auth=auth) as resp:
             data = await resp.json()
             if resp.status >= 400:
                 raise HTTPException(status_code=500, detail=f'Error token PayPal: {data}')
-            return data.get('access_token')
+        expires_in = int(data.get('expires_in') or 0)
+        _paypal_token['token'] = data.get('access_token')
+        # margen acotado a la mitad de la vida del token por si PayPal emite tokens cortos
+        _paypal_token['expires_at'] = time.monotonic() + max(expires_in - min(PAYPAL_TOKEN_REFRESH_MARGIN, expires_in // 2), 0)
+        return _paypal_token['token']
+
+async def _paypal_post(path: str, error_detail: str, **kwargs) -> dict:
+    """POST autenticado a la API de PayPal; ante un 401 (token revocado) renueva el token y reintenta una vez."""
+    for attempt in range(2):
+        token = await _paypal_get_access_token()
+        headers = { 'Authorization': f'Bearer {token}', 'Content-Type': 'application/json' }
+        async with http_clients.get('paypal').post(f"{PAYPAL_API_BASE}{path}", headers=headers, **kwargs) as resp:
+            data = await resp.json()
+            if resp.status == 401 and attempt == 0:
+                _paypal_invalidate_token(token)
+                continue
+            if resp.status >= 400:
+                raise HTTPException(status_code=500, detail=f'{error_detail}: {data}')
+            return data
 
 async def _paypal_create_order(amount: float, currency: str, username: str):
-    token = await _paypal_get_access_token()
-    headers = { 'Authorization': f'Bearer {token}', 'Content-Type': 'application/json' }
     body = {
         'intent': 'CAPTURE',
         'purchase_units': [
@@ -113,22 +153,10 @@ async def _paypal_create_order(amount: float, currency: str, username: str):
             'user_action': 'PAY_NOW'
         }
     }
-    async with aiohttp.ClientSession() as session:
-        async with session.post(f"{PAYPAL_API_BASE}/v2/checkout/orders", headers=headers, json=body) as resp:
-            data = await resp.json()
-            if resp.status >= 400:
-                raise HTTPException(status_code=500, detail=f'Error creando orden PayPal: {data}')
-            return data
+    return await _paypal_post('/v2/checkout/orders', 'Error creando orden PayPal', json=body)
 
 async def _paypal_capture_order(order_id: str):
-    token = await _paypal_get_access_token()
-    headers = { 'Authorization': f'Bearer {token}', 'Content-Type': 'application/json' }
-    async with aiohttp.ClientSession() as session:
-        async with session.post(f"{PAYPAL_API_BASE}/v2/checkout/orders/{order_id}/capture", headers=headers) as resp:
-            data = await resp.json()
-            if resp.status >= 400:
-                raise HTTPException(status_code=500, detail=f'Error capturando orden PayPal: {data}')
-            return data
+    return await _paypal_post(f'/v2/checkout/orders/{order_id}/capture', 'Error capturando orden PayPal')
 
 # ---------------- Endpoints ----------------
 @router.post('/paypal/order', response_model=CreatePaypalOrderResponse)
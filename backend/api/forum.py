@@ -1,8 +1,16 @@
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
 from typing import Optional, List
+import datetime
 from api.auth import require_logged, require_admin, get_current_user
-from db import fetch_one, fetch_all, execute
+from db import fetch_one, fetch_all, execute, begin_transaction, release_connection, tx_execute, tx_fetch_all
+from forum_counters import topic_counters, reconcile_topics
+from forum_index import forum_index, recompute_category_stats
+from slugs import with_unique_slug
+from search import search_service
+from render import rendered_fields, ensure_rendered
+from view_counter import view_counter, views_subquery
+from config import FORUM_UNREAD_WINDOW_DAYS
 import re
 
 router = APIRouter(prefix="/forum", tags=["forum"])
@@ -33,6 +41,22 @@ class TopicModerate(BaseModel):
 class PostCreate(BaseModel):
     content: str
 
+class TopicRead(BaseModel):
+    last_post_id: Optional[int] = None
+
+class BulkTopics(BaseModel):
+    topic_ids: List[int]
+
+class BulkTopicsLock(BulkTopics):
+    locked: bool = True
+
+class BulkTopicsMove(BulkTopics):
+    category_id: int
+
+class BulkAuthorPosts(BaseModel):
+    username: str
+    include_topics: bool = False
+
 # ----------------- Helpers -----------------
 _slug_re = re.compile(r'[^a-z0-9]+')
 
@@ -44,15 +68,58 @@ def _slugify(text: str) -> str:
         s = 'cat'
     return s[:140]
 
-async def _unique_category_slug(base: str) -> str:
-    slug = base
-    idx = 1
-    while True:
-        row = await fetch_one('cms', 'SELECT id FROM forum_categories WHERE slug = %s', (slug,))
-        if not row:
-            return slug
-        slug = f"{base}-{idx}"
-        idx += 1
+TOPIC_COLUMNS = ('id, title, author_username, created_at, updated_at, last_post_at, posts_count, is_locked, is_pinned, '
+                 f"{views_subquery('topic', 'forum_topics.id')} AS views")
+# Posts embebidos en get_topic; el resto se pagina con cursor en list_posts
+TOPIC_POSTS_EMBED = 50
+
+def _topic_cursor(row: dict) -> str:
+    last = row.get('last_post_at') or row.get('created_at')
+    return f"{1 if row.get('is_pinned') else 0}:{last.strftime('%Y%m%d%H%M%S')}:{row.get('id')}"
+
+def _parse_topic_cursor(cursor: str) -> tuple:
+    try:
+        pinned, last, topic_id = cursor.split(':')
+        return int(pinned), datetime.datetime.strptime(last, '%Y%m%d%H%M%S'), int(topic_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail='Cursor inválido')
+
+async def _topics_page(category_id: int, page_size: int, cursor: Optional[str] = None) -> tuple[list, Optional[str]]:
+    """Página de topics (fijados primero, luego por actividad) usando keyset sobre
+    (is_pinned, last_post_at, id); usa idx_forum_topics_category_order."""
+    if cursor:
+        pinned, last, topic_id = _parse_topic_cursor(cursor)
+        # predicado expandido (no row constructor) para que MySQL haga range scan sobre el índice
+        rows = await fetch_all('cms', f'SELECT {TOPIC_COLUMNS} FROM forum_topics WHERE category_id = %s '
+                                      'AND (is_pinned < %s OR (is_pinned = %s AND (last_post_at < %s OR (last_post_at = %s AND id < %s)))) '
+                                      'ORDER BY is_pinned DESC, last_post_at DESC, id DESC LIMIT %s',
+                               (category_id, pinned, pinned, last, last, topic_id, page_size + 1))
+    else:
+        rows = await fetch_all('cms', f'SELECT {TOPIC_COLUMNS} FROM forum_topics WHERE category_id = %s ORDER BY is_pinned DESC, last_post_at DESC, id DESC LIMIT %s', (category_id, page_size + 1))
+    rows = list(rows or [])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    next_cursor = _topic_cursor(rows[-1]) if (has_more and rows) else None
+    return rows, next_cursor
+
+async def _posts_page(topic_id: int, page_size: int, cursor: Optional[int] = None) -> tuple[list, Optional[int]]:
+    """Página de posts en orden cronológico usando keyset (id > cursor)."""
+    rows = await fetch_all('cms', 'SELECT * FROM forum_posts WHERE topic_id = %s AND id > %s ORDER BY id ASC LIMIT %s', (topic_id, cursor or 0, page_size + 1))
+    rows = list(rows or [])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    next_cursor = rows[-1].get('id') if (has_more and rows) else None
+    await ensure_rendered('forum_posts', rows)
+    return rows, next_cursor
+
+# El HTML se genera al escribir (ver render.py)
+_INSERT_POST_SQL = 'INSERT INTO forum_posts (topic_id, author_username, content, content_html, content_hash, render_version) VALUES (%s,%s,%s,%s,%s,%s)'
+
+# Agregados por categoría (ver forum_index): se actualizan en la misma transacción que el post
+_CATEGORY_NEW_TOPIC_SQL = ('UPDATE forum_categories SET topics_count = topics_count + 1, posts_count = posts_count + 1, '
+                           'last_topic_id = %s, last_topic_title = %s, last_post_author = %s, last_post_at = CURRENT_TIMESTAMP WHERE id = %s')
+_CATEGORY_NEW_POST_SQL = ('UPDATE forum_categories SET posts_count = posts_count + 1, '
+                          'last_topic_id = %s, last_topic_title = %s, last_post_author = %s, last_post_at = CURRENT_TIMESTAMP WHERE id = %s')
 
 # ----------------- Category Endpoints -----------------
 @router.post('/categories', dependencies=[Depends(require_admin)])
@@ -60,14 +127,21 @@ async def create_category(payload: CategoryCreate):
     if not payload.name or len(payload.name.strip()) < 2:
         raise HTTPException(status_code=400, detail='Nombre demasiado corto')
     base = _slugify(payload.name)
-    slug = await _unique_category_slug(base)
     try:
-        _, last_id = await execute('cms', 'INSERT INTO forum_categories (name, slug, description, position) VALUES (%s,%s,%s,%s)', (payload.name.strip(), slug, payload.description, payload.position or 0))
+        _, last_id = await with_unique_slug('forum_categories', base, lambda slug: execute('cms', 'INSERT INTO forum_categories (name, slug, description, position) VALUES (%s,%s,%s,%s)', (
+            payload.name.strip(), slug, payload.description, payload.position or 0
+        )), first_suffix=1, max_len=140)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f'Error creando categoria: {e}')
     row = await fetch_one('cms', 'SELECT * FROM forum_categories WHERE id = %s', (last_id,))
+    await forum_index.refresh_categories([last_id])
     return row
 
+@router.get('/index')
+async def forum_home():
+    """Categorías con totales de topics/posts y último topic con actividad (desde memoria)."""
+    return { 'categories': await forum_index.get() }
+
 @router.get('/categories')
 async def list_categories():
     rows = await fetch_all('cms', 'SELECT * FROM forum_categories ORDER BY position ASC, id ASC')
@@ -96,6 +170,7 @@ async def update_category(category_id: int, payload: CategoryUpdate):
             await execute('cms', q, tuple(values))
         except Exception as e:
             raise HTTPException(status_code=500, detail=f'Error actualizando categoria: {e}')
+        await forum_index.refresh_categories([category_id])
     row = await fetch_one('cms', 'SELECT * FROM forum_categories WHERE id = %s', (category_id,))
     return row
 
@@ -108,6 +183,8 @@ async def delete_category(category_id: int):
         await execute('cms', 'DELETE FROM forum_categories WHERE id = %s', (category_id,))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f'Error eliminando categoria: {e}')
+    search_service.remove_category(category_id)
+    await forum_index.refresh_categories([category_id])
     return None
 
 # ----------------- Topic & Post Endpoints -----------------
@@ -120,37 +197,71 @@ async def create_topic(category_id: int, payload: TopicCreate, user: dict = Depe
         raise HTTPException(status_code=400, detail='Titulo demasiado corto')
     if not payload.content or len(payload.content.strip()) < 3:
         raise HTTPException(status_code=400, detail='Contenido demasiado corto')
+    # topic + primer post en una sola transacción (sin topics vacíos ni contadores desfasados)
+    conn, tx = await begin_transaction('cms')
     try:
-        _, topic_id = await execute('cms', 'INSERT INTO forum_topics (category_id, title, author_username, last_post_at, posts_count) VALUES (%s,%s,%s,CURRENT_TIMESTAMP,1)', (category_id, payload.title.strip(), user.get('username')))
-        await execute('cms', 'INSERT INTO forum_posts (topic_id, author_username, content) VALUES (%s,%s,%s)', (topic_id, user.get('username'), payload.content.strip()))
+        _, topic_id = await tx_execute(conn, 'INSERT INTO forum_topics (category_id, title, author_username, last_post_at, posts_count) VALUES (%s,%s,%s,CURRENT_TIMESTAMP,1)', (category_id, payload.title.strip(), user.get('username')))
+        _, post_id = await tx_execute(conn, _INSERT_POST_SQL, (topic_id, user.get('username'), payload.content.strip(), *rendered_fields(payload.content.strip())))
+        await tx_execute(conn, _CATEGORY_NEW_TOPIC_SQL, (topic_id, payload.title.strip(), user.get('username'), category_id))
+        await tx.commit()
     except Exception as e:
+        await tx.rollback()
+        await release_connection('cms', conn)
         raise HTTPException(status_code=500, detail=f'Error creando topic: {e}')
+    await release_connection('cms', conn)
+    await forum_index.refresh_categories([category_id])
     topic = await fetch_one('cms', 'SELECT * FROM forum_topics WHERE id = %s', (topic_id,))
+    search_service.index_topic(topic)
+    search_service.index_post({'id': post_id, 'topic_id': topic_id, 'author_username': user.get('username'), 'content': payload.content.strip()}, topic.get('title') if topic else None)
     return topic
 
 @router.get('/categories/{category_id}/topics')
-async def list_topics(category_id: int, page: int = 1, page_size: int = 20):
+async def list_topics(category_id: int, page: int = 1, page_size: int = 20, cursor: Optional[str] = None):
+    """Topics paginados. Con `cursor` (next_cursor de la página anterior) usa keyset y no
+    calcula el total; `page` se mantiene por compatibilidad (OFFSET + COUNT)."""
     if page < 1: page = 1
     if page_size < 1: page_size = 1
     if page_size > 100: page_size = 100
     cat = await fetch_one('cms', 'SELECT id FROM forum_categories WHERE id = %s', (category_id,))
     if not cat:
         raise HTTPException(status_code=404, detail='Categoria no encontrada')
+    if cursor:
+        rows, next_cursor = await _topics_page(category_id, page_size, cursor)
+        return { 'items': rows, 'pagination': { 'page_size': page_size, 'next_cursor': next_cursor } }
     total_row = await fetch_one('cms', 'SELECT COUNT(*) AS cnt FROM forum_topics WHERE category_id = %s', (category_id,))
     total = int(total_row.get('cnt')) if total_row else 0
-    offset = (page - 1) * page_size
-    rows = await fetch_all('cms', 'SELECT id, title, author_username, created_at, updated_at, last_post_at, posts_count, is_locked, is_pinned FROM forum_topics WHERE category_id = %s ORDER BY is_pinned DESC, last_post_at DESC, id DESC LIMIT %s OFFSET %s', (category_id, page_size, offset))
-    return { 'items': rows or [], 'pagination': { 'page': page, 'page_size': page_size, 'total': total } }
+    if page == 1:
+        rows, next_cursor = await _topics_page(category_id, page_size)
+    else:
+        offset = (page - 1) * page_size
+        rows = await fetch_all('cms', f'SELECT {TOPIC_COLUMNS} FROM forum_topics WHERE category_id = %s ORDER BY is_pinned DESC, last_post_at DESC, id DESC LIMIT %s OFFSET %s', (category_id, page_size, offset))
+        rows = list(rows or [])
+        next_cursor = _topic_cursor(rows[-1]) if (rows and offset + len(rows) < total) else None
+    return { 'items': rows, 'pagination': { 'page': page, 'page_size': page_size, 'total': total, 'next_cursor': next_cursor } }
 
 @router.get('/topics/{topic_id}')
 async def get_topic(topic_id: int):
-    topic = await fetch_one('cms', 'SELECT * FROM forum_topics WHERE id = %s', (topic_id,))
+    topic = await fetch_one('cms', f"SELECT *, {views_subquery('topic', 'forum_topics.id')} AS views FROM forum_topics WHERE id = %s", (topic_id,))
     if not topic:
         raise HTTPException(status_code=404, detail='Topic no encontrado')
-    posts = await fetch_all('cms', 'SELECT * FROM forum_posts WHERE topic_id = %s ORDER BY id ASC', (topic_id,))
-    topic['posts'] = posts or []
+    view_counter.add('topic', topic_id)
+    topic['views'] = int(topic.get('views') or 0) + view_counter.pending('topic', topic_id)
+    posts, next_cursor = await _posts_page(topic_id, TOPIC_POSTS_EMBED)
+    topic['posts'] = posts
+    topic['posts_next_cursor'] = next_cursor
     return topic
 
+@router.get('/topics/{topic_id}/posts')
+async def list_posts(topic_id: int, cursor: Optional[int] = None, page_size: int = 50):
+    """Posts del topic a partir de `cursor` (id del último post recibido)."""
+    if page_size < 1: page_size = 1
+    if page_size > 100: page_size = 100
+    topic = await fetch_one('cms', 'SELECT id FROM forum_topics WHERE id = %s', (topic_id,))
+    if not topic:
+        raise HTTPException(status_code=404, detail='Topic no encontrado')
+    posts, next_cursor = await _posts_page(topic_id, page_size, cursor)
+    return { 'items': posts, 'pagination': { 'page_size': page_size, 'next_cursor': next_cursor } }
+
 
 @router.patch('/topics/{topic_id}')
 async def edit_topic(topic_id: int, payload: TopicUpdate, user: dict = Depends(require_logged)):
@@ -165,21 +276,31 @@ async def edit_topic(topic_id: int, payload: TopicUpdate, user: dict = Depends(r
             raise HTTPException(status_code=400, detail='Titulo demasiado corto')
         try:
             await execute('cms', 'UPDATE forum_topics SET title = %s WHERE id = %s', (payload.title.strip(), topic_id))
+            await execute('cms', 'UPDATE forum_categories SET last_topic_title = %s WHERE last_topic_id = %s', (payload.title.strip(), topic_id))
         except Exception as e:
             raise HTTPException(status_code=500, detail=f'Error editando topic: {e}')
     row = await fetch_one('cms', 'SELECT * FROM forum_topics WHERE id = %s', (topic_id,))
+    if row and payload.title is not None:
+        await forum_index.refresh_categories([row.get('category_id')])
+    search_service.index_topic(row)
     return row
 
 
 @router.delete('/topics/{topic_id}', status_code=204, dependencies=[Depends(require_admin)])
 async def delete_topic(topic_id: int):
-    topic = await fetch_one('cms', 'SELECT id FROM forum_topics WHERE id = %s', (topic_id,))
+    topic = await fetch_one('cms', 'SELECT id, category_id FROM forum_topics WHERE id = %s', (topic_id,))
     if not topic:
         raise HTTPException(status_code=404, detail='Topic no encontrado')
+    await topic_counters.flush()
     try:
         await execute('cms', 'DELETE FROM forum_topics WHERE id = %s', (topic_id,))
+        await execute('cms', "DELETE FROM content_views WHERE kind = 'topic' AND content_id = %s", (topic_id,))
+        await recompute_category_stats([topic.get('category_id')])
     except Exception as e:
         raise HTTPException(status_code=500, detail=f'Error eliminando topic: {e}')
+    search_service.remove_topic(topic_id)
+    view_counter.discard('topic', topic_id)
+    await forum_index.refresh_categories([topic.get('category_id')])
     return None
 
 @router.post('/topics/{topic_id}/posts')
@@ -191,28 +312,56 @@ async def add_post(topic_id: int, payload: PostCreate, user: dict = Depends(requ
         raise HTTPException(status_code=403, detail='Topic bloqueado')
     if not payload.content or len(payload.content.strip()) < 2:
         raise HTTPException(status_code=400, detail='Contenido demasiado corto')
-    try:
-        _, post_id = await execute('cms', 'INSERT INTO forum_posts (topic_id, author_username, content) VALUES (%s,%s,%s)', (topic_id, user.get('username'), payload.content.strip()))
-        await execute('cms', 'UPDATE forum_topics SET posts_count = posts_count + 1, last_post_at = CURRENT_TIMESTAMP WHERE id = %s', (topic_id,))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f'Error agregando post: {e}')
-    post = await fetch_one('cms', 'SELECT * FROM forum_posts WHERE id = %s', (post_id,))
+    if topic_counters.write_behind:
+        try:
+            _, post_id = await execute('cms', _INSERT_POST_SQL, (topic_id, user.get('username'), payload.content.strip(), *rendered_fields(payload.content.strip())))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f'Error agregando post: {e}')
+        post = await fetch_one('cms', 'SELECT * FROM forum_posts WHERE id = %s', (post_id,))
+        topic_counters.add(topic_id, 1, post.get('created_at') if post else None,
+                           category_id=topic.get('category_id'), topic_title=topic.get('title'), author=user.get('username'))
+    else:
+        conn, tx = await begin_transaction('cms')
+        try:
+            _, post_id = await tx_execute(conn, _INSERT_POST_SQL, (topic_id, user.get('username'), payload.content.strip(), *rendered_fields(payload.content.strip())))
+            await tx_execute(conn, 'UPDATE forum_topics SET posts_count = posts_count + 1, last_post_at = CURRENT_TIMESTAMP WHERE id = %s', (topic_id,))
+            await tx_execute(conn, _CATEGORY_NEW_POST_SQL, (topic_id, topic.get('title'), user.get('username'), topic.get('category_id')))
+            await tx.commit()
+        except Exception as e:
+            await tx.rollback()
+            await release_connection('cms', conn)
+            raise HTTPException(status_code=500, detail=f'Error agregando post: {e}')
+        await release_connection('cms', conn)
+        await forum_index.refresh_categories([topic.get('category_id')])
+        post = await fetch_one('cms', 'SELECT * FROM forum_posts WHERE id = %s', (post_id,))
+    search_service.index_post(post, topic.get('title'))
     return post
 
 @router.delete('/posts/{post_id}', status_code=204)
 async def delete_post(post_id: int, user: dict = Depends(require_logged)):
-    post = await fetch_one('cms', 'SELECT topic_id, author_username FROM forum_posts WHERE id = %s', (post_id,))
+    post = await fetch_one('cms', 'SELECT p.topic_id, p.author_username, t.category_id FROM forum_posts p JOIN forum_topics t ON t.id = p.topic_id WHERE p.id = %s', (post_id,))
     if not post:
         raise HTTPException(status_code=404, detail='Post no encontrado')
     is_admin = int(user.get('role', 1)) >= 2
     if post.get('author_username') != user.get('username') and not is_admin:
         raise HTTPException(status_code=403, detail='No autorizado')
+    # borrar el último post cambia last_post_at del topic y el último post de la categoría:
+    # se recalculan desde forum_posts en la misma transacción (tras aplicar los deltas write-behind)
+    await topic_counters.flush()
+    conn, tx = await begin_transaction('cms')
     try:
-        await execute('cms', 'DELETE FROM forum_posts WHERE id = %s', (post_id,))
-        # decrement posts_count (safe guard: not below zero)
-        await execute('cms', 'UPDATE forum_topics SET posts_count = GREATEST(posts_count - 1,0) WHERE id = %s', (post.get('topic_id'),))
+        rowcount, _ = await tx_execute(conn, 'DELETE FROM forum_posts WHERE id = %s', (post_id,))
+        if rowcount:
+            await reconcile_topics([post.get('topic_id')], conn=conn)
+            await recompute_category_stats([post.get('category_id')], conn=conn)
+        await tx.commit()
     except Exception as e:
+        await tx.rollback()
+        await release_connection('cms', conn)
         raise HTTPException(status_code=500, detail=f'Error eliminando post: {e}')
+    await release_connection('cms', conn)
+    await forum_index.refresh_categories([post.get('category_id')])
+    search_service.remove_post(post_id)
     return None
 
 @router.post('/topics/{topic_id}/lock', dependencies=[Depends(require_admin)])
@@ -264,14 +413,255 @@ async def unpin_topic(topic_id: int):
 
 @router.post('/topics/{topic_id}/move/{new_category_id}', dependencies=[Depends(require_admin)])
 async def move_topic(topic_id: int, new_category_id: int):
-    topic = await fetch_one('cms', 'SELECT id FROM forum_topics WHERE id = %s', (topic_id,))
+    topic = await fetch_one('cms', 'SELECT id, category_id FROM forum_topics WHERE id = %s', (topic_id,))
     if not topic:
         raise HTTPException(status_code=404, detail='Topic no encontrado')
     cat = await fetch_one('cms', 'SELECT id FROM forum_categories WHERE id = %s', (new_category_id,))
     if not cat:
         raise HTTPException(status_code=404, detail='Categoria destino no existe')
+    await topic_counters.flush()
     try:
         await execute('cms', 'UPDATE forum_topics SET category_id = %s WHERE id = %s', (new_category_id, topic_id))
+        await recompute_category_stats([topic.get('category_id'), new_category_id])
     except Exception as e:
         raise HTTPException(status_code=500, detail=f'Error moviendo topic: {e}')
+    search_service.set_topic_category(topic_id, new_category_id)
+    await forum_index.refresh_categories([topic.get('category_id'), new_category_id])
     return { 'ok': True }
+
+
+# ----------------- Maintenance -----------------
+@router.get('/admin/counters', dependencies=[Depends(require_admin)])
+async def counters_stats():
+    return topic_counters.stats()
+
+@router.post('/admin/counters/reconcile', dependencies=[Depends(require_admin)])
+async def reconcile_counters():
+    """Recalcula posts_count y last_post_at de todos los topics desde forum_posts."""
+    try:
+        updated = await topic_counters.reconcile()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f'Error reconciliando contadores: {e}')
+    return { 'ok': True, 'updated': updated }
+
+
+# ----------------- Read state -----------------
+# Un topic está no leído si su último post (MAX(id) por idx_forum_posts_topic_id) es posterior
+# a la marca de su categoría, a la marca global (category_id 0) y a la lectura propia del topic.
+# Se compara por id de post: dos posts en el mismo segundo no se confunden.
+_UNREAD_SQL = (
+    'SELECT * FROM ('
+    'SELECT t.id, t.category_id, t.title, t.author_username, t.last_post_at, t.posts_count, t.is_locked, t.is_pinned, '
+    'r.last_read_post_id, (SELECT MAX(p.id) FROM forum_posts p WHERE p.topic_id = t.id) AS last_post_id, '
+    'GREATEST(%s, COALESCE(rc.read_before_post_id, 0), COALESCE(r.last_read_post_id, 0)) AS read_post_id '
+    'FROM forum_topics t '
+    'LEFT JOIN forum_read_categories rc ON rc.username = %s AND rc.category_id = t.category_id '
+    'LEFT JOIN forum_read_topics r ON r.username = %s AND r.topic_id = t.id '
+    # el rango por tiempo solo acota el recorrido del índice; la marca global usa >= por la resolución al segundo
+    'WHERE t.last_post_at > NOW() - INTERVAL %s DAY AND t.last_post_at >= %s '
+    ') u WHERE u.last_post_id > u.read_post_id '
+    'ORDER BY u.last_post_at DESC, u.id DESC LIMIT %s'
+)
+
+async def _global_mark(username: str) -> tuple:
+    row = await fetch_one('cms', 'SELECT read_before, read_before_post_id FROM forum_read_categories WHERE username = %s AND category_id = 0', (username,))
+    if not row:
+        return datetime.datetime(1970, 1, 2), 0
+    return row.get('read_before') or datetime.datetime(1970, 1, 2), int(row.get('read_before_post_id') or 0)
+
+@router.get('/unread')
+async def unread_topics(limit: int = 50, user: dict = Depends(require_logged)):
+    """Topics con actividad que el usuario no ha leído, más recientes primero.
+
+    El rango sobre idx_forum_topics_last_post_at (desde la marca global o la ventana
+    FORUM_UNREAD_WINDOW_DAYS) acota el recorrido; las marcas se resuelven por PK.
+    """
+    if limit < 1: limit = 1
+    if limit > 200: limit = 200
+    username = user.get('username')
+    read_before, read_post_id = await _global_mark(username)
+    rows = await fetch_all('cms', _UNREAD_SQL, (read_post_id, username, username, FORUM_UNREAD_WINDOW_DAYS, read_before, limit)) or []
+    by_category: dict = {}
+    for r in rows:
+        r.pop('read_post_id', None)
+        by_category[r['category_id']] = by_category.get(r['category_id'], 0) + 1
+    return { 'items': rows, 'by_category': by_category, 'has_more': len(rows) >= limit }
+
+@router.post('/topics/{topic_id}/read')
+async def mark_topic_read(topic_id: int, payload: Optional[TopicRead] = None, user: dict = Depends(require_logged)):
+    """Marca el topic leído hasta `last_post_id` (por defecto, hasta el último post)."""
+    topic = await fetch_one('cms', 'SELECT id FROM forum_topics WHERE id = %s', (topic_id,))
+    if not topic:
+        raise HTTPException(status_code=404, detail='Topic no encontrado')
+    last_post_id = payload.last_post_id if payload else None
+    if last_post_id:
+        post = await fetch_one('cms', 'SELECT id FROM forum_posts WHERE id = %s AND topic_id = %s', (last_post_id, topic_id))
+        if not post:
+            raise HTTPException(status_code=404, detail='Post no encontrado')
+    else:
+        post = await fetch_one('cms', 'SELECT MAX(id) AS id FROM forum_posts WHERE topic_id = %s', (topic_id,))
+        last_post_id = (post or {}).get('id') or 0
+    if not last_post_id:
+        return { 'ok': True }
+    try:
+        # nunca retrocede: solo avanza la lectura del topic
+        await execute('cms', 'INSERT INTO forum_read_topics (username, topic_id, last_read_post_id) VALUES (%s,%s,%s) '
+                             'ON DUPLICATE KEY UPDATE last_read_post_id = GREATEST(last_read_post_id, VALUES(last_read_post_id)), read_at = CURRENT_TIMESTAMP',
+                      (user.get('username'), topic_id, last_post_id))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f'Error marcando topic leído: {e}')
+    return { 'ok': True, 'last_read_post_id': last_post_id }
+
+async def _set_read_watermark(username: str, category_id: int) -> None:
+    await execute('cms', 'INSERT INTO forum_read_categories (username, category_id, read_before, read_before_post_id) '
+                         'SELECT %s, %s, CURRENT_TIMESTAMP, COALESCE(MAX(id), 0) FROM forum_posts '
+                         'ON DUPLICATE KEY UPDATE read_before = VALUES(read_before), read_before_post_id = VALUES(read_before_post_id)', (username, category_id))
+
+@router.post('/categories/{category_id}/read')
+async def mark_category_read(category_id: int, user: dict = Depends(require_logged)):
+    """Marca todos los topics de la categoría como leídos (una fila de marca; se descartan
+    las lecturas por topic que quedan cubiertas)."""
+    cat = await fetch_one('cms', 'SELECT id FROM forum_categories WHERE id = %s', (category_id,))
+    if not cat:
+        raise HTTPException(status_code=404, detail='Categoria no encontrada')
+    username = user.get('username')
+    try:
+        await _set_read_watermark(username, category_id)
+        await execute('cms', 'DELETE r FROM forum_read_topics r JOIN forum_topics t ON t.id = r.topic_id WHERE r.username = %s AND t.category_id = %s', (username, category_id))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f'Error marcando categoria leída: {e}')
+    return { 'ok': True }
+
+@router.post('/read')
+async def mark_all_read(user: dict = Depends(require_logged)):
+    """Marca todo el foro como leído (marca global category_id 0)."""
+    username = user.get('username')
+    try:
+        await _set_read_watermark(username, 0)
+        await execute('cms', 'DELETE FROM forum_read_categories WHERE username = %s AND category_id <> 0', (username,))
+        await execute('cms', 'DELETE FROM forum_read_topics WHERE username = %s', (username,))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f'Error marcando foro leído: {e}')
+    return { 'ok': True }
+
+
+# ----------------- Bulk moderation -----------------
+BULK_MAX_IDS = 500
+
+def _bulk_ids(ids: List[int]) -> List[int]:
+    unique = sorted({int(i) for i in ids})
+    if not unique:
+        raise HTTPException(status_code=400, detail='Lista de ids vacía')
+    if len(unique) > BULK_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f'Máximo {BULK_MAX_IDS} ids por petición')
+    return unique
+
+def _in(ids: List[int]) -> str:
+    return ','.join(['%s'] * len(ids))
+
+@router.post('/admin/bulk/topics/lock', dependencies=[Depends(require_admin)])
+async def bulk_lock_topics(payload: BulkTopicsLock):
+    ids = _bulk_ids(payload.topic_ids)
+    try:
+        updated, _ = await execute('cms', f'UPDATE forum_topics SET is_locked = %s WHERE id IN ({_in(ids)})', (1 if payload.locked else 0, *ids))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f'Error bloqueando topics: {e}')
+    return { 'ok': True, 'updated': updated }
+
+@router.post('/admin/bulk/topics/move', dependencies=[Depends(require_admin)])
+async def bulk_move_topics(payload: BulkTopicsMove):
+    ids = _bulk_ids(payload.topic_ids)
+    cat = await fetch_one('cms', 'SELECT id FROM forum_categories WHERE id = %s', (payload.category_id,))
+    if not cat:
+        raise HTTPException(status_code=404, detail='Categoria destino no existe')
+    # aplica los deltas write-behind pendientes antes de recalcular
+    await topic_counters.flush()
+    conn, tx = await begin_transaction('cms')
+    try:
+        rows = await tx_fetch_all(conn, f'SELECT DISTINCT category_id FROM forum_topics WHERE id IN ({_in(ids)})', tuple(ids))
+        categories = {r['category_id'] for r in rows} | {payload.category_id}
+        moved, _ = await tx_execute(conn, f'UPDATE forum_topics SET category_id = %s WHERE id IN ({_in(ids)})', (payload.category_id, *ids))
+        await recompute_category_stats(categories, conn=conn)
+        await tx.commit()
+    except Exception as e:
+        await tx.rollback()
+        await release_connection('cms', conn)
+        raise HTTPException(status_code=500, detail=f'Error moviendo topics: {e}')
+    await release_connection('cms', conn)
+    for topic_id in ids:
+        search_service.set_topic_category(topic_id, payload.category_id)
+    await forum_index.refresh_categories(categories)
+    return { 'ok': True, 'moved': moved }
+
+@router.post('/admin/bulk/topics/delete', dependencies=[Depends(require_admin)])
+async def bulk_delete_topics(payload: BulkTopics):
+    ids = _bulk_ids(payload.topic_ids)
+    # aplica los deltas write-behind pendientes antes de recalcular
+    await topic_counters.flush()
+    conn, tx = await begin_transaction('cms')
+    try:
+        rows = await tx_fetch_all(conn, f'SELECT DISTINCT category_id FROM forum_topics WHERE id IN ({_in(ids)})', tuple(ids))
+        categories = {r['category_id'] for r in rows}
+        # los posts y lecturas caen por ON DELETE CASCADE
+        deleted, _ = await tx_execute(conn, f'DELETE FROM forum_topics WHERE id IN ({_in(ids)})', tuple(ids))
+        await tx_execute(conn, f"DELETE FROM content_views WHERE kind = 'topic' AND content_id IN ({_in(ids)})", tuple(ids))
+        await recompute_category_stats(categories, conn=conn)
+        await tx.commit()
+    except Exception as e:
+        await tx.rollback()
+        await release_connection('cms', conn)
+        raise HTTPException(status_code=500, detail=f'Error eliminando topics: {e}')
+    await release_connection('cms', conn)
+    for topic_id in ids:
+        search_service.remove_topic(topic_id)
+        view_counter.discard('topic', topic_id)
+    await forum_index.refresh_categories(categories)
+    return { 'ok': True, 'deleted': deleted }
+
+@router.post('/admin/bulk/posts/delete-by-author', dependencies=[Depends(require_admin)])
+async def bulk_delete_author_posts(payload: BulkAuthorPosts):
+    """Borra todos los posts de un autor (y opcionalmente sus topics) y reconcilia una
+    sola vez los contadores de los topics y categorías afectados."""
+    username = payload.username.strip()
+    if not username:
+        raise HTTPException(status_code=400, detail='Usuario requerido')
+    # aplica los deltas write-behind pendientes antes de recalcular
+    await topic_counters.flush()
+    conn, tx = await begin_transaction('cms')
+    try:
+        # se bloquean y borran exactamente las filas leídas: un post creado entre medias no queda
+        # borrado sin reconciliar ni fuera del índice de búsqueda
+        posts = await tx_fetch_all(conn, 'SELECT p.id, p.topic_id, t.category_id FROM forum_posts p JOIN forum_topics t ON t.id = p.topic_id WHERE p.author_username = %s FOR UPDATE', (username,))
+        topics = []
+        if payload.include_topics:
+            topics = await tx_fetch_all(conn, 'SELECT id, category_id FROM forum_topics WHERE author_username = %s FOR UPDATE', (username,))
+        topic_ids = {r['topic_id'] for r in posts} - {r['id'] for r in topics}
+        categories = {r['category_id'] for r in posts} | {r['category_id'] for r in topics}
+        deleted_posts = 0
+        post_ids = [r['id'] for r in posts]
+        for i in range(0, len(post_ids), BULK_MAX_IDS):
+            chunk = post_ids[i:i + BULK_MAX_IDS]
+            n, _ = await tx_execute(conn, f'DELETE FROM forum_posts WHERE id IN ({_in(chunk)})', tuple(chunk))
+            deleted_posts += n
+        deleted_topics = 0
+        topic_del = [r['id'] for r in topics]
+        for i in range(0, len(topic_del), BULK_MAX_IDS):
+            chunk = topic_del[i:i + BULK_MAX_IDS]
+            n, _ = await tx_execute(conn, f'DELETE FROM forum_topics WHERE id IN ({_in(chunk)})', tuple(chunk))
+            deleted_topics += n
+            await tx_execute(conn, f"DELETE FROM content_views WHERE kind = 'topic' AND content_id IN ({_in(chunk)})", tuple(chunk))
+        await reconcile_topics(topic_ids, conn=conn)
+        await recompute_category_stats(categories, conn=conn)
+        await tx.commit()
+    except Exception as e:
+        await tx.rollback()
+        await release_connection('cms', conn)
+        raise HTTPException(status_code=500, detail=f'Error eliminando posts: {e}')
+    await release_connection('cms', conn)
+    for r in posts:
+        search_service.remove_post(r['id'])
+    for r in topics:
+        search_service.remove_topic(r['id'])
+        view_counter.discard('topic', r['id'])
+    await forum_index.refresh_categories(categories)
+    return { 'ok': True, 'deleted_posts': deleted_posts, 'deleted_topics': deleted_topics }
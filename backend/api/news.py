@@ -1,10 +1,19 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
 from pydantic import BaseModel
 from typing import Optional, List, Any
 import re
 import datetime
-
-from db import fetch_one, fetch_all, execute
+import hashlib
+from email.utils import format_datetime, parsedate_to_datetime
+from xml.sax.saxutils import escape
+
+from db import fetch_one, fetch_all, execute, begin_transaction, release_connection, tx_execute
+from cache import VersionedCache
+from slugs import with_unique_slug
+from search import search_service
+from view_counter import view_counter, views_subquery
+from render import RENDERER_VERSION, content_hash, rendered_fields, ensure_rendered
+from config import NEWS_CACHE_TTL, NEWS_CACHE_CHECK_INTERVAL, SITE_URL, SITE_NAME, NEWS_FEED_SIZE
 from api.auth import get_current_user, require_logged, require_admin  # reuse session + role validation
 
 router = APIRouter()
@@ -37,6 +46,7 @@ def _serialize_comment(row: dict) -> dict:
         'id': row.get('id'),
         'author': row.get('author_username'),
         'content': row.get('content'),
+        'content_html': row.get('content_html'),
         'created_at': row.get('created_at').isoformat() if row.get('created_at') else None
     }
 
@@ -44,7 +54,7 @@ def _serialize_comment(row: dict) -> dict:
 SLUG_SAFE_RE = re.compile(r'[^a-z0-9\-]+')
 
 
-async def _generate_unique_slug(title: str) -> str:
+def _slug_base(title: str) -> str:
     base = title.strip().lower()
     # replace spaces with dashes
     base = re.sub(r'\s+', '-', base)
@@ -54,16 +64,7 @@ async def _generate_unique_slug(title: str) -> str:
     base = re.sub(r'-{2,}', '-', base).strip('-')
     if not base:
         base = 'noticia'
-
-    slug = base
-    idx = 1
-    # ensure uniqueness
-    while True:
-        row = await fetch_one('cms', 'SELECT id FROM news WHERE slug = %s', (slug,))
-        if not row:
-            return slug
-        idx += 1
-        slug = f"{base}-{idx}"
+    return base
 
 
 def _serialize_news(row: dict) -> dict:
@@ -75,18 +76,38 @@ def _serialize_news(row: dict) -> dict:
         'slug': row.get('slug'),
         'summary': row.get('summary'),
         'content': row.get('content'),
+        'content_html': row.get('content_html'),
         'realm_id': row.get('realm_id'),
         'author': row.get('author_username'),
         'is_published': bool(row.get('is_published')),
         'published_at': row.get('published_at').isoformat() if row.get('published_at') else None,
         'created_at': row.get('created_at').isoformat() if row.get('created_at') else None,
         'updated_at': row.get('updated_at').isoformat() if row.get('updated_at') else None,
-        'priority': row.get('priority')
+        'priority': row.get('priority'),
+        'comments_count': int(row.get('comments_count') or 0),
+        'views': int(row.get('views') or 0)
     }
 
 
+# (realm_id, page, page_size, lite) -> respuesta de list_news; ('feed', fmt, realm_id) -> (etag, updated, bytes)
+_news_cache = VersionedCache('news', maxsize=512, ttl=NEWS_CACHE_TTL, check_interval=NEWS_CACHE_CHECK_INTERVAL)
+
+# Proyección ligera para listados: sin content (summary cae a un extracto si no existe)
+NEWS_LITE_COLUMNS = ('id, title, slug, COALESCE(summary, LEFT(content, 200)) AS summary, realm_id, author_username, '
+                     'is_published, published_at, created_at, updated_at, priority, comments_count, '
+                     f"{views_subquery('news', 'news.id')} AS views")
+NEWS_FULL_COLUMNS = f"*, {views_subquery('news', 'news.id')} AS views"
+
+# Comentarios embebidos en el detalle; el resto se pagina con cursor en list_comments
+NEWS_COMMENTS_EMBED = 20
+
+
+async def _invalidate_news_feed():
+    await _news_cache.bump()
+
+
 @router.get('/news')
-async def list_news(page: int = 1, page_size: int = 10, realm_id: Optional[int] = None):
+async def list_news(page: int = 1, page_size: int = 10, realm_id: Optional[int] = None, lite: bool = False):
     if page < 1:
         page = 1
     if page_size < 1:
@@ -95,6 +116,12 @@ async def list_news(page: int = 1, page_size: int = 10, realm_id: Optional[int]
     if page_size > MAX_PAGE:
         page_size = MAX_PAGE
 
+    await _news_cache.sync()
+    cache_key = (realm_id, page, page_size, lite)
+    cached = _news_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     params: list[Any] = []
     where = 'WHERE is_published = 1'
     if realm_id is not None:
@@ -106,9 +133,148 @@ async def list_news(page: int = 1, page_size: int = 10, realm_id: Optional[int]
     total = int(row.get('cnt') if row else 0)
     offset = (page - 1) * page_size
 
-    rows = await fetch_all('cms', f'SELECT * FROM news {where} ORDER BY priority DESC, published_at DESC, id DESC LIMIT %s OFFSET %s', (*params, page_size, offset))
+    columns = NEWS_LITE_COLUMNS if lite else NEWS_FULL_COLUMNS
+    rows = await fetch_all('cms', f'SELECT {columns} FROM news {where} ORDER BY priority DESC, published_at DESC, id DESC LIMIT %s OFFSET %s', (*params, page_size, offset))
+    if not lite:
+        await ensure_rendered('news', rows or [])
     items = [_serialize_news(r) for r in (rows or [])]
-    return {'items': items, 'pagination': {'page': page, 'page_size': page_size, 'total': total}}
+    if lite:
+        for it in items:
+            it.pop('content', None)
+            it.pop('content_html', None)
+    result = {'items': items, 'pagination': {'page': page, 'page_size': page_size, 'total': total}}
+    _news_cache.set(cache_key, result)
+    return result
+
+FEED_MEDIA_TYPES = {
+    'rss': 'application/rss+xml; charset=utf-8',
+    'atom': 'application/atom+xml; charset=utf-8',
+}
+
+
+def _utc(dt: Optional[datetime.datetime]) -> datetime.datetime:
+    # MySQL devuelve DATETIME naive; se asume UTC
+    if dt is None:
+        return datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.astimezone(datetime.timezone.utc)
+
+
+def _news_link(row: dict) -> str:
+    return f"{SITE_URL}/news?slug={row.get('slug')}"
+
+
+def _render_rss(rows: list, updated: datetime.datetime) -> str:
+    items = []
+    for r in rows:
+        items.append(
+            '<item>'
+            f"<title>{escape(r.get('title') or '')}</title>"
+            f'<link>{escape(_news_link(r))}</link>'
+            f"<guid isPermaLink=\"false\">news-{r.get('id')}</guid>"
+            f"<pubDate>{format_datetime(_utc(r.get('published_at') or r.get('created_at')))}</pubDate>"
+            f"<description>{escape(r.get('summary') or '')}</description>"
+            '</item>'
+        )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<rss version="2.0"><channel>'
+        f'<title>{escape(SITE_NAME)}</title>'
+        f'<link>{escape(SITE_URL)}/news</link>'
+        f'<description>{escape(SITE_NAME)} - Noticias</description>'
+        f'<lastBuildDate>{format_datetime(updated)}</lastBuildDate>'
+        + ''.join(items) +
+        '</channel></rss>'
+    )
+
+
+def _render_atom(rows: list, updated: datetime.datetime) -> str:
+    entries = []
+    for r in rows:
+        published = _utc(r.get('published_at') or r.get('created_at'))
+        entries.append(
+            '<entry>'
+            f"<title>{escape(r.get('title') or '')}</title>"
+            f'<link href="{escape(_news_link(r))}"/>'
+            f"<id>{escape(SITE_URL)}/news/{r.get('id')}</id>"
+            f'<published>{published.isoformat()}</published>'
+            f"<updated>{_utc(r.get('updated_at') or published).isoformat()}</updated>"
+            f"<author><name>{escape(r.get('author_username') or '')}</name></author>"
+            f"<summary>{escape(r.get('summary') or '')}</summary>"
+            '</entry>'
+        )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<feed xmlns="http://www.w3.org/2005/Atom">'
+        f'<title>{escape(SITE_NAME)}</title>'
+        f'<link href="{escape(SITE_URL)}/news"/>'
+        f'<id>{escape(SITE_URL)}/news</id>'
+        f'<updated>{updated.isoformat()}</updated>'
+        + ''.join(entries) +
+        '</feed>'
+    )
+
+
+async def _build_feed(fmt: str, realm_id: Optional[int]) -> tuple:
+    params: list[Any] = []
+    where = 'WHERE is_published = 1'
+    if realm_id is not None:
+        where += ' AND (realm_id = %s OR realm_id IS NULL)'
+        params.append(realm_id)
+    rows = await fetch_all('cms', f'SELECT {NEWS_LITE_COLUMNS} FROM news {where} ORDER BY published_at DESC, id DESC LIMIT %s', (*params, NEWS_FEED_SIZE)) or []
+    updated = max((_utc(r.get('updated_at') or r.get('published_at') or r.get('created_at')) for r in rows), default=_utc(None))
+    # un borrado o despublicación no deja rastro en las filas restantes: la hora de la última
+    # invalidación (cache_versions 'news') hace que Last-Modified solo avance
+    try:
+        bumped = await fetch_one('cms', 'SELECT UNIX_TIMESTAMP(updated_at) AS ts FROM cache_versions WHERE name = %s', (_news_cache.name,))
+    except Exception:
+        bumped = None
+    if bumped and bumped.get('ts') is not None:
+        updated = max(updated, datetime.datetime.fromtimestamp(float(bumped['ts']), tz=datetime.timezone.utc))
+    updated = updated.replace(microsecond=0)
+    body = (_render_rss if fmt == 'rss' else _render_atom)(rows, updated).encode('utf-8')
+    etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+    return etag, updated, body
+
+
+def _not_modified(request: Request, etag: str, updated: datetime.datetime) -> bool:
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match:
+        # If-None-Match tiene prioridad sobre If-Modified-Since (RFC 9110)
+        candidates = [c.strip() for c in if_none_match.split(',')]
+        return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since:
+        try:
+            return updated <= _utc(parsedate_to_datetime(if_modified_since))
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+@router.get('/news/feed')
+async def news_feed(request: Request, format: str = 'rss', realm_id: Optional[int] = None):
+    """Feed RSS 2.0 / Atom de las últimas noticias publicadas.
+
+    Los bytes renderizados se guardan en la cache de noticias (se invalida al publicar,
+    editar o borrar), así que un sondeo sin cambios responde 304 sin consultar MySQL.
+    """
+    fmt = format.lower()
+    if fmt not in FEED_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail='Formato no soportado (rss|atom)')
+    await _news_cache.sync()
+    cache_key = ('feed', fmt, realm_id)
+    entry = _news_cache.get(cache_key)
+    if entry is None:
+        entry = await _build_feed(fmt, realm_id)
+        _news_cache.set(cache_key, entry)
+    etag, updated, body = entry
+    headers = {'ETag': etag, 'Last-Modified': format_datetime(updated, usegmt=True), 'Cache-Control': 'public, max-age=60'}
+    if _not_modified(request, etag, updated):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=FEED_MEDIA_TYPES[fmt], headers=headers)
+
 
 @router.get('/news/admin', dependencies=[Depends(require_admin)])
 async def admin_list_news(page: int = 1, page_size: int = 20, realm_id: Optional[int] = None, include_unpublished: bool = True):
@@ -124,7 +290,8 @@ async def admin_list_news(page: int = 1, page_size: int = 20, realm_id: Optional
     total_row = await fetch_one('cms', f'SELECT COUNT(*) AS cnt FROM news{where}', tuple(params))
     total = int(total_row.get('cnt') if total_row else 0)
     offset = (page - 1) * page_size
-    rows = await fetch_all('cms', f'SELECT * FROM news{where} ORDER BY priority DESC, created_at DESC, id DESC LIMIT %s OFFSET %s', (*params, page_size, offset))
+    rows = await fetch_all('cms', f'SELECT {NEWS_FULL_COLUMNS} FROM news{where} ORDER BY priority DESC, created_at DESC, id DESC LIMIT %s OFFSET %s', (*params, page_size, offset))
+    await ensure_rendered('news', rows or [])
     items = [_serialize_news(r) for r in (rows or [])]
     return { 'items': items, 'pagination': { 'page': page, 'page_size': page_size, 'total': total } }
 
@@ -133,19 +300,21 @@ async def admin_list_news(page: int = 1, page_size: int = 20, realm_id: Optional
 async def get_news(id_or_slug: str):
     row = None
     if id_or_slug.isdigit():
-        row = await fetch_one('cms', 'SELECT * FROM news WHERE id = %s', (int(id_or_slug),))
+        row = await fetch_one('cms', f'SELECT {NEWS_FULL_COLUMNS} FROM news WHERE id = %s', (int(id_or_slug),))
     if not row:
-        row = await fetch_one('cms', 'SELECT * FROM news WHERE slug = %s', (id_or_slug,))
+        row = await fetch_one('cms', f'SELECT {NEWS_FULL_COLUMNS} FROM news WHERE slug = %s', (id_or_slug,))
     if not row:
         raise HTTPException(status_code=404, detail='Noticia no encontrada')
     # hide unpublished
     if not row.get('is_published'):
         raise HTTPException(status_code=404, detail='Noticia no encontrada')
-    comments = await fetch_all('cms', 'SELECT * FROM news_comments WHERE news_id = %s ORDER BY id DESC', (row.get('id'),))
-    serialized_comments = [_serialize_comment(c) for c in (comments or [])]
+    await ensure_rendered('news', [row])
+    view_counter.add('news', row['id'])
+    row['views'] = int(row.get('views') or 0) + view_counter.pending('news', row['id'])
+    comments, next_cursor = await _comments_page(row.get('id'), NEWS_COMMENTS_EMBED)
     data = _serialize_news(row)
-    data['comments'] = serialized_comments
-    data['comments_count'] = len(serialized_comments)
+    data['comments'] = comments
+    data['comments_next_cursor'] = next_cursor
     return data
 
 
@@ -157,19 +326,23 @@ async def create_news(payload: NewsCreate, user: dict = Depends(require_logged))
     if len(payload.content.strip()) < 5:
         raise HTTPException(status_code=400, detail='Contenido demasiado corto')
 
-    slug = await _generate_unique_slug(payload.title)
     is_pub = 1 if payload.publish else 0
     published_at = datetime.datetime.utcnow() if is_pub else None
 
-    q = ('INSERT INTO news (title, slug, summary, content, realm_id, author_username, is_published, published_at, priority) '
-         'VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s)')
-    params = (payload.title, slug, payload.summary, payload.content, payload.realm_id, user.get('username'), is_pub, published_at, payload.priority)
+    q = ('INSERT INTO news (title, slug, summary, content, content_html, content_hash, render_version, realm_id, author_username, is_published, published_at, priority) '
+         'VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)')
+    rendered = rendered_fields(payload.content)
     try:
-        _, last_id = await execute('cms', q, params)
+        _, last_id = await with_unique_slug('news', _slug_base(payload.title), lambda slug: execute('cms', q, (
+            payload.title, slug, payload.summary, payload.content, *rendered, payload.realm_id, user.get('username'), is_pub, published_at, payload.priority
+        )), max_len=220)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f'Error creando noticia: {e}')
 
+    if is_pub:
+        await _invalidate_news_feed()
     row = await fetch_one('cms', 'SELECT * FROM news WHERE id = %s', (last_id,))
+    search_service.index_news(row)
     return _serialize_news(row)
 
 
@@ -181,20 +354,30 @@ async def update_news(news_id: int, payload: NewsUpdate, user: dict = Depends(re
 
     fields = []
     params: list[Any] = []
+    slug_index = None
 
     # Title => maybe slug change
     if payload.title is not None:
         if len(payload.title.strip()) < 3:
             raise HTTPException(status_code=400, detail='Título demasiado corto')
-        new_slug = await _generate_unique_slug(payload.title) if payload.title != row.get('title') else row.get('slug')
-        fields.extend(['title = %s', 'slug = %s'])
-        params.extend([payload.title, new_slug])
+        fields.append('title = %s')
+        params.append(payload.title)
+        if payload.title != row.get('title'):
+            fields.append('slug = %s')
+            slug_index = len(params)
+            params.append(None)  # se asigna al escribir
 
     if payload.content is not None:
         if len(payload.content.strip()) < 5:
             raise HTTPException(status_code=400, detail='Contenido demasiado corto')
         fields.append('content = %s')
         params.append(payload.content)
+        # mismo hash y versión => el HTML guardado sigue siendo válido
+        if content_hash(payload.content) != row.get('content_hash') or row.get('render_version') != RENDERER_VERSION:
+            fields.append('content_html = %s')
+            fields.append('content_hash = %s')
+            fields.append('render_version = %s')
+            params.extend(rendered_fields(payload.content))
 
     if payload.summary is not None:
         fields.append('summary = %s')
@@ -223,29 +406,64 @@ async def update_news(news_id: int, payload: NewsUpdate, user: dict = Depends(re
     set_clause = ', '.join(fields)
     params.append(news_id)
     q = f'UPDATE news SET {set_clause} WHERE id = %s'
+
+    async def _write(slug=None):
+        if slug_index is not None:
+            params[slug_index] = slug
+        return await execute('cms', q, tuple(params))
+
     try:
-        await execute('cms', q, tuple(params))
+        if slug_index is not None:
+            await with_unique_slug('news', _slug_base(payload.title), _write, max_len=220)
+        else:
+            await _write()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f'Error actualizando noticia: {e}')
+    # solo afecta al listado público si estaba o queda publicada
+    if row.get('is_published') or payload.publish:
+        await _invalidate_news_feed()
 
     row2 = await fetch_one('cms', 'SELECT * FROM news WHERE id = %s', (news_id,))
+    search_service.index_news(row2)
     return _serialize_news(row2)
 
 
 @router.delete('/news/{news_id}', status_code=204)
 async def delete_news(news_id: int, user: dict = Depends(require_admin)):
-    row = await fetch_one('cms', 'SELECT id FROM news WHERE id = %s', (news_id,))
+    row = await fetch_one('cms', 'SELECT id, is_published FROM news WHERE id = %s', (news_id,))
     if not row:
         raise HTTPException(status_code=404, detail='Noticia no encontrada')
     try:
         await execute('cms', 'DELETE FROM news WHERE id = %s', (news_id,))
+        await execute('cms', "DELETE FROM content_views WHERE kind = 'news' AND content_id = %s", (news_id,))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f'Error eliminando noticia: {e}')
+    if row.get('is_published'):
+        await _invalidate_news_feed()
+    search_service.remove_news(news_id)
+    view_counter.discard('news', news_id)
     return None
 
 
 # -------- Comments --------
 
+async def _comments_page(news_id: int, page_size: int, cursor: Optional[int] = None) -> tuple[list, Optional[int]]:
+    """Página de comentarios más recientes primero usando keyset (id < cursor).
+
+    Devuelve (items, next_cursor); next_cursor es None cuando no hay más.
+    """
+    if cursor:
+        rows = await fetch_all('cms', 'SELECT * FROM news_comments WHERE news_id = %s AND id < %s ORDER BY id DESC LIMIT %s', (news_id, cursor, page_size + 1))
+    else:
+        rows = await fetch_all('cms', 'SELECT * FROM news_comments WHERE news_id = %s ORDER BY id DESC LIMIT %s', (news_id, page_size + 1))
+    rows = list(rows or [])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    next_cursor = rows[-1].get('id') if (has_more and rows) else None
+    await ensure_rendered('news_comments', rows)
+    return [_serialize_comment(r) for r in rows], next_cursor
+
+
 @router.post('/news/{news_id}/comments', status_code=201)
 async def add_comment(news_id: int, payload: CommentCreate, user: dict = Depends(require_logged)):
     if len(payload.content.strip()) < 2:
@@ -254,30 +472,46 @@ async def add_comment(news_id: int, payload: CommentCreate, user: dict = Depends
     news_row = await fetch_one('cms', 'SELECT id, is_published FROM news WHERE id = %s', (news_id,))
     if not news_row or not news_row.get('is_published'):
         raise HTTPException(status_code=404, detail='Noticia no encontrada')
+    conn, tx = await begin_transaction('cms')
     try:
-        _, last_id = await execute('cms', 'INSERT INTO news_comments (news_id, author_username, content) VALUES (%s,%s,%s)', (news_id, user.get('username'), payload.content))
+        _, last_id = await tx_execute(conn, 'INSERT INTO news_comments (news_id, author_username, content, content_html, content_hash, render_version) VALUES (%s,%s,%s,%s,%s,%s)',
+                                      (news_id, user.get('username'), payload.content, *rendered_fields(payload.content)))
+        await tx_execute(conn, 'UPDATE news SET comments_count = comments_count + 1 WHERE id = %s', (news_id,))
+        await tx.commit()
     except Exception as e:
+        await tx.rollback()
+        await release_connection('cms', conn)
         raise HTTPException(status_code=500, detail=f'Error creando comentario: {e}')
+    await release_connection('cms', conn)
+    # el listado cacheado incluye comments_count
+    await _invalidate_news_feed()
     row = await fetch_one('cms', 'SELECT * FROM news_comments WHERE id = %s', (last_id,))
     return _serialize_comment(row)
 
 
 @router.get('/news/{news_id}/comments')
-async def list_comments(news_id: int, page: int = 1, page_size: int = 30):
+async def list_comments(news_id: int, page: int = 1, page_size: int = 30, cursor: Optional[int] = None):
+    """Comentarios paginados. Con `cursor` (id del último comentario recibido) usa keyset;
+    `page` se mantiene por compatibilidad (OFFSET) para page > 1 sin cursor."""
     if page < 1: page = 1
     if page_size < 1: page_size = 1
     if page_size > 100: page_size = 100
     # ensure news exists & is published
-    news_row = await fetch_one('cms', 'SELECT id, is_published FROM news WHERE id = %s', (news_id,))
+    news_row = await fetch_one('cms', 'SELECT id, is_published, comments_count FROM news WHERE id = %s', (news_id,))
     if not news_row or not news_row.get('is_published'):
         raise HTTPException(status_code=404, detail='Noticia no encontrada')
-    total_row = await fetch_one('cms', 'SELECT COUNT(*) AS cnt FROM news_comments WHERE news_id = %s', (news_id,))
-    total = int(total_row.get('cnt') if total_row else 0)
-    offset = (page - 1) * page_size
-    rows = await fetch_all('cms', 'SELECT * FROM news_comments WHERE news_id = %s ORDER BY id DESC LIMIT %s OFFSET %s', (news_id, page_size, offset))
+    total = int(news_row.get('comments_count') or 0)
+    if cursor is not None or page == 1:
+        items, next_cursor = await _comments_page(news_id, page_size, cursor)
+    else:
+        offset = (page - 1) * page_size
+        rows = await fetch_all('cms', 'SELECT * FROM news_comments WHERE news_id = %s ORDER BY id DESC LIMIT %s OFFSET %s', (news_id, page_size, offset))
+        await ensure_rendered('news_comments', rows or [])
+        items = [_serialize_comment(r) for r in (rows or [])]
+        next_cursor = items[-1]['id'] if (items and offset + len(items) < total) else None
     return {
-        'items': [_serialize_comment(r) for r in (rows or [])],
-        'pagination': {'page': page, 'page_size': page_size, 'total': total}
+        'items': items,
+        'pagination': {'page': page, 'page_size': page_size, 'total': total, 'next_cursor': next_cursor}
     }
 
 
@@ -290,8 +524,17 @@ async def delete_comment(news_id: int, comment_id: int, user: dict = Depends(req
     is_admin = int(user.get('role', 1)) >= 2
     if (row.get('author_username') != user.get('username')) and not is_admin:
         raise HTTPException(status_code=403, detail='No autorizado')
+    conn, tx = await begin_transaction('cms')
     try:
-        await execute('cms', 'DELETE FROM news_comments WHERE id = %s', (comment_id,))
+        deleted, _ = await tx_execute(conn, 'DELETE FROM news_comments WHERE id = %s AND news_id = %s', (comment_id, news_id))
+        if deleted:
+            await tx_execute(conn, 'UPDATE news SET comments_count = GREATEST(CAST(comments_count AS SIGNED) - 1, 0) WHERE id = %s', (news_id,))
+        await tx.commit()
     except Exception as e:
+        await tx.rollback()
+        await release_connection('cms', conn)
         raise HTTPException(status_code=500, detail=f'Error eliminando comentario: {e}')
+    await release_connection('cms', conn)
+    if deleted:
+        await _invalidate_news_feed()
     return None
@@ -1,8 +1,7 @@
 from fastapi import APIRouter, HTTPException
-from db import fetch_one, fetch_all
-import aiomysql
+from db import fetch_one
+from account_characters import get_account_characters
 import hashlib
-import asyncio
 
 router = APIRouter(prefix="/profile", tags=["profile"])
 
@@ -31,53 +30,10 @@ async def get_profile(username: str):
     email = acct.get('email') or ''
     avatar = gravatar_url(email)
 
-    # realms
     try:
-        realms = await fetch_all('cms', 'SELECT realm_id, name, char_db_host, char_db_port, char_db_user, char_db_password, char_db_name FROM realms')
+        characters_accum = await get_account_characters(account_id)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f'Error obteniendo realms: {e}')
-
-    characters_accum = []
-
-    async def fetch_chars(realm):
-        host = realm.get('char_db_host')
-        user = realm.get('char_db_user')
-        dbname = realm.get('char_db_name')
-        port = realm.get('char_db_port') or 3306
-        password = realm.get('char_db_password') or ''
-        realm_id = realm.get('realm_id')
-        realm_name = realm.get('name') or f'Realm {realm_id}'
-        if not host or not user or not dbname:
-            return []
-        try:
-            conn = await aiomysql.connect(host=host, port=int(port), user=user, password=password, db=dbname)
-            async with conn.cursor(aiomysql.DictCursor) as cur:
-                await cur.execute('SELECT name, level, race, class, gender FROM characters WHERE account = %s', (account_id,))
-                rows = await cur.fetchall()
-            conn.close()
-            await conn.wait_closed()
-        except Exception:
-            return []
-        out = []
-        if rows:
-            for r in rows:
-                out.append({
-                    'realm_id': realm_id,
-                    'realm_name': realm_name,
-                    'name': r.get('name'),
-                    'level': int(r.get('level') or 0),
-                    'race': int(r.get('race') or 0),
-                    'class': int(r.get('class') or 0),
-                    'gender': int(r.get('gender') or 0)
-                })
-        return out
-
-    if realms:
-        tasks = [fetch_chars(r) for r in realms]
-        results = await asyncio.gather(*tasks)
-        for chunk in results:
-            if chunk:
-                characters_accum.extend(chunk)
+        raise HTTPException(status_code=500, detail=f'Error obteniendo personajes: {e}')
 
     return {
         'username': username,
@@ -0,0 +1,28 @@
+from fastapi import APIRouter, HTTPException
+from typing import Optional
+
+from search import search_service, DOC_TYPES
+
+router = APIRouter(prefix="/search", tags=["search"])
+
+
+@router.get('')
+async def search(q: str, type: Optional[str] = None, page: int = 1, page_size: int = 20):
+    """Búsqueda en noticias publicadas y foro. `type`: news | topic | post | forum (topic+post)."""
+    if len(q.strip()) < 2:
+        raise HTTPException(status_code=400, detail='Búsqueda demasiado corta')
+    if page < 1: page = 1
+    if page_size < 1: page_size = 1
+    if page_size > 50: page_size = 50
+    if type is None:
+        types = DOC_TYPES
+    elif type == 'forum':
+        types = ('topic', 'post')
+    elif type in DOC_TYPES:
+        types = (type,)
+    else:
+        raise HTTPException(status_code=400, detail='Tipo inválido')
+    try:
+        return await search_service.search(q.strip(), types, page=page, page_size=page_size)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f'Error en búsqueda: {e}')
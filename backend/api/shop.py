@@ -3,9 +3,13 @@ from pydantic import BaseModel
 from typing import Optional
 from api.auth import require_logged, require_admin, get_current_user
 from db import fetch_one, fetch_all, execute, db_pools, begin_transaction, release_connection, tx_execute, tx_fetch_one
+from slugs import with_unique_slug
+from shop_catalog import shop_catalog
+from shop_limits import exceeded_limits, record_purchase
+from account_characters import get_account_characters, get_realm_characters, invalidate as invalidate_account_characters
 from config import get_soap_realm_config  # (ya no se usa como fallback; mantenido si se requiere más adelante)
-import aiohttp
-import asyncio
+from soap_delivery import soap_delivery, enqueue_delivery, purchase_items as load_purchase_items
+import aiomysql
 import re
 
 router = APIRouter(prefix="/shop", tags=["shop"])
@@ -20,16 +24,6 @@ def _slugify(text: str) -> str:
         s = 'cat'
     return s[:140]
 
-async def _unique_slug(table: str, slug: str) -> str:
-    base = slug
-    idx = 1
-    while True:
-        row = await fetch_one('cms', f'SELECT id FROM {table} WHERE slug = %s', (slug,))
-        if not row:
-            return slug
-        slug = f"{base}-{idx}"
-        idx += 1
-
 # ---------------- Models -----------------
 class CategoryCreate(BaseModel):
     name: str
@@ -77,18 +71,19 @@ class PurchaseRequest(BaseModel):
 async def create_category(payload: CategoryCreate):
     if not payload.name or len(payload.name.strip()) < 2:
         raise HTTPException(status_code=400, detail='Nombre inválido')
-    slug = await _unique_slug('shop_categories', _slugify(payload.name))
     try:
-        _, last_id = await execute('cms', 'INSERT INTO shop_categories (name, slug, description, position) VALUES (%s,%s,%s,%s)', (payload.name.strip(), slug, payload.description, payload.position or 0))
+        _, last_id = await with_unique_slug('shop_categories', _slugify(payload.name), lambda slug: execute('cms', 'INSERT INTO shop_categories (name, slug, description, position) VALUES (%s,%s,%s,%s)', (
+            payload.name.strip(), slug, payload.description, payload.position or 0
+        )), first_suffix=1, max_len=140)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f'Error creando categoria: {e}')
+    await shop_catalog.invalidate()
     row = await fetch_one('cms', 'SELECT * FROM shop_categories WHERE id = %s', (last_id,))
     return row
 
 @router.get('/categories')
 async def list_categories():
-    rows = await fetch_all('cms', 'SELECT * FROM shop_categories ORDER BY position ASC, id ASC')
-    return rows or []
+    return await shop_catalog.categories()
 
 @router.patch('/categories/{category_id}', dependencies=[Depends(require_admin)])
 async def update_category(category_id: int, payload: CategoryUpdate):
@@ -110,6 +105,7 @@ async def update_category(category_id: int, payload: CategoryUpdate):
             await execute('cms', q, tuple(values))
         except Exception as e:
             raise HTTPException(status_code=500, detail=f'Error actualizando categoria: {e}')
+        await shop_catalog.invalidate()
     row = await fetch_one('cms', 'SELECT * FROM shop_categories WHERE id = %s', (category_id,))
     return row
 
@@ -122,6 +118,7 @@ async def delete_category(category_id: int):
         await execute('cms', 'DELETE FROM shop_categories WHERE id = %s', (category_id,))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f'Error eliminando categoria: {e}')
+    await shop_catalog.invalidate()
     return None
 
 # ---------------- Items ------------------
@@ -141,20 +138,13 @@ async def create_item(payload: ItemCreate):
         ))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f'Error creando item: {e}')
+    await shop_catalog.invalidate()
     row = await fetch_one('cms', 'SELECT * FROM shop_items WHERE id = %s', (last_id,))
     return row
 
 @router.get('/items')
 async def list_items(category_id: Optional[int] = None, realm_id: Optional[int] = None):
-    clauses = ['is_enabled = 1']
-    params = []
-    if category_id is not None:
-        clauses.append('category_id = %s'); params.append(category_id)
-    if realm_id is not None:
-        clauses.append('(realm_id IS NULL OR realm_id = %s)'); params.append(realm_id)
-    where = ' AND '.join(clauses)
-    rows = await fetch_all('cms', f'SELECT * FROM shop_items WHERE {where} ORDER BY id DESC', tuple(params))
-    return rows or []
+    return await shop_catalog.items(category_id, realm_id)
 
 # --------------- Realms & Characters helper endpoints ---------------
 @router.get('/realms')
@@ -164,13 +154,13 @@ async def list_realms():
 
 
 @router.get('/realms/{realm_id}/characters')
-async def list_characters(realm_id: int, user: dict = Depends(require_logged)):
+async def list_characters(realm_id: int, refresh: bool = False, user: dict = Depends(require_logged)):
     auth_acct = await fetch_one('auth', 'SELECT id FROM account WHERE username = %s', (user.get('username'),))
     if not auth_acct:
         return []
     account_id = auth_acct.get('id')
-    chars = await fetch_all('characters', 'SELECT guid, name, race, class, level FROM characters WHERE account = %s', (account_id,))
-    return chars or []
+    chars = await get_realm_characters(account_id, realm_id, refresh=refresh)
+    return [{'guid': c['guid'], 'name': c['name'], 'race': c['race'], 'class': c['class'], 'level': c['level']} for c in chars]
 
 @router.patch('/items/{item_id}', dependencies=[Depends(require_admin)])
 async def update_item(item_id: int, payload: ItemUpdate):
@@ -203,6 +193,7 @@ async def update_item(item_id: int, payload: ItemUpdate):
             await execute('cms', q, tuple(values))
         except Exception as e:
             raise HTTPException(status_code=500, detail=f'Error actualizando item: {e}')
+        await shop_catalog.invalidate()
     row = await fetch_one('cms', 'SELECT * FROM shop_items WHERE id = %s', (item_id,))
     return row
 
@@ -215,15 +206,38 @@ async def delete_item(item_id: int):
         await execute('cms', 'DELETE FROM shop_items WHERE id = %s', (item_id,))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f'Error eliminando item: {e}')
+    await shop_catalog.invalidate()
     return None
 
 # --------------- Purchase ----------------
-async def _check_limit(username: str, item_id: int, limit: Optional[int]) -> bool:
-    if not limit:
-        return True
-    row = await fetch_one('cms', 'SELECT COUNT(*) AS cnt FROM shop_purchases WHERE username = %s AND item_id = %s', (username, item_id))
-    bought = int(row.get('cnt') or 0) if row else 0
-    return bought < limit
+async def _find_realm_character(realm_id: Optional[int], account_id: int, guid: Optional[int] = None, name: Optional[str] = None) -> Optional[dict]:
+    """Busca un personaje de la cuenta en la DB characters del realm con una sola consulta indexada (guid o name).
+
+    Sin realm seleccionado se usa el pool global 'characters' (instalaciones de un solo realm).
+    """
+    if guid:
+        q, params = 'SELECT guid, name FROM characters WHERE guid = %s AND account = %s', (guid, account_id)
+    else:
+        q, params = 'SELECT guid, name FROM characters WHERE name = %s AND account = %s', (name.strip(), account_id)
+    if realm_id is None:
+        return await fetch_one('characters', q, params)
+    realm = await fetch_one('cms', 'SELECT realm_id, name, char_db_host, char_db_port, char_db_user, char_db_password, char_db_name FROM realms WHERE realm_id = %s', (realm_id,))
+    if not realm:
+        raise HTTPException(status_code=400, detail='Realm inválido')
+    try:
+        pool = await db_pools.get_realm_pool(realm)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f'No se pudo conectar al realm: {e}')
+    if pool is None:
+        raise HTTPException(status_code=503, detail='Realm sin datos de conexión')
+    async with pool.connection() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cur:
+            await cur.execute(q, params)
+            row = await cur.fetchone()
+    if row:
+        # la cache de la cuenta quedó desactualizada
+        invalidate_account_characters(account_id)
+    return row
 
 @router.post('/purchase')
 async def purchase(payload: PurchaseRequest, user: dict = Depends(require_logged)):
@@ -236,11 +250,9 @@ async def purchase(payload: PurchaseRequest, user: dict = Depends(require_logged
         ids = [it.get('shop_item_id') for it in payload.items if it.get('shop_item_id')]
         if not ids:
             raise HTTPException(status_code=400, detail='Items inválidos')
-        # cargar todos
-        placeholders = ','.join(['%s'] * len(ids))
-        rows = await fetch_all('cms', f'SELECT * FROM shop_items WHERE id IN ({placeholders}) AND is_enabled = 1', tuple(ids)) or []
-        items_map = {r['id']: r for r in rows}
-        if len(items_map) != len(ids):
+        # cargar todos (desde el catálogo en memoria: solo items habilitados)
+        items_map = await shop_catalog.get_items(ids)
+        if len(items_map) != len(set(ids)):
             raise HTTPException(status_code=400, detail='Algún item no existe o está deshabilitado')
         for raw in payload.items:
             sid = raw.get('shop_item_id')
@@ -263,7 +275,7 @@ async def purchase(payload: PurchaseRequest, user: dict = Depends(require_logged
     else:
         if not payload.item_id:
             raise HTTPException(status_code=400, detail='Debe especificar item(s)')
-        item = await fetch_one('cms', 'SELECT * FROM shop_items WHERE id = %s AND is_enabled = 1', (payload.item_id,))
+        item = (await shop_catalog.get_items([payload.item_id])).get(int(payload.item_id))
         if not item:
             raise HTTPException(status_code=404, detail='Item no disponible')
         item_realm = item.get('realm_id')
@@ -275,10 +287,13 @@ async def purchase(payload: PurchaseRequest, user: dict = Depends(require_logged
         ir = it['shop_item'].get('realm_id')
         if ir is not None and selected_realm and ir != selected_realm:
             raise HTTPException(status_code=400, detail='Realm inválido para un item de la lista')
-    # limit per account
+    # unidades por item del carrito (límite por cuenta; se valida dentro de la transacción)
+    cart = {}
+    limits = {}
     for it in multi_items:
-        if not await _check_limit(username, it['shop_item'].get('id'), it['shop_item'].get('limit_per_account')):
-            raise HTTPException(status_code=400, detail=f'Límite alcanzado para item {it['shop_item'].get('id')}')
+        sid = int(it['shop_item'].get('id'))
+        cart[sid] = cart.get(sid, 0) + it['quantity']
+        limits[sid] = it['shop_item'].get('limit_per_account')
     # fetch user balances
     acct = await fetch_one('cms', 'SELECT credits, vote_points FROM account WHERE username = %s', (username,))
     if not acct:
@@ -301,11 +316,18 @@ async def purchase(payload: PurchaseRequest, user: dict = Depends(require_logged
         if not auth_acct:
             raise HTTPException(status_code=400, detail='Cuenta auth no encontrada')
         account_id = auth_acct.get('id')
-        character = await fetch_one('characters', 'SELECT guid, name FROM characters WHERE guid = %s AND account = %s', (char_guid, account_id)) if char_guid else None
+        # primero desde cache (solo personajes del realm seleccionado); si no aparece
+        # (p.ej. personaje recién creado) una consulta indexada en la DB del realm
+        chars = await get_account_characters(account_id)
+        candidates = [c for c in chars if c['realm_id'] == selected_realm or c['realm_id'] is None]
+        if char_guid:
+            character = next((c for c in candidates if c['guid'] == int(char_guid)), None)
+        else:
+            character = next((c for c in candidates if (c['name'] or '').lower() == char_name.strip().lower()), None)
+        if not character:
+            character = await _find_realm_character(selected_realm, account_id, guid=char_guid, name=char_name)
         if char_guid and not character:
             raise HTTPException(status_code=400, detail='Personaje no válido')
-        if not character and char_name:
-            character = await fetch_one('characters', 'SELECT guid, name FROM characters WHERE name = %s AND account = %s', (char_name, account_id))
         if not character:
             raise HTTPException(status_code=400, detail='Personaje no encontrado')
         char_guid = character.get('guid')
@@ -321,6 +343,10 @@ async def purchase(payload: PurchaseRequest, user: dict = Depends(require_logged
         vp_tx = int(acct_tx.get('vote_points') or 0)
         if price_vp > vp_tx or price_cr > credits_tx:
             raise HTTPException(status_code=400, detail='Fondos insuficientes')
+        # limit per account: una consulta para todo el carrito; el FOR UPDATE de la cuenta serializa compras concurrentes
+        exceeded = await exceeded_limits(username, cart, limits, conn=conn)
+        if exceeded:
+            raise HTTPException(status_code=400, detail=f'Límite alcanzado para item {exceeded[0]}')
         if price_vp > 0:
             upd_vp = await tx_execute(conn, 'UPDATE account SET vote_points = vote_points - %s WHERE username = %s', (price_vp, username))
         if price_cr > 0:
@@ -330,6 +356,9 @@ async def purchase(payload: PurchaseRequest, user: dict = Depends(require_logged
         # insertar items
         for it in multi_items:
             await tx_execute(conn, 'INSERT INTO shop_purchase_items (purchase_id, shop_item_id, world_item_entry, quantity) VALUES (%s,%s,%s,%s)', (pid, it['shop_item'].get('id'), it['shop_item'].get('world_item_entry'), it['quantity']))
+        await record_purchase(username, cart, limits, conn)
+        # el job de entrega se confirma junto con la compra (no se pierde si el worker reinicia)
+        job_id = await enqueue_delivery(pid, selected_realm, conn=conn)
         await tx.commit()
     except HTTPException as he:
         await tx.rollback()
@@ -340,13 +369,11 @@ async def purchase(payload: PurchaseRequest, user: dict = Depends(require_logged
         await release_connection('cms', conn)
         raise HTTPException(status_code=500, detail=f'Error transacción compra: {e}')
     await release_connection('cms', conn)
-    # TODO: Envío via SOAP (pendiente de implementar cuando se definan credenciales)
+    # Envío SOAP por la cola de entregas (no bloquea la respuesta al usuario)
+    soap_delivery.notify()
     purchase_row = await fetch_one('cms', 'SELECT * FROM shop_purchases WHERE id = %s', (pid,))
     purchase_items = await fetch_all('cms', 'SELECT * FROM shop_purchase_items WHERE purchase_id = %s', (pid,))
-
-    # Intento de envío SOAP en background (no bloquea la respuesta al usuario)
-    asyncio.create_task(_deliver_purchase_via_soap(purchase_row, purchase_items))
-    return {'ok': True, 'purchase': purchase_row, 'items': purchase_items, 'soap_dispatched': True}
+    return {'ok': True, 'purchase': purchase_row, 'items': purchase_items, 'soap_dispatched': True, 'delivery_job_id': job_id}
 
 
 # --------------- Purchases listing ---------------
@@ -387,142 +414,35 @@ async def resend_purchase(purchase_id: int, force: bool = False, user: dict = De
         raise HTTPException(status_code=403, detail='No autorizado')
     if purchase.get('sent_via_soap') and not force:
         return {'ok': True, 'already_sent': True, 'forced': False}
-    purchase_items = await fetch_all('cms', 'SELECT * FROM shop_purchase_items WHERE purchase_id = %s', (purchase_id,)) or []
-    if not purchase_items:
-        # compat: intento legacy single-item
-        if purchase.get('item_id'):
-            legacy_item = await fetch_one('cms', 'SELECT id AS shop_item_id, world_item_entry FROM shop_items WHERE id = %s', (purchase.get('item_id'),))
-            if legacy_item:
-                purchase_items = [{'world_item_entry': legacy_item.get('world_item_entry'), 'quantity': 1}]
-        if not purchase_items:
-            raise HTTPException(status_code=400, detail='Compra sin items asociados')
-    # Disparo async
-    asyncio.create_task(_deliver_purchase_via_soap(purchase, purchase_items))
-    return {'ok': True, 'queued': True, 'forced': force}
-
-
-# --------------- SOAP Delivery ---------------
-async def _deliver_purchase_via_soap(purchase_row: dict, purchase_items: list):
-    """Envía el item al personaje por SOAP.
-
-    Estrategia mínima: usar comando 'send items' a la cuenta (requiere personaje => futuro: seleccionar personaje en payload).
-    Ahora solo marca sent_via_soap=0/1 y guarda respuesta o error.
-    """
-    if not purchase_row:
-        return
-    realm_id = purchase_row.get('realm_id')
-    soap_cfg = await _load_realm_soap_config(realm_id)
-    if not soap_cfg or not soap_cfg.get('enabled'):
-        await _update_purchase_soap(purchase_row['id'], False, 'SOAP deshabilitado o config ausente')
-        return
-    # FUTURO: obtener personaje destino. Por ahora se deja pendiente.
-    # Sin personaje no podemos realmente usar 'send items <player>'.
-    # Simulamos un comando placeholder que se registraría en logs del core si existiera.
-    # Construcción de comando real 'send items': requiere personaje (name), asunto y cuerpo.
-    character_name = purchase_row.get('character_name') or ''
-    if not character_name:
-        await _update_purchase_soap(purchase_row['id'], False, 'Sin personaje destino')
-        return
-    subject = 'Compra Tienda'
-    body = f"Gracias por tu compra, {character_name}!"
-    # Por ahora solo un item, stack 1
-    # Construir stacks basado en world_item_entry y quantity (similar a PHP)
-    # 1) Agrupar por entry
-    entry_counts = {}
-    for it in purchase_items:
-        entry = it.get('world_item_entry')
-        qty = int(it.get('quantity') or 1)
-        entry_counts[entry] = entry_counts.get(entry, 0) + qty
-    # 2) Obtener stack size desde world DB (si disponible) -> fallback 1
-    stacks = []  # lista de (entry, stack_qty)
-    for entry, total_qty in entry_counts.items():
-        stack_row = await fetch_one('world', 'SELECT stackable FROM item_template WHERE entry = %s', (entry,))
-        max_stack = int(stack_row.get('stackable') or 1) if stack_row else 1
-        if max_stack < 1:
-            max_stack = 1
-        remaining = total_qty
-        while remaining > 0:
-            take = remaining if remaining <= max_stack else max_stack
-            stacks.append((entry, take))
-            remaining -= take
-    # 3) Dividir en mails de máximo 12 items (AzerothCore soporta 12 attachments en send items)
-    mails = []
-    current = []
-    for entry, count in stacks:
-        if len(current) >= 12:
-            mails.append(current)
-            current = []
-        current.append((entry, count))
-    if current:
-        mails.append(current)
-    responses = []
-    for mail_items in mails:
-        parts = ' '.join([f'{e}:{c}' for e, c in mail_items])
-        command = f'send items {character_name} "{subject}" "{body}" {parts}'
-        try:
-            resp_text = await _soap_execute(soap_cfg, command)
-            responses.append(resp_text[:1000])
-        except Exception as e:
-            responses.append(f'Error:{e}')
-    final_resp = '\n---\n'.join(responses)[:2000]
-    success = all(not r.startswith('Error:') for r in responses)
-    await _update_purchase_soap(purchase_row['id'], success, final_resp)
-    try:
-        pass
-    except Exception as e:
-        await _update_purchase_soap(purchase_row['id'], False, f'Error SOAP final: {e}')
-
-
-async def _soap_execute(cfg: dict, command: str) -> str:
-    """Ejecuta un comando SOAP simple usando HTTP POST estilo AzerothCore.
-    Si el core usa SOAP clásico PHP ext/Soap, esta versión HTTP puede necesitar adaptarse.
-    """
-    # Placeholder genérico usando aiohttp, esperando endpoint estilo http://host:port/ con basic auth (si se configurara).
-    # Muchos cores usan autenticación básica. Ajustar según entorno real.
-    url = cfg.get('endpoint') or f"http://{cfg['host']}:{cfg['port']}"
-    auth = aiohttp.BasicAuth(cfg['user'], cfg['password']) if cfg.get('user') else None
-    envelope = f'''<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" xmlns:ns1="urn:AC">
-  <SOAP-ENV:Body>
-    <ns1:executeCommand>
-      <command>{command}</command>
-    </ns1:executeCommand>
-  </SOAP-ENV:Body>
-</SOAP-ENV:Envelope>'''
-    headers = {'Content-Type': 'text/xml; charset=utf-8'}
-    timeout = aiohttp.ClientTimeout(total=cfg.get('timeout', 15))
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        async with session.post(url, data=envelope.encode('utf-8'), auth=auth, headers=headers) as resp:
-            text = await resp.text()
-            if resp.status >= 400:
-                raise RuntimeError(f'Status {resp.status}: {text[:300]}')
-            return text
-
-
-async def _update_purchase_soap(purchase_id: int, success: bool, response: str):
-    try:
-        await execute('cms', 'UPDATE shop_purchases SET sent_via_soap = %s, soap_response = %s WHERE id = %s', (1 if success else 0, response, purchase_id))
-    except Exception:
-        pass
-
+    # compat: las compras legacy single-item se resuelven por item_id
+    if not await load_purchase_items(purchase):
+        raise HTTPException(status_code=400, detail='Compra sin items asociados')
+    active = await fetch_one('cms', "SELECT id FROM soap_delivery_jobs WHERE purchase_id = %s AND status IN ('pending','running') ORDER BY id DESC LIMIT 1", (purchase_id,))
+    if active:
+        return {'ok': True, 'queued': True, 'forced': force, 'job_id': active['id']}
+    job_id = await enqueue_delivery(purchase_id, purchase.get('realm_id'))
+    soap_delivery.notify()
+    return {'ok': True, 'queued': True, 'forced': force, 'job_id': job_id}
+
+
+# --------------- SOAP delivery queue (admin) ---------------
+@router.get('/admin/deliveries', dependencies=[Depends(require_admin)])
+async def delivery_stats():
+    """Estado de la cola de entregas: contadores del worker de este proceso por realm
+    y jobs por realm/estado en la tabla."""
+    return {'worker': soap_delivery.stats(), 'queue': await soap_delivery.queue_stats()}
+
+
+@router.get('/admin/deliveries/dead', dependencies=[Depends(require_admin)])
+async def list_dead_deliveries(limit: int = 50):
+    limit = max(1, min(limit, 200))
+    rows = await fetch_all('cms', "SELECT j.*, p.username, p.character_name FROM soap_delivery_jobs j JOIN shop_purchases p ON p.id = j.purchase_id "
+                                  "WHERE j.status = 'dead' ORDER BY j.id DESC LIMIT %s", (limit,))
+    return rows or []
 
-async def _load_realm_soap_config(realm_id: int | None) -> dict | None:
-    """Obtiene configuración SOAP desde cms.realms.
 
-    Campos relevantes: soap_enabled, soap_endpoint, soap_user, soap_password, soap_timeout.
-    Usa realm_id (columna realm_id en tabla) y no id autoincrement.
-    """
-    if realm_id is None:
-        return None
-    row = await fetch_one('cms', 'SELECT soap_enabled, soap_endpoint, soap_user, soap_password, soap_timeout FROM realms WHERE realm_id = %s', (realm_id,))
-    if not row:
-        return None
-    return {
-        'enabled': bool(row.get('soap_enabled')),
-        'endpoint': row.get('soap_endpoint'),
-        'user': row.get('soap_user'),
-        'password': row.get('soap_password'),
-        'timeout': row.get('soap_timeout') or 30,
-        # compat keys para la función previa
-        'host': row.get('soap_endpoint') or '',
-        'port': 0,
-    }
+@router.post('/admin/deliveries/{job_id}/retry', dependencies=[Depends(require_admin)])
+async def retry_delivery(job_id: int):
+    if not await soap_delivery.retry(job_id):
+        raise HTTPException(status_code=404, detail='Job no encontrado o no está en dead letter')
+    return {'ok': True, 'job_id': job_id}
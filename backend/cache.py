@@ -0,0 +1,109 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from db import fetch_one, execute
+
+
+class TTLCache:
+    """Small in-process LRU cache with per-entry expiry.
+
+    Each worker process keeps its own copy; entries are dropped when they expire or
+    when `maxsize` is exceeded (least recently used first).
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        expires_at, value = item
+        if expires_at and expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else 0.0
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> Any:
+        item = self._data.pop(key, None)
+        return item[1] if item else None
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+
+# todas las instancias, para GET /cache/status
+versioned_caches: list = []
+
+
+class VersionedCache(TTLCache):
+    """TTLCache that is emptied whenever a shared version counter changes.
+
+    The counter lives in cms.cache_versions so a bump made by one worker is seen by
+    the others after at most `check_interval` seconds; the local process clears
+    immediately. If the table is missing, entries just expire by TTL; the failure is
+    kept in `last_error` (see stats()) so a missing migration is visible.
+    """
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 300.0, check_interval: float = 5.0):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.name = name
+        self.check_interval = check_interval
+        self.version: Optional[int] = None
+        self._checked_at = 0.0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+        versioned_caches.append(self)
+
+    def _failed(self, op: str, exc: Exception) -> None:
+        self.errors += 1
+        self.last_error = f'{op}: {exc}'
+
+    async def sync(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            row = await fetch_one('cms', 'SELECT version FROM cache_versions WHERE name = %s', (self.name,))
+        except Exception as e:
+            self._failed('sync', e)
+            return
+        version = int(row.get('version') or 0) if row else 0
+        if version != self.version:
+            self.clear()
+            self.version = version
+
+    async def bump(self) -> None:
+        self.clear()
+        self._checked_at = 0.0
+        try:
+            await execute('cms', 'INSERT INTO cache_versions (name, version) VALUES (%s, 1) ON DUPLICATE KEY UPDATE version = version + 1', (self.name,))
+        except Exception as e:
+            self._failed('bump', e)
+
+    def stats(self) -> dict:
+        return {**super().stats(), 'name': self.name, 'version': self.version, 'errors': self.errors, 'last_error': self.last_error}
@@ -0,0 +1,128 @@
+import asyncio
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional
+
+import aiomysql
+
+from config import CHARACTER_INDEX_REFRESH
+from db import fetch_all, db_pools
+
+
+class CharacterIndex:
+    """Sorted in-memory index of character names across all realms.
+
+    Rebuilt periodically from each realm's `characters` table; prefix lookups are a
+    bisect over the sorted lowercase names, so searches never hit the game DBs.
+    """
+
+    def __init__(self):
+        self._names: List[str] = []  # lowercase names, sorted
+        self._entries: List[dict] = []  # same order as _names
+        self._by_realm: Dict[Optional[int], list] = {}  # última carga correcta de cada realm
+        self.failed_realms: List[Optional[int]] = []
+        self.built_at: Optional[float] = None
+        self.build_seconds = 0.0
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    async def _load_realm(self, realm: dict) -> Optional[list]:
+        """Entries of one realm, or None if its DB failed."""
+        try:
+            pool = await db_pools.get_realm_pool(realm)
+            if pool is None:
+                return []
+            async with pool.connection() as conn:
+                async with conn.cursor(aiomysql.DictCursor) as cur:
+                    await cur.execute('SELECT guid, name, level, race, class FROM characters')
+                    rows = await cur.fetchall()
+        except Exception:
+            return None
+        realm_id = realm.get('realm_id')
+        realm_name = realm.get('name') or f'Realm {realm_id}'
+        return [{
+            'name': r.get('name'),
+            'realm_id': realm_id,
+            'realm_name': realm_name,
+            'guid': int(r.get('guid') or 0),
+            'level': int(r.get('level') or 0),
+            'class': int(r.get('class') or 0),
+            'race': int(r.get('race') or 0),
+        } for r in (rows or []) if r.get('name')]
+
+    async def _build(self):
+        start = time.monotonic()
+        realms = await fetch_all('cms', 'SELECT realm_id, name, char_db_host, char_db_port, char_db_user, char_db_password, char_db_name FROM realms') or []
+        chunks = await asyncio.gather(*[self._load_realm(r) for r in realms])
+        by_realm: Dict[Optional[int], list] = {}
+        failed = []
+        for realm, chunk in zip(realms, chunks):
+            realm_id = realm.get('realm_id')
+            if chunk is None:
+                # realm caído: se mantienen sus entradas anteriores hasta el próximo rebuild
+                failed.append(realm_id)
+                chunk = self._by_realm.get(realm_id, [])
+            by_realm[realm_id] = chunk
+        entries = [e for chunk in by_realm.values() for e in chunk]
+        entries.sort(key=lambda e: (e['name'].lower(), e['realm_id'], e['guid']))
+        # swap en bloque: las búsquedas en curso siguen usando las listas anteriores
+        self._entries = entries
+        self._names = [e['name'].lower() for e in entries]
+        self._by_realm = by_realm
+        self.failed_realms = failed
+        self.built_at = time.time()
+        self.build_seconds = time.monotonic() - start
+
+    async def rebuild(self):
+        async with self._lock:
+            await self._build()
+
+    async def ensure_built(self):
+        if self.built_at is not None:
+            return
+        async with self._lock:
+            if self.built_at is None:
+                await self._build()
+
+    def search(self, prefix: str, limit: int = 20, realm_id: Optional[int] = None) -> list:
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        names, entries = self._names, self._entries
+        out = []
+        i = bisect_left(names, prefix)
+        while i < len(names) and names[i].startswith(prefix):
+            entry = entries[i]
+            if realm_id is None or entry['realm_id'] == realm_id:
+                out.append(entry)
+                if len(out) >= limit:
+                    break
+            i += 1
+        return out
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await self.rebuild()
+            except Exception:
+                pass
+            await asyncio.sleep(CHARACTER_INDEX_REFRESH)
+
+    def start(self):
+        if CHARACTER_INDEX_REFRESH > 0 and self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {'size': len(self._entries), 'built_at': self.built_at, 'build_seconds': round(self.build_seconds, 3), 'failed_realms': self.failed_realms}
+
+
+character_index = CharacterIndex()
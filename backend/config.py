@@ -55,6 +55,52 @@ DEFAULT_POOL_ARGS = {
     # You can add more aiomysql.create_pool kwargs here if needed
 }
 
+# Number of worker processes sharing the DB server (gunicorn -w N). Used to split
+# an optional per-schema connection budget between workers.
+DB_POOL_WORKERS = max(1, int(_env_or("DB_POOL_WORKERS", getenv("WEB_CONCURRENCY", "1"))))
+
+# Env prefix used by each schema (same as DB_CONFIG above)
+_POOL_ENV_PREFIX = {
+    "cms": "DB_CMS",
+    "auth": "DB_AUTH",
+    "characters": "DB_CHAR",
+    "world": "DB_WORLD",
+    "realm": "DB_REALM",  # pools por realm (characters DB de cms.realms)
+}
+
+
+def _pool_config(key: str) -> dict:
+    """Per-schema pool bounds for the adaptive controller.
+
+    - <PREFIX>_POOL_MINSIZE / <PREFIX>_POOL_MAXSIZE: bounds per worker (fallback DB_POOL_MINSIZE/MAXSIZE)
+    - <PREFIX>_POOL_BUDGET: total connections for all workers; if set, maxsize = budget // DB_POOL_WORKERS
+    - <PREFIX>_POOL_INITIAL: starting limit (defaults to maxsize)
+    """
+    prefix = _POOL_ENV_PREFIX.get(key, f"DB_{key.upper()}")
+    minsize = int(getenv(f"{prefix}_POOL_MINSIZE") or DEFAULT_POOL_ARGS["minsize"])
+    maxsize = int(getenv(f"{prefix}_POOL_MAXSIZE") or DEFAULT_POOL_ARGS["maxsize"])
+    budget = getenv(f"{prefix}_POOL_BUDGET")
+    if budget:
+        maxsize = int(budget) // DB_POOL_WORKERS
+    minsize = max(1, minsize)
+    maxsize = max(minsize, maxsize)
+    initial = int(getenv(f"{prefix}_POOL_INITIAL") or maxsize)
+    initial = min(max(initial, minsize), maxsize)
+    return {"minsize": minsize, "maxsize": maxsize, "initial": initial}
+
+
+POOL_CONFIG = {key: _pool_config(key) for key in DB_CONFIG}
+REALM_POOL_CONFIG = _pool_config("realm")
+# Segundos sin reintentar crear el pool de un realm cuya conexión falló
+REALM_POOL_RETRY_AFTER = float(_env_or("REALM_POOL_RETRY_AFTER", "30"))
+
+# Adaptive pool controller: every interval each schema's limit is grown when the
+# average acquire wait or the peak utilization is high, and shrunk when it stays idle.
+DB_POOL_ADAPT_INTERVAL = float(_env_or("DB_POOL_ADAPT_INTERVAL", "10"))  # segundos; 0 desactiva
+DB_POOL_ADAPT_WAIT_MS = float(_env_or("DB_POOL_ADAPT_WAIT_MS", "5"))
+DB_POOL_ADAPT_HIGH_UTIL = float(_env_or("DB_POOL_ADAPT_HIGH_UTIL", "0.85"))
+DB_POOL_ADAPT_LOW_UTIL = float(_env_or("DB_POOL_ADAPT_LOW_UTIL", "0.25"))
+
 
 # JWT settings
 JWT_SECRET = _env_or("JWT_SECRET", "change-me-to-a-strong-secret")
@@ -97,3 +143,82 @@ def get_soap_realm_config(realm_id: int | None):
     if not user or not password:
         return None
     return {"host": host, "port": port, "user": user, "password": password}
+
+# Armory cache (por realm_id+guid). Personajes online cambian seguido -> TTL corto.
+ARMORY_CACHE_TTL_ONLINE = int(_env_or("ARMORY_CACHE_TTL_ONLINE", "30"))
+ARMORY_CACHE_TTL_OFFLINE = int(_env_or("ARMORY_CACHE_TTL_OFFLINE", "600"))
+ARMORY_CACHE_MAXSIZE = int(_env_or("ARMORY_CACHE_MAXSIZE", "5000"))
+
+# Cache LRU de item_template (world). Los datos solo cambian entre parches del servidor.
+WORLD_ITEM_CACHE_MAXSIZE = int(_env_or("WORLD_ITEM_CACHE_MAXSIZE", "20000"))
+WORLD_ITEM_CACHE_TTL = int(_env_or("WORLD_ITEM_CACHE_TTL", "0"))  # segundos; 0 = sin expiración
+# Al arrancar, precarga los item_template referenciados por shop_items (entregas SOAP sin consultar world)
+WORLD_ITEM_PRELOAD_SHOP = _env_or("WORLD_ITEM_PRELOAD_SHOP", "true").lower() in ("1", "true", "yes")
+ARMORY_BATCH_MAX = int(_env_or("ARMORY_BATCH_MAX", "50"))
+
+# Índice en memoria de nombres de personajes (búsqueda por prefijo en todos los realms)
+CHARACTER_INDEX_REFRESH = int(_env_or("CHARACTER_INDEX_REFRESH", "300"))  # segundos; 0 = se construye en la primera búsqueda y no se refresca
+
+# Cache de personajes por cuenta (perfil + selector de personajes de la tienda)
+ACCOUNT_CHARS_CACHE_TTL = int(_env_or("ACCOUNT_CHARS_CACHE_TTL", "60"))
+ACCOUNT_CHARS_CACHE_MAXSIZE = int(_env_or("ACCOUNT_CHARS_CACHE_MAXSIZE", "10000"))
+# TTL corto para listas incompletas (algún realm falló), para no ocultar personajes durante todo el TTL
+ACCOUNT_CHARS_PARTIAL_TTL = int(_env_or("ACCOUNT_CHARS_PARTIAL_TTL", "5"))
+
+# Cache del listado público de noticias (invalidado al publicar/editar/borrar)
+NEWS_CACHE_TTL = int(_env_or("NEWS_CACHE_TTL", "300"))
+NEWS_CACHE_CHECK_INTERVAL = float(_env_or("NEWS_CACHE_CHECK_INTERVAL", "5"))
+
+# Búsqueda: 'auto' (FULLTEXT y, si no existen los índices, índice invertido en memoria), 'fulltext' o 'memory'
+SEARCH_BACKEND = _env_or("SEARCH_BACKEND", "auto")
+# Índice en memoria: cada cuánto se aplican los cambios de otros workers (tabla search_index_changes)
+SEARCH_INDEX_CHECK_INTERVAL = float(_env_or("SEARCH_INDEX_CHECK_INTERVAL", "5"))
+# Con más cambios pendientes que esto se reconstruye el índice entero en vez de aplicarlos uno a uno
+SEARCH_INDEX_MAX_DELTA = int(_env_or("SEARCH_INDEX_MAX_DELTA", "1000"))
+# Segundos que se conservan las entradas del log de cambios
+SEARCH_INDEX_LOG_RETENTION = int(_env_or("SEARCH_INDEX_LOG_RETENTION", "86400"))
+
+# Feed RSS/Atom de noticias
+SITE_URL = _env_or("SITE_URL", "http://localhost:4200").rstrip("/")
+SITE_NAME = _env_or("SITE_NAME", "FastWoW CMS")
+NEWS_FEED_SIZE = int(_env_or("NEWS_FEED_SIZE", "20"))
+
+# Contadores de topics del foro (posts_count / last_post_at)
+# Write-behind: los posts se insertan sin tocar la fila del topic y los deltas se agrupan y aplican cada intervalo
+FORUM_COUNTERS_WRITE_BEHIND = _env_or("FORUM_COUNTERS_WRITE_BEHIND", "0").lower() in ("1", "true", "yes")
+FORUM_COUNTERS_FLUSH_INTERVAL = float(_env_or("FORUM_COUNTERS_FLUSH_INTERVAL", "1"))
+FORUM_RECONCILE_INTERVAL = int(_env_or("FORUM_RECONCILE_INTERVAL", "3600"))  # segundos; 0 = solo manual
+
+# Índice del foro (categorías con totales y último topic) servido desde memoria
+FORUM_INDEX_REFRESH = int(_env_or("FORUM_INDEX_REFRESH", "10"))  # segundos; recarga para ver cambios de otros workers
+
+# No leídos del foro: topics sin actividad en esta ventana cuentan como leídos
+FORUM_UNREAD_WINDOW_DAYS = int(_env_or("FORUM_UNREAD_WINDOW_DAYS", "30"))
+
+# Contador de visitas (topics y noticias): se acumula en memoria y se vuelca cada intervalo
+VIEW_COUNTER_FLUSH_INTERVAL = float(_env_or("VIEW_COUNTER_FLUSH_INTERVAL", "5"))
+
+# Catálogo de la tienda en memoria (invalidado por versión al editar items/categorías)
+SHOP_CATALOG_TTL = int(_env_or("SHOP_CATALOG_TTL", "600"))
+SHOP_CATALOG_CHECK_INTERVAL = float(_env_or("SHOP_CATALOG_CHECK_INTERVAL", "5"))
+
+# Cola de entregas SOAP: sondeo, lote por ciclo, comandos simultáneos por realm y reintentos con backoff
+SOAP_DELIVERY_POLL_INTERVAL = float(_env_or("SOAP_DELIVERY_POLL_INTERVAL", "2"))
+SOAP_DELIVERY_BATCH = int(_env_or("SOAP_DELIVERY_BATCH", "20"))
+SOAP_DELIVERY_REALM_CONCURRENCY = int(_env_or("SOAP_DELIVERY_REALM_CONCURRENCY", "2"))
+SOAP_DELIVERY_MAX_ATTEMPTS = int(_env_or("SOAP_DELIVERY_MAX_ATTEMPTS", "8"))
+SOAP_DELIVERY_BACKOFF_BASE = float(_env_or("SOAP_DELIVERY_BACKOFF_BASE", "10"))
+SOAP_DELIVERY_BACKOFF_MAX = float(_env_or("SOAP_DELIVERY_BACKOFF_MAX", "3600"))
+# un job 'running' más viejo que esto se considera abandonado (worker caído) y se vuelve a reclamar
+SOAP_DELIVERY_STALE_AFTER = int(_env_or("SOAP_DELIVERY_STALE_AFTER", "600"))
+
+# Cliente HTTP compartido (SOAP, PayPal): conexiones keep-alive por proceso
+HTTP_CLIENT_LIMIT = int(_env_or("HTTP_CLIENT_LIMIT", "100"))
+HTTP_CLIENT_LIMIT_PER_HOST = int(_env_or("HTTP_CLIENT_LIMIT_PER_HOST", "10"))
+HTTP_CLIENT_KEEPALIVE = float(_env_or("HTTP_CLIENT_KEEPALIVE", "30"))
+HTTP_CLIENT_CONNECT_TIMEOUT = float(_env_or("HTTP_CLIENT_CONNECT_TIMEOUT", "5"))
+HTTP_CLIENT_TIMEOUT = float(_env_or("HTTP_CLIENT_TIMEOUT", "30"))
+HTTP_CLIENT_DNS_TTL = int(_env_or("HTTP_CLIENT_DNS_TTL", "300"))
+
+# Límites por cuenta de la tienda: contador (username, item) mantenido en la compra en vez de sumar el historial
+SHOP_LIMIT_COUNTERS = _env_or("SHOP_LIMIT_COUNTERS", "false").lower() in ("1", "true", "yes")
@@ -1,23 +1,166 @@
 import asyncio
+import time
+from contextlib import asynccontextmanager
 from typing import Dict, Any, Optional
 
 import aiomysql
 
-from config import DB_CONFIG, DEFAULT_POOL_ARGS
+from config import (
+    DB_CONFIG, DEFAULT_POOL_ARGS, POOL_CONFIG, REALM_POOL_CONFIG, REALM_POOL_RETRY_AFTER,
+    DB_POOL_ADAPT_INTERVAL, DB_POOL_ADAPT_WAIT_MS, DB_POOL_ADAPT_HIGH_UTIL, DB_POOL_ADAPT_LOW_UTIL,
+)
+
+
+class AdaptivePool:
+    """aiomysql pool behind an adjustable concurrency limit.
+
+    The underlying pool is created with the configured upper bound; `limit` is the
+    number of connections callers may hold at once and is moved between
+    `min_limit` and `max_limit` by `adapt()` based on acquire wait and utilization.
+    """
+
+    def __init__(self, key: str, pool: aiomysql.Pool, min_limit: int, max_limit: int, initial: int):
+        self.key = key
+        self.pool = pool
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = initial
+        self.in_use = 0
+        self.waiting = 0
+        self._cond = asyncio.Condition()
+        # totals since startup
+        self.total_acquires = 0
+        self.total_wait = 0.0
+        # current adapt window
+        self._win_acquires = 0
+        self._win_wait = 0.0
+        self._win_max_wait = 0.0
+        self._win_peak = 0
+        self.last_window: Dict[str, Any] = {}
+
+    async def acquire(self):
+        start = time.monotonic()
+        async with self._cond:
+            self.waiting += 1
+            try:
+                await self._cond.wait_for(lambda: self.in_use < self.limit)
+            finally:
+                self.waiting -= 1
+            self.in_use += 1
+            if self.in_use > self._win_peak:
+                self._win_peak = self.in_use
+        try:
+            conn = await self.pool.acquire()
+        except BaseException:
+            await self._release_slot()
+            raise
+        waited = time.monotonic() - start
+        self.total_acquires += 1
+        self.total_wait += waited
+        self._win_acquires += 1
+        self._win_wait += waited
+        if waited > self._win_max_wait:
+            self._win_max_wait = waited
+        return conn
+
+    async def release(self, conn):
+        self.pool.release(conn)
+        await self._release_slot()
+
+    async def _release_slot(self):
+        async with self._cond:
+            self.in_use -= 1
+            self._cond.notify()
+
+    @asynccontextmanager
+    async def connection(self):
+        conn = await self.acquire()
+        try:
+            yield conn
+        finally:
+            await self.release(conn)
+
+    async def adapt(self):
+        """Close the current metrics window and resize the limit within bounds."""
+        acquires = self._win_acquires
+        avg_wait_ms = (self._win_wait / acquires * 1000.0) if acquires else 0.0
+        utilization = self._win_peak / self.limit if self.limit else 0.0
+        old_limit = self.limit
+        if avg_wait_ms > DB_POOL_ADAPT_WAIT_MS or utilization >= DB_POOL_ADAPT_HIGH_UTIL:
+            # grow fast under pressure (x1.5, at least +1)
+            self.limit = min(self.max_limit, max(self.limit + 1, int(self.limit * 1.5)))
+        elif utilization <= DB_POOL_ADAPT_LOW_UTIL and self.waiting == 0:
+            # shrink slowly when idle
+            self.limit = max(self.min_limit, self.limit - 1, self.in_use)
+        self.last_window = {
+            'acquires': acquires,
+            'avg_wait_ms': round(avg_wait_ms, 3),
+            'max_wait_ms': round(self._win_max_wait * 1000.0, 3),
+            'peak_in_use': self._win_peak,
+            'utilization': round(utilization, 3),
+        }
+        self._win_acquires = 0
+        self._win_wait = 0.0
+        self._win_max_wait = 0.0
+        self._win_peak = self.in_use
+        if self.limit > old_limit:
+            async with self._cond:
+                self._cond.notify(self.limit - old_limit)
+        elif self.limit < old_limit and self.pool.freesize > self.limit:
+            await self._close_idle(self.pool.freesize - self.limit)
+
+    async def _close_idle(self, count: int) -> None:
+        """Close `count` idle connections (only the excess, not the whole free list)."""
+        for _ in range(count):
+            if self.pool.freesize <= 0:
+                break
+            # con conexiones libres acquire() devuelve una de ellas sin abrir otra
+            conn = await self.pool.acquire()
+            conn.close()
+            # release de una conexión cerrada la quita del pool
+            self.pool.release(conn)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'limit': self.limit,
+            'min_limit': self.min_limit,
+            'max_limit': self.max_limit,
+            'in_use': self.in_use,
+            'waiting': self.waiting,
+            'pool_size': self.pool.size,
+            'pool_free': self.pool.freesize,
+            'total_acquires': self.total_acquires,
+            'avg_wait_ms': round(self.total_wait / self.total_acquires * 1000.0, 3) if self.total_acquires else 0.0,
+            'last_window': self.last_window,
+        }
 
 
 class DatabasePools:
     """Manage aiomysql pools for multiple schemas (cms, auth, characters, world)."""
 
     def __init__(self):
-        self._pools: Dict[str, aiomysql.Pool] = {}
+        self._pools: Dict[str, AdaptivePool] = {}
         self._lock = asyncio.Lock()
+        self._adapt_task: Optional[asyncio.Task] = None
+        # realm_id -> pool for that realm's characters DB (created on first use)
+        self._realm_pools: Dict[int, AdaptivePool] = {}
+        self._realm_dsn: Dict[int, tuple] = {}
+        # un lock por realm: un realm lento o caído no bloquea la creación de los demás
+        self._realm_locks: Dict[int, asyncio.Lock] = {}
+        # realm_id -> (dsn, monotonic time, error) del último intento fallido
+        self._realm_failures: Dict[int, tuple] = {}
 
     async def init_pools(self):
         async with self._lock:
             if self._pools:
                 return
             for key, cfg in DB_CONFIG.items():
+                bounds = POOL_CONFIG.get(key) or {
+                    "minsize": DEFAULT_POOL_ARGS["minsize"],
+                    "maxsize": DEFAULT_POOL_ARGS["maxsize"],
+                    "initial": DEFAULT_POOL_ARGS["maxsize"],
+                }
+                pool_args = {**DEFAULT_POOL_ARGS, "minsize": bounds["minsize"], "maxsize": bounds["maxsize"]}
                 pool = await aiomysql.create_pool(
                     host=cfg["host"],
                     port=cfg["port"],
@@ -25,39 +168,115 @@ class DatabasePools:
                     password=cfg["password"],
                     db=cfg["db"],
                     autocommit=True,
-                    **DEFAULT_POOL_ARGS,
+                    **pool_args,
                 )
-                self._pools[key] = pool
+                self._pools[key] = AdaptivePool(key, pool, bounds["minsize"], bounds["maxsize"], bounds["initial"])
+            if DB_POOL_ADAPT_INTERVAL > 0:
+                self._adapt_task = asyncio.create_task(self._adapt_loop())
 
     async def close_pools(self):
         async with self._lock:
-            for pool in self._pools.values():
-                pool.close()
-                await pool.wait_closed()
+            if self._adapt_task:
+                self._adapt_task.cancel()
+                try:
+                    await self._adapt_task
+                except asyncio.CancelledError:
+                    pass
+                self._adapt_task = None
+            for managed in [*self._pools.values(), *self._realm_pools.values()]:
+                managed.pool.close()
+                await managed.pool.wait_closed()
             self._pools.clear()
+            self._realm_pools.clear()
+            self._realm_dsn.clear()
+            self._realm_failures.clear()
+
+    async def _adapt_loop(self):
+        while True:
+            await asyncio.sleep(DB_POOL_ADAPT_INTERVAL)
+            for managed in [*self._pools.values(), *self._realm_pools.values()]:
+                try:
+                    await managed.adapt()
+                except Exception:
+                    pass
 
     def get_pool(self, key: str) -> Optional[aiomysql.Pool]:
-        return self._pools.get(key)
+        managed = self._pools.get(key)
+        return managed.pool if managed else None
+
+    def get_managed(self, key: str) -> AdaptivePool:
+        managed = self._pools.get(key)
+        if managed is None:
+            raise RuntimeError(f"Pool for {key} is not initialized")
+        return managed
+
+    async def get_realm_pool(self, realm: dict) -> Optional[AdaptivePool]:
+        """Pool for a realm's characters DB, given its cms.realms row.
+
+        Returns None when the realm has no connection info. The pool is rebuilt if
+        the connection data in cms.realms changed. After a failed connection the same
+        error is raised without retrying for REALM_POOL_RETRY_AFTER seconds.
+        """
+        realm_id = realm.get('realm_id')
+        host = realm.get('char_db_host')
+        user = realm.get('char_db_user')
+        dbname = realm.get('char_db_name')
+        if not host or not user or not dbname:
+            return None
+        dsn = (host, int(realm.get('char_db_port') or 3306), user, realm.get('char_db_password') or '', dbname)
+        managed = self._realm_pools.get(realm_id)
+        if managed and self._realm_dsn.get(realm_id) == dsn:
+            return managed
+        async with self._realm_locks.setdefault(realm_id, asyncio.Lock()):
+            managed = self._realm_pools.get(realm_id)
+            if managed and self._realm_dsn.get(realm_id) == dsn:
+                return managed
+            failure = self._realm_failures.get(realm_id)
+            if failure and failure[0] == dsn and time.monotonic() - failure[1] < REALM_POOL_RETRY_AFTER:
+                raise ConnectionError(failure[2])
+            try:
+                pool = await aiomysql.create_pool(
+                    host=dsn[0],
+                    port=dsn[1],
+                    user=dsn[2],
+                    password=dsn[3],
+                    db=dsn[4],
+                    autocommit=True,
+                    minsize=REALM_POOL_CONFIG["minsize"],
+                    maxsize=REALM_POOL_CONFIG["maxsize"],
+                )
+            except Exception as e:
+                self._realm_failures[realm_id] = (dsn, time.monotonic(), str(e))
+                raise
+            self._realm_failures.pop(realm_id, None)
+            old = managed
+            managed = AdaptivePool(f'realm:{realm_id}', pool, REALM_POOL_CONFIG["minsize"], REALM_POOL_CONFIG["maxsize"], REALM_POOL_CONFIG["initial"])
+            self._realm_pools[realm_id] = managed
+            self._realm_dsn[realm_id] = dsn
+        if old:
+            # el pool anterior se cierra cuando sus conexiones en uso se devuelven
+            old.pool.close()
+            await old.pool.wait_closed()
+        return managed
+
+    def stats(self) -> Dict[str, Any]:
+        out = {key: managed.snapshot() for key, managed in self._pools.items()}
+        out.update({managed.key: managed.snapshot() for managed in self._realm_pools.values()})
+        return out
 
 
 db_pools = DatabasePools()
 
 
 async def fetch_one(pool_key: str, query: str, params: Optional[tuple] = None) -> Optional[Dict[str, Any]]:
-    pool = db_pools.get_pool(pool_key)
-    if pool is None:
-        raise RuntimeError(f"Pool for {pool_key} is not initialized")
-    async with pool.acquire() as conn:
+    async with db_pools.get_managed(pool_key).connection() as conn:
         async with conn.cursor(aiomysql.DictCursor) as cur:
             await cur.execute(query, params or ())
             return await cur.fetchone()
 
 
 async def fetch_all(pool_key: str, query: str, params: Optional[tuple] = None) -> Optional[list]:
-    pool = db_pools.get_pool(pool_key)
-    if pool is None:
-        raise RuntimeError(f"Pool for {pool_key} is not initialized")
-    async with pool.acquire() as conn:
+    async with db_pools.get_managed(pool_key).connection() as conn:
         async with conn.cursor(aiomysql.DictCursor) as cur:
             await cur.execute(query, params or ())
             return await cur.fetchall()
@@ -65,10 +284,7 @@ async def fetch_all(pool_key: str, query: str, params: Optional[tuple] = None) -
 
 async def execute(pool_key: str, query: str, params: Optional[tuple] = None) -> int:
     """Execute a statement (INSERT/UPDATE/DELETE). Returns affected rowcount."""
-    pool = db_pools.get_pool(pool_key)
-    if pool is None:
-        raise RuntimeError(f"Pool for {pool_key} is not initialized")
-    async with pool.acquire() as conn:
+    async with db_pools.get_managed(pool_key).connection() as conn:
         async with conn.cursor() as cur:
             await cur.execute(query, params or ())
             # return a tuple (rowcount, lastrowid) where lastrowid may be 0 if not applicable
@@ -92,18 +308,13 @@ class Transaction:
 
 
 async def begin_transaction(pool_key: str):
-    pool = db_pools.get_pool(pool_key)
-    if pool is None:
-        raise RuntimeError(f"Pool for {pool_key} is not initialized")
-    conn = await pool.acquire()
+    conn = await db_pools.get_managed(pool_key).acquire()
     # autocommit false for explicit control
     await conn.begin()
     return conn, Transaction(conn)
 
 async def release_connection(pool_key: str, conn):
-    pool = db_pools.get_pool(pool_key)
-    if pool:
-        pool.release(conn)
+    await db_pools.get_managed(pool_key).release(conn)
 
 async def tx_execute(conn, query: str, params: Optional[tuple] = None, dict_cursor=False):
     cur_cls = aiomysql.DictCursor if dict_cursor else None
@@ -115,3 +326,8 @@ async def tx_fetch_one(conn, query: str, params: Optional[tuple] = None):
     async with conn.cursor(aiomysql.DictCursor) as cur:
         await cur.execute(query, params or ())
         return await cur.fetchone()
+
+async def tx_fetch_all(conn, query: str, params: Optional[tuple] = None):
+    async with conn.cursor(aiomysql.DictCursor) as cur:
+        await cur.execute(query, params or ())
+        return list(await cur.fetchall())
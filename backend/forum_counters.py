@@ -0,0 +1,213 @@
+import asyncio
+import datetime
+import time
+from typing import Dict, Iterable, Optional
+
+from config import FORUM_COUNTERS_WRITE_BEHIND, FORUM_COUNTERS_FLUSH_INTERVAL, FORUM_RECONCILE_INTERVAL
+from db import execute, begin_transaction, release_connection, tx_execute
+from forum_index import forum_index, recompute_category_stats
+
+
+# Recalcula posts_count/last_post_at desde forum_posts; `{where}` limita a ciertos topics
+_RECONCILE_TOPICS_SQL = '''
+UPDATE forum_topics t
+LEFT JOIN (SELECT topic_id, COUNT(*) AS cnt, MAX(created_at) AS last_at FROM forum_posts {sub_where} GROUP BY topic_id) p ON p.topic_id = t.id
+SET t.posts_count = COALESCE(p.cnt, 0), t.last_post_at = COALESCE(p.last_at, t.created_at)
+WHERE (t.posts_count <> COALESCE(p.cnt, 0) OR NOT (t.last_post_at <=> COALESCE(p.last_at, t.created_at))) {where}
+'''
+
+
+async def reconcile_topics(topic_ids: Optional[Iterable[int]] = None, conn=None) -> int:
+    """Recompute the counters of `topic_ids` (all topics if None); with `conn` it runs
+    inside the caller's transaction."""
+    if topic_ids is None:
+        q, params = _RECONCILE_TOPICS_SQL.format(sub_where='', where=''), ()
+    else:
+        ids = sorted({int(t) for t in topic_ids})
+        if not ids:
+            return 0
+        placeholders = ','.join(['%s'] * len(ids))
+        q = _RECONCILE_TOPICS_SQL.format(sub_where=f'WHERE topic_id IN ({placeholders})', where=f'AND t.id IN ({placeholders})')
+        params = (*ids, *ids)
+    if conn is not None:
+        rowcount, _ = await tx_execute(conn, q, params)
+    else:
+        rowcount, _ = await execute('cms', q, params)
+    return rowcount
+
+
+class TopicCounters:
+    """posts_count / last_post_at of forum topics.
+
+    With write-behind enabled, `add()` only records a delta in memory and a background
+    task applies all pending deltas every FORUM_COUNTERS_FLUSH_INTERVAL seconds (one
+    UPDATE for topics and one for their categories), so hot threads do not serialize
+    on their topic row. Deltas not yet
+    flushed are lost if the process dies; `reconcile()` recomputes every topic from
+    forum_posts and also runs periodically (FORUM_RECONCILE_INTERVAL).
+    """
+
+    def __init__(self, write_behind: bool = FORUM_COUNTERS_WRITE_BEHIND):
+        self.write_behind = write_behind
+        # topic_id -> [delta posts_count, max last_post_at]
+        self._pending: Dict[int, list] = {}
+        # category_id -> [delta posts_count, last_post_at, topic_id, topic_title, author]
+        self._pending_categories: Dict[int, list] = {}
+        self._lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._reconcile_task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.flushed_topics = 0
+        self.reconciled_at: Optional[float] = None
+        self.reconciled_rows = 0
+        self.last_error: Optional[str] = None
+
+    def add(self, topic_id: int, delta: int, last_post_at: Optional[datetime.datetime] = None,
+            category_id: Optional[int] = None, topic_title: Optional[str] = None, author: Optional[str] = None) -> None:
+        entry = self._pending.setdefault(int(topic_id), [0, None])
+        entry[0] += delta
+        if last_post_at is not None and (entry[1] is None or last_post_at > entry[1]):
+            entry[1] = last_post_at
+        if category_id is not None:
+            cat = self._pending_categories.setdefault(int(category_id), [0, None, None, None, None])
+            cat[0] += delta
+            if last_post_at is not None and (cat[1] is None or last_post_at > cat[1]):
+                cat[1:] = [last_post_at, int(topic_id), topic_title, author]
+
+    async def flush(self) -> int:
+        async with self._lock:
+            return await self._flush()
+
+    @staticmethod
+    def _topics_update(pending: Dict[int, list]) -> tuple:
+        ids = list(pending)
+        count_cases = ' '.join('WHEN %s THEN %s' for _ in ids)
+        params: list = [v for tid in ids for v in (tid, pending[tid][0])]
+        dated = [tid for tid in ids if pending[tid][1] is not None]
+        last_sql = ''
+        if dated:
+            last_cases = ' '.join('WHEN %s THEN GREATEST(COALESCE(last_post_at, %s), %s)' for _ in dated)
+            last_sql = f', last_post_at = CASE id {last_cases} ELSE last_post_at END'
+            params += [v for tid in dated for v in (tid, pending[tid][1], pending[tid][1])]
+        placeholders = ','.join(['%s'] * len(ids))
+        params += ids
+        q = (f'UPDATE forum_topics SET posts_count = GREATEST(CAST(posts_count AS SIGNED) + CASE id {count_cases} ELSE 0 END, 0)'
+             f'{last_sql} WHERE id IN ({placeholders})')
+        return q, tuple(params)
+
+    @staticmethod
+    def _categories_update(pending: Dict[int, list]) -> tuple:
+        ids = list(pending)
+        count_cases = ' '.join('WHEN %s THEN %s' for _ in ids)
+        params: list = [v for cid in ids for v in (cid, pending[cid][0])]
+        sets = [f'posts_count = GREATEST(CAST(posts_count AS SIGNED) + CASE id {count_cases} ELSE 0 END, 0)']
+        dated = [cid for cid in ids if pending[cid][1] is not None]
+        if dated:
+            # las columnas last_* se asignan antes que last_post_at (MySQL evalúa el SET en orden)
+            for col, pos in (('last_topic_id', 2), ('last_topic_title', 3), ('last_post_author', 4)):
+                cases = ' '.join(f'WHEN %s THEN IF(last_post_at IS NULL OR last_post_at <= %s, %s, {col})' for _ in dated)
+                sets.append(f'{col} = CASE id {cases} ELSE {col} END')
+                params += [v for cid in dated for v in (cid, pending[cid][1], pending[cid][pos])]
+            cases = ' '.join('WHEN %s THEN GREATEST(COALESCE(last_post_at, %s), %s)' for _ in dated)
+            sets.append(f'last_post_at = CASE id {cases} ELSE last_post_at END')
+            params += [v for cid in dated for v in (cid, pending[cid][1], pending[cid][1])]
+        placeholders = ','.join(['%s'] * len(ids))
+        params += ids
+        return f"UPDATE forum_categories SET {', '.join(sets)} WHERE id IN ({placeholders})", tuple(params)
+
+    async def _flush(self) -> int:
+        if not self._pending and not self._pending_categories:
+            return 0
+        # la conexión se obtiene antes de vaciar los pendientes: si falla, los deltas quedan en cola
+        conn, tx = await begin_transaction('cms')
+        pending, self._pending = self._pending, {}
+        pending_categories, self._pending_categories = self._pending_categories, {}
+        try:
+            if pending:
+                await tx_execute(conn, *self._topics_update(pending))
+            if pending_categories:
+                await tx_execute(conn, *self._categories_update(pending_categories))
+            await tx.commit()
+        except Exception:
+            await tx.rollback()
+            # se reintenta en el siguiente flush
+            for tid, (delta, last) in pending.items():
+                self.add(tid, delta, last)
+            for cid, (delta, last, tid, title, author) in pending_categories.items():
+                cat = self._pending_categories.setdefault(cid, [0, None, None, None, None])
+                cat[0] += delta
+                if last is not None and (cat[1] is None or last > cat[1]):
+                    cat[1:] = [last, tid, title, author]
+            raise
+        finally:
+            await release_connection('cms', conn)
+        self.flushes += 1
+        self.flushed_topics += len(pending)
+        await forum_index.refresh_categories(pending_categories)
+        return len(pending)
+
+    async def reconcile(self) -> int:
+        """Recompute posts_count/last_post_at of every topic from forum_posts, then the
+        per-category aggregates from the topics."""
+        async with self._lock:
+            # aplica primero los deltas locales para no sumarlos dos veces
+            await self._flush()
+            rowcount = await reconcile_topics()
+            await recompute_category_stats()
+        if forum_index.loaded_at is not None:
+            await forum_index.reload()
+        self.reconciled_at = time.time()
+        self.reconciled_rows = rowcount
+        return rowcount
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(FORUM_COUNTERS_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception as e:
+                self.last_error = f'flush: {e}'
+
+    async def _reconcile_loop(self):
+        while True:
+            await asyncio.sleep(FORUM_RECONCILE_INTERVAL)
+            try:
+                await self.reconcile()
+            except Exception as e:
+                self.last_error = f'reconcile: {e}'
+
+    def start(self):
+        if self.write_behind and self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+        if FORUM_RECONCILE_INTERVAL > 0 and self._reconcile_task is None:
+            self._reconcile_task = asyncio.create_task(self._reconcile_loop())
+
+    async def stop(self):
+        for task in (self._flush_task, self._reconcile_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._flush_task = None
+        self._reconcile_task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            self.last_error = f'flush: {e}'
+
+    def stats(self) -> dict:
+        return {
+            'write_behind': self.write_behind,
+            'pending_topics': len(self._pending),
+            'pending_categories': len(self._pending_categories),
+            'flushes': self.flushes,
+            'flushed_topics': self.flushed_topics,
+            'reconciled_at': self.reconciled_at,
+            'reconciled_rows': self.reconciled_rows,
+            'last_error': self.last_error,
+        }
+
+
+topic_counters = TopicCounters()
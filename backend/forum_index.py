@@ -0,0 +1,115 @@
+import asyncio
+import time
+from typing import Dict, Iterable, List, Optional
+
+from config import FORUM_INDEX_REFRESH
+from db import fetch_all, execute, tx_execute
+
+CATEGORY_INDEX_COLUMNS = ('id, name, slug, description, position, topics_count, posts_count, '
+                          'last_topic_id, last_topic_title, last_post_author, last_post_at')
+
+# Recalcula los agregados de categoría desde forum_topics/forum_posts (reconciliación,
+# borrado/movimiento de topics). `{where}` limita a ciertas categorías.
+_RECOMPUTE_SQL = '''
+UPDATE forum_categories c
+LEFT JOIN (SELECT category_id, COUNT(*) AS topics, SUM(posts_count) AS posts FROM forum_topics {topics_where} GROUP BY category_id) s ON s.category_id = c.id
+LEFT JOIN forum_topics lt ON lt.id = (
+    SELECT t2.id FROM forum_topics t2 WHERE t2.category_id = c.id ORDER BY t2.last_post_at DESC, t2.id DESC LIMIT 1
+)
+SET c.topics_count = COALESCE(s.topics, 0),
+    c.posts_count = COALESCE(s.posts, 0),
+    c.last_topic_id = lt.id,
+    c.last_topic_title = lt.title,
+    c.last_post_author = (SELECT p.author_username FROM forum_posts p WHERE p.topic_id = lt.id ORDER BY p.id DESC LIMIT 1),
+    c.last_post_at = lt.last_post_at
+{where}
+'''
+
+
+def _serialize_category(row: dict) -> dict:
+    last_at = row.get('last_post_at')
+    return {
+        'id': row.get('id'),
+        'name': row.get('name'),
+        'slug': row.get('slug'),
+        'description': row.get('description'),
+        'position': row.get('position'),
+        'topics_count': int(row.get('topics_count') or 0),
+        'posts_count': int(row.get('posts_count') or 0),
+        'last_topic': {
+            'id': row.get('last_topic_id'),
+            'title': row.get('last_topic_title'),
+            'author': row.get('last_post_author'),
+            'last_post_at': last_at.isoformat() if last_at else None,
+        } if row.get('last_topic_id') else None,
+    }
+
+
+async def recompute_category_stats(category_ids: Optional[Iterable[int]] = None, conn=None) -> int:
+    """Recalcula los agregados (todas las categorías si `category_ids` es None); con
+    `conn` corre dentro de la transacción del llamador."""
+    if category_ids is None:
+        q, params = _RECOMPUTE_SQL.format(topics_where='', where=''), ()
+    else:
+        ids = sorted({int(c) for c in category_ids if c is not None})
+        if not ids:
+            return 0
+        placeholders = ','.join(['%s'] * len(ids))
+        # el filtro va también en la derivada: solo se agregan los topics de esas categorías
+        q = _RECOMPUTE_SQL.format(topics_where=f'WHERE category_id IN ({placeholders})', where=f'WHERE c.id IN ({placeholders})')
+        params = (*ids, *ids)
+    if conn is not None:
+        rowcount, _ = await tx_execute(conn, q, params)
+    else:
+        rowcount, _ = await execute('cms', q, params)
+    return rowcount
+
+
+class ForumIndex:
+    """Category list with topic/post totals and latest topic, kept in memory.
+
+    The aggregates are stored on forum_categories and updated by the forum write
+    handlers in the same transaction; after a local write the affected categories are
+    re-read by primary key, and the whole list is reloaded every FORUM_INDEX_REFRESH
+    seconds to pick up writes made by other workers.
+    """
+
+    def __init__(self):
+        self._categories: Dict[int, dict] = {}
+        self._ordered: List[dict] = []
+        self.loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    def _reorder(self) -> None:
+        self._ordered = sorted(self._categories.values(), key=lambda c: (c.get('position') or 0, c['id']))
+
+    async def reload(self) -> None:
+        rows = await fetch_all('cms', f'SELECT {CATEGORY_INDEX_COLUMNS} FROM forum_categories') or []
+        self._categories = {r['id']: _serialize_category(r) for r in rows}
+        self._reorder()
+        self.loaded_at = time.monotonic()
+
+    async def refresh_categories(self, category_ids: Iterable[int]) -> None:
+        ids = sorted({int(c) for c in category_ids if c is not None})
+        if not ids or self.loaded_at is None:
+            return
+        placeholders = ','.join(['%s'] * len(ids))
+        rows = await fetch_all('cms', f'SELECT {CATEGORY_INDEX_COLUMNS} FROM forum_categories WHERE id IN ({placeholders})', tuple(ids)) or []
+        found = {r['id']: _serialize_category(r) for r in rows}
+        for cid in ids:
+            if cid in found:
+                self._categories[cid] = found[cid]
+            else:
+                self._categories.pop(cid, None)
+        self._reorder()
+
+    async def get(self) -> List[dict]:
+        expired = self.loaded_at is None or (FORUM_INDEX_REFRESH > 0 and time.monotonic() - self.loaded_at > FORUM_INDEX_REFRESH)
+        if expired:
+            async with self._lock:
+                if self.loaded_at is None or (FORUM_INDEX_REFRESH > 0 and time.monotonic() - self.loaded_at > FORUM_INDEX_REFRESH):
+                    await self.reload()
+        return self._ordered
+
+
+forum_index = ForumIndex()
@@ -0,0 +1,54 @@
+from typing import Dict
+
+import aiohttp
+
+from config import (
+    HTTP_CLIENT_LIMIT, HTTP_CLIENT_LIMIT_PER_HOST, HTTP_CLIENT_KEEPALIVE,
+    HTTP_CLIENT_CONNECT_TIMEOUT, HTTP_CLIENT_TIMEOUT, HTTP_CLIENT_DNS_TTL,
+)
+
+# un pool por destino para que un worldserver lento no acapare conexiones de PayPal
+CLIENT_NAMES = ('soap', 'paypal')
+
+
+class HttpClients:
+    """App-lifetime aiohttp sessions, one per outbound integration.
+
+    Sessions are created in startup and closed in shutdown; each has its own
+    connector with per-host limits, keep-alive and cached DNS, so repeated calls
+    reuse open (TLS) connections instead of opening a new pool per request.
+    """
+
+    def __init__(self):
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+
+    def _create(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(limit=HTTP_CLIENT_LIMIT, limit_per_host=HTTP_CLIENT_LIMIT_PER_HOST,
+                                         keepalive_timeout=HTTP_CLIENT_KEEPALIVE, ttl_dns_cache=HTTP_CLIENT_DNS_TTL)
+        timeout = aiohttp.ClientTimeout(total=HTTP_CLIENT_TIMEOUT, connect=HTTP_CLIENT_CONNECT_TIMEOUT)
+        return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    def get(self, name: str) -> aiohttp.ClientSession:
+        """Sesión `name`; se crea al vuelo si se usa fuera del ciclo startup/shutdown."""
+        session = self._sessions.get(name)
+        if session is None or session.closed:
+            session = self._sessions[name] = self._create()
+        return session
+
+    def start(self):
+        for name in CLIENT_NAMES:
+            self.get(name)
+
+    async def close(self):
+        sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            if not session.closed:
+                await session.close()
+
+    def stats(self) -> dict:
+        return {name: {'closed': s.closed, 'limit': s.connector.limit if s.connector else None,
+                       'limit_per_host': s.connector.limit_per_host if s.connector else None}
+                for name, s in self._sessions.items()}
+
+
+http_clients = HttpClients()
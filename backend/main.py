@@ -1,9 +1,17 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 
 from db import db_pools, fetch_one
-from api.auth import router as auth_router
+from cache import versioned_caches
+from character_index import character_index
+from forum_counters import topic_counters
+from render import rerender_job
+from view_counter import view_counter
+from soap_delivery import soap_delivery
+from http_client import http_clients
+from world_items import start_preload as preload_world_items, stop_preload as stop_world_items_preload
+from api.auth import router as auth_router, require_admin
 from api.online import router as online_router
 from api.toppvp import router as toppvp_router
 from api.news import router as news_router
@@ -13,6 +21,7 @@ from api.armory import router as armory_router
 from api.shop import router as shop_router
 from api.vote import router as vote_router
 from api.donations import router as donations_router
+from api.search import router as search_router
 
 app = FastAPI(title="FastWoW CMS Backend")
 
@@ -34,10 +43,24 @@ class HealthResponse(BaseModel):
 @app.on_event("startup")
 async def startup_event():
     await db_pools.init_pools()
+    http_clients.start()
+    character_index.start()
+    topic_counters.start()
+    rerender_job.start()
+    view_counter.start()
+    soap_delivery.start()
+    preload_world_items()
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    await character_index.stop()
+    await topic_counters.stop()
+    await rerender_job.stop()
+    await view_counter.stop()
+    await soap_delivery.stop()
+    await stop_world_items_preload()
+    await http_clients.close()
     await db_pools.close_pools()
 
 
@@ -52,8 +75,33 @@ app.include_router(armory_router)
 app.include_router(shop_router)
 app.include_router(vote_router)
 app.include_router(donations_router)
+app.include_router(search_router)
 
 
 @app.get("/", response_model=dict)
 async def root():
     return {"ok": True, "service": "FastWoW CMS Backend"}
+
+
+@app.get("/db/pools", dependencies=[Depends(require_admin)])
+async def db_pool_stats():
+    """Tamaño actual, límites y esperas de acquire por schema (para ajustar POOL_CONFIG)."""
+    return {"pools": db_pools.stats()}
+
+
+@app.get("/cache/status", dependencies=[Depends(require_admin)])
+async def cache_status():
+    """Caches versionados (cache_versions): tamaño, aciertos y último error de sync/bump."""
+    return {"caches": [c.stats() for c in versioned_caches]}
+
+
+@app.get("/render/status", dependencies=[Depends(require_admin)])
+async def render_status():
+    return rerender_job.stats()
+
+
+@app.post("/render/rebuild", dependencies=[Depends(require_admin)])
+async def render_rebuild():
+    """Re-renderiza en segundo plano las filas con render_version anterior a la actual."""
+    rerender_job.start()
+    return rerender_job.stats()
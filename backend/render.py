@@ -0,0 +1,229 @@
+import asyncio
+import hashlib
+import html
+import re
+import time
+from typing import Iterable, List, Optional
+
+from db import db_pools, fetch_all, fetch_one, execute, tx_fetch_one
+
+# Subir al cambiar la salida del renderer: el job de re-render reprocesa las filas viejas
+RENDERER_VERSION = 1
+RENDERED_TABLES = ('news', 'news_comments', 'forum_posts')
+RERENDER_BATCH = 500
+# lock de MySQL: con varios workers solo uno re-renderiza
+RERENDER_LOCK = 'cms_rerender_job'
+
+_CODE_RE = re.compile(r'\[code\](.*?)\[/code\]', re.I | re.S)
+_SIMPLE_TAGS = (('b', 'strong'), ('i', 'em'), ('u', 'u'), ('s', 's'))
+_URL_RE = re.compile(r'\[url\](.*?)\[/url\]', re.I | re.S)
+_URL_NAMED_RE = re.compile(r'\[url=([^\]]+)\](.*?)\[/url\]', re.I | re.S)
+_IMG_RE = re.compile(r'\[img\](.*?)\[/img\]', re.I | re.S)
+_COLOR_RE = re.compile(r'\[color=(#[0-9a-f]{3}|#[0-9a-f]{6}|[a-z]{3,20})\](.*?)\[/color\]', re.I | re.S)
+# solo el quote más interno en cada pasada, para soportar anidados
+_QUOTE_RE = re.compile(r'\[quote(?:=([^\]\[]{1,32}))?\]((?:(?!\[quote).)*?)\[/quote\]', re.I | re.S)
+_LIST_RE = re.compile(r'\[list\](.*?)\[/list\]', re.I | re.S)
+_PLACEHOLDER_RE = re.compile(r'\x00(\d+)\x00')
+
+
+def content_hash(content: Optional[str]) -> str:
+    return hashlib.sha1((content or '').encode('utf-8')).hexdigest()
+
+
+def _safe_url(escaped: str) -> Optional[str]:
+    url = html.unescape(escaped).strip()
+    if not re.match(r'https?://[^\s"<>]+$', url, re.I):
+        return None
+    return html.escape(url, quote=True)
+
+
+def render(content: Optional[str]) -> str:
+    """BBCode -> HTML. Everything is escaped first and only whitelisted tags are turned
+    back into markup, so the output is safe to insert as HTML."""
+    if not content:
+        return ''
+    codes: List[str] = []
+
+    def _stash(m):
+        codes.append(m.group(1))
+        return f'\x00{len(codes) - 1}\x00'
+
+    # NUL es el marcador de los bloques [code] guardados: el texto del usuario no puede contenerlo
+    text = _CODE_RE.sub(_stash, content.replace('\x00', '').replace('\r\n', '\n'))
+    out = html.escape(text, quote=True)
+    for tag, html_tag in _SIMPLE_TAGS:
+        out = re.sub(rf'\[{tag}\](.*?)\[/{tag}\]', rf'<{html_tag}>\1</{html_tag}>', out, flags=re.I | re.S)
+
+    def _url(m):
+        href = _safe_url(m.group(1))
+        return f'<a href="{href}" rel="nofollow noopener" target="_blank">{m.group(1)}</a>' if href else m.group(0)
+
+    def _url_named(m):
+        href = _safe_url(m.group(1))
+        return f'<a href="{href}" rel="nofollow noopener" target="_blank">{m.group(2)}</a>' if href else m.group(2)
+
+    def _img(m):
+        src = _safe_url(m.group(1))
+        return f'<img src="{src}" alt="" loading="lazy">' if src else m.group(0)
+
+    out = _URL_RE.sub(_url, out)
+    out = _URL_NAMED_RE.sub(_url_named, out)
+    out = _IMG_RE.sub(_img, out)
+    out = _COLOR_RE.sub(r'<span style="color:\1">\2</span>', out)
+
+    def _quote(m):
+        author = f'<cite>{m.group(1)}</cite>' if m.group(1) else ''
+        return f'<blockquote>{author}{m.group(2)}</blockquote>'
+
+    while True:
+        out, n = _QUOTE_RE.subn(_quote, out)
+        if not n:
+            break
+
+    def _list(m):
+        items = [i.strip() for i in m.group(1).split('[*]') if i.strip()]
+        return '<ul>' + ''.join(f'<li>{i}</li>' for i in items) + '</ul>'
+
+    out = _LIST_RE.sub(_list, out)
+    out = out.replace('\n', '<br>\n')
+    return _PLACEHOLDER_RE.sub(lambda m: f'<pre><code>{html.escape(codes[int(m.group(1))], quote=True)}</code></pre>', out)
+
+
+def rendered_fields(content: Optional[str]) -> tuple:
+    """(content_html, content_hash, render_version) para guardar junto al contenido."""
+    return render(content), content_hash(content), RENDERER_VERSION
+
+
+def _is_stale(row: dict) -> bool:
+    if row.get('content_html') is None or row.get('render_version') != RENDERER_VERSION:
+        return True
+    # contenido cambiado sin re-renderizar (p. ej. editado directamente en la base)
+    return 'content_hash' in row and row.get('content_hash') != content_hash(row.get('content'))
+
+
+async def _store(table: str, rows: List[dict]) -> None:
+    ids = [r['id'] for r in rows]
+    html_cases = ' '.join('WHEN %s THEN %s' for _ in rows)
+    hash_cases = ' '.join('WHEN %s THEN %s' for _ in rows)
+    params: list = [v for r in rows for v in (r['id'], r['content_html'])]
+    params += [v for r in rows for v in (r['id'], r['content_hash'])]
+    params += [RENDERER_VERSION, *ids, RENDERER_VERSION]
+    placeholders = ','.join(['%s'] * len(ids))
+    # la condición final evita pisar una edición concurrente que ya guardó su propio HTML
+    await execute('cms', f'UPDATE {table} SET content_html = CASE id {html_cases} END, content_hash = CASE id {hash_cases} END, render_version = %s '
+                         f'WHERE id IN ({placeholders}) AND (content_html IS NULL OR render_version <> %s)', tuple(params))
+
+
+async def ensure_rendered(table: str, rows: Iterable[dict]) -> None:
+    """Render rows that predate the current renderer (normally done by the batch job)
+    and persist the result so it only happens once."""
+    stale = [r for r in rows if r and 'content' in r and _is_stale(r)]
+    if not stale:
+        return
+    for r in stale:
+        r['content_html'], r['content_hash'], r['render_version'] = rendered_fields(r.get('content'))
+    try:
+        await _store(table, stale)
+    except Exception:
+        # la respuesta ya lleva el HTML; se reintenta en la próxima lectura
+        pass
+
+
+class RerenderJob:
+    """Background job that re-renders, in batches, every row whose render_version is
+    older than RENDERER_VERSION (e.g. after a renderer change or a migration).
+
+    Every worker starts it, but it only scans the tables that have stale rows and
+    runs under a MySQL named lock, so a single worker does the work.
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self.rendered = 0
+        self.skipped = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    async def rerender_table(self, table: str) -> int:
+        done = 0
+        last_id = 0
+        while True:
+            rows = await fetch_all('cms', f'SELECT id, content FROM {table} WHERE id > %s AND (render_version <> %s OR content_html IS NULL) ORDER BY id ASC LIMIT %s',
+                                   (last_id, RENDERER_VERSION, RERENDER_BATCH)) or []
+            if not rows:
+                return done
+            for r in rows:
+                r['content_html'], r['content_hash'], r['render_version'] = rendered_fields(r.get('content'))
+            await _store(table, rows)
+            done += len(rows)
+            self.rendered += len(rows)
+            last_id = rows[-1]['id']
+            # cede el loop entre lotes
+            await asyncio.sleep(0)
+
+    async def _has_stale(self, table: str) -> bool:
+        # solo por render_version para usar su índice: las escrituras guardan HTML y versión juntos
+        row = await fetch_one('cms', f'SELECT 1 AS stale FROM {table} WHERE render_version <> %s LIMIT 1', (RENDERER_VERSION,))
+        return bool(row)
+
+    async def run(self) -> int:
+        self.started_at = time.time()
+        self.finished_at = None
+        total = 0
+        try:
+            tables = [t for t in RENDERED_TABLES if await self._has_stale(t)]
+            if tables:
+                total = await self._run_locked(tables)
+        except Exception as e:
+            self.last_error = str(e)
+        self.finished_at = time.time()
+        return total
+
+    async def _run_locked(self, tables: List[str]) -> int:
+        total = 0
+        # el lock pertenece a la sesión: se mantiene la misma conexión durante toda la pasada
+        async with db_pools.get_managed('cms').connection() as conn:
+            row = await tx_fetch_one(conn, 'SELECT GET_LOCK(%s, 0) AS got', (RERENDER_LOCK,))
+            if not (row and row.get('got')):
+                # otro worker ya está re-renderizando
+                self.skipped += 1
+                return 0
+            try:
+                for table in tables:
+                    total += await self.rerender_table(table)
+            finally:
+                try:
+                    await tx_fetch_one(conn, 'SELECT RELEASE_LOCK(%s) AS released', (RERENDER_LOCK,))
+                except BaseException:
+                    # sin liberar, el lock quedaría retenido en una conexión del pool
+                    conn.close()
+                    raise
+        return total
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    def stats(self) -> dict:
+        return {
+            'renderer_version': RENDERER_VERSION,
+            'running': bool(self._task and not self._task.done()),
+            'rendered': self.rendered,
+            'skipped': self.skipped,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'last_error': self.last_error,
+        }
+
+
+rerender_job = RerenderJob()
@@ -0,0 +1,388 @@
+import asyncio
+import math
+import time
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import aiomysql
+
+from config import SEARCH_BACKEND, SEARCH_INDEX_CHECK_INTERVAL, SEARCH_INDEX_MAX_DELTA, SEARCH_INDEX_LOG_RETENTION
+from db import fetch_all, fetch_one, execute
+
+# MySQL error 1191: Can't find FULLTEXT index matching the column list
+ER_FT_MATCHING_KEY_NOT_FOUND = 1191
+
+_token_re = re.compile(r'\w+', re.UNICODE)
+SNIPPET_LEN = 200
+DOC_TYPES = ('news', 'topic', 'post')
+
+
+def _tokenize(text: Optional[str]) -> List[str]:
+    if not text:
+        return []
+    # minúsculas y sin acentos para que "misión" y "mision" coincidan
+    norm = unicodedata.normalize('NFKD', text.lower())
+    norm = ''.join(ch for ch in norm if not unicodedata.combining(ch))
+    return [t for t in _token_re.findall(norm) if len(t) >= 2]
+
+
+def _snippet(text: Optional[str]) -> Optional[str]:
+    if not text:
+        return text
+    return text[:SNIPPET_LEN]
+
+
+class InvertedIndex:
+    """Incrementally maintained in-process inverted index (fallback without FULLTEXT).
+
+    Documents are keyed by (type, id); postings map token -> {doc_key: term frequency}.
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[Tuple[str, int], int]] = defaultdict(dict)
+        self.doc_tokens: Dict[Tuple[str, int], Dict[str, int]] = {}
+        self.docs: Dict[Tuple[str, int], dict] = {}
+
+    def add(self, doc_type: str, doc_id: int, text: str, meta: dict) -> None:
+        key = (doc_type, int(doc_id))
+        self.remove(doc_type, doc_id)
+        counts: Dict[str, int] = defaultdict(int)
+        for tok in _tokenize(text):
+            counts[tok] += 1
+        for tok, tf in counts.items():
+            self.postings[tok][key] = tf
+        self.doc_tokens[key] = dict(counts)
+        self.docs[key] = meta
+
+    def remove(self, doc_type: str, doc_id: int) -> None:
+        key = (doc_type, int(doc_id))
+        for tok in self.doc_tokens.pop(key, {}):
+            docs = self.postings.get(tok)
+            if docs is not None:
+                docs.pop(key, None)
+                if not docs:
+                    del self.postings[tok]
+        self.docs.pop(key, None)
+
+    def remove_where(self, doc_type: str, **match) -> None:
+        keys = [k for k, meta in self.docs.items() if k[0] == doc_type and all(meta.get(f) == v for f, v in match.items())]
+        for k in keys:
+            self.remove(*k)
+
+    def search(self, query: str, types: Tuple[str, ...]) -> List[Tuple[float, Tuple[str, int]]]:
+        n_docs = max(1, len(self.docs))
+        scores: Dict[Tuple[str, int], float] = defaultdict(float)
+        for tok in set(_tokenize(query)):
+            docs = self.postings.get(tok)
+            if not docs:
+                continue
+            idf = math.log(1.0 + n_docs / len(docs))
+            for key, tf in docs.items():
+                if key[0] in types and self.docs[key].get('visible', True):
+                    scores[key] += (1.0 + math.log(tf)) * idf
+        return sorted(((score, key) for key, score in scores.items()), key=lambda x: (-x[0], -x[1][1]))
+
+
+def _add_news(idx: InvertedIndex, row: dict) -> None:
+    text = ' '.join(filter(None, [row.get('title'), row.get('summary'), row.get('content')]))
+    idx.add('news', row['id'], text, {
+        'id': row['id'],
+        'title': row.get('title'),
+        'slug': row.get('slug'),
+        'snippet': row.get('summary') or _snippet(row.get('content')),
+        'visible': bool(row.get('is_published')),
+    })
+
+
+def _add_topic(idx: InvertedIndex, row: dict) -> None:
+    idx.add('topic', row['id'], row.get('title') or '', {
+        'id': row['id'],
+        'title': row.get('title'),
+        'category_id': row.get('category_id'),
+        'author': row.get('author_username'),
+    })
+
+
+def _add_post(idx: InvertedIndex, row: dict, topic_title: Optional[str] = None) -> None:
+    idx.add('post', row['id'], row.get('content') or '', {
+        'id': row['id'],
+        'topic_id': row.get('topic_id'),
+        'title': topic_title if topic_title is not None else row.get('topic_title'),
+        'author': row.get('author_username'),
+        'snippet': _snippet(row.get('content')),
+    })
+
+
+class SearchService:
+    """Search over news and forum content.
+
+    Uses MySQL FULLTEXT indexes (see sql/create_cms_tables.sql). If they are not
+    available the service switches to an in-process inverted index, built once from
+    the tables and kept up to date by the create/update/delete hooks below.
+
+    The hooks only update this worker's index, so they also append the changed
+    document to cms.search_index_changes; every SEARCH_INDEX_CHECK_INTERVAL seconds the
+    other workers re-read just those documents by id. A full rebuild only happens when
+    a worker fell too far behind (more than SEARCH_INDEX_MAX_DELTA changes, or longer
+    than half of SEARCH_INDEX_LOG_RETENTION, after which old entries are pruned).
+    """
+
+    def __init__(self):
+        self.mode = SEARCH_BACKEND if SEARCH_BACKEND in ('fulltext', 'memory') else 'fulltext'
+        self.index: Optional[InvertedIndex] = None
+        self._lock = asyncio.Lock()
+        self.log_id = 0
+        self._checked_at = 0.0
+        self._synced_at = 0.0
+        self._pruned_at = 0.0
+        self._outbox: List[Tuple[str, int, str]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+
+    # ---------- cross-worker propagation ----------
+    async def _flush_changes(self) -> None:
+        while self._outbox:
+            batch, self._outbox = self._outbox[:500], self._outbox[500:]
+            params = [v for change in batch for v in change]
+            try:
+                await execute('cms', 'INSERT INTO search_index_changes (doc_type, doc_id, op) VALUES '
+                                     + ', '.join(['(%s, %s, %s)'] * len(batch)), tuple(params))
+            except Exception:
+                # se reintenta con el siguiente cambio
+                self._outbox[:0] = batch
+                return
+        if time.monotonic() - self._pruned_at > 3600:
+            self._pruned_at = time.monotonic()
+            try:
+                await execute('cms', 'DELETE FROM search_index_changes WHERE created_at < NOW() - INTERVAL %s SECOND', (SEARCH_INDEX_LOG_RETENTION,))
+            except Exception:
+                pass
+
+    def _changed(self, doc_type: str, doc_id: int, op: str = 'upsert') -> None:
+        """Called by every hook: announces the change to the other workers."""
+        # con FULLTEXT no hay índice en memoria que sincronizar
+        if self.mode != 'memory':
+            return
+        self._outbox.append((doc_type, int(doc_id), op))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_changes())
+
+    async def _sync(self) -> None:
+        now = time.monotonic()
+        if self.index is None or now - self._checked_at < SEARCH_INDEX_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        async with self._lock:
+            try:
+                rows = await fetch_all('cms', 'SELECT id, doc_type, doc_id, op FROM search_index_changes WHERE id > %s ORDER BY id LIMIT %s',
+                                       (self.log_id, SEARCH_INDEX_MAX_DELTA + 1)) or []
+            except Exception:
+                return
+            # demasiados cambios, o el log pudo podarse desde la última sincronización
+            if len(rows) > SEARCH_INDEX_MAX_DELTA or now - self._synced_at > SEARCH_INDEX_LOG_RETENTION / 2:
+                await self._build_index()
+                return
+            if rows:
+                try:
+                    await self._apply_changes(rows)
+                except Exception:
+                    return
+                self.log_id = int(rows[-1]['id'])
+            self._synced_at = now
+
+    async def _apply_changes(self, rows: List[dict]) -> None:
+        """Re-read the changed documents by id (their own changes included: re-reading is idempotent)."""
+        idx = self.index
+        latest: Dict[Tuple[str, int], str] = {}
+        for r in rows:
+            key = (r['doc_type'], int(r['doc_id']))
+            latest.pop(key, None)
+            latest[key] = r['op']
+        upserts: Dict[str, List[int]] = defaultdict(list)
+        for (doc_type, doc_id), op in latest.items():
+            if op == 'upsert':
+                upserts[doc_type].append(doc_id)
+            elif doc_type == 'category':
+                topic_ids = [k[1] for k, meta in idx.docs.items() if k[0] == 'topic' and meta.get('category_id') == doc_id]
+                for tid in topic_ids:
+                    idx.remove('topic', tid)
+                    idx.remove_where('post', topic_id=tid)
+            else:
+                idx.remove(doc_type, doc_id)
+                if doc_type == 'topic':
+                    idx.remove_where('post', topic_id=doc_id)
+        # los documentos que ya no existen se quitan del índice
+        if upserts['news']:
+            ids = upserts['news']
+            found = await fetch_all('cms', f'SELECT id, title, slug, summary, content, is_published FROM news WHERE id IN ({", ".join(["%s"] * len(ids))})', tuple(ids)) or []
+            for row in found:
+                _add_news(idx, row)
+            for missing in set(ids) - {int(r['id']) for r in found}:
+                idx.remove('news', missing)
+        if upserts['topic']:
+            ids = upserts['topic']
+            found = await fetch_all('cms', f'SELECT id, title, category_id, author_username FROM forum_topics WHERE id IN ({", ".join(["%s"] * len(ids))})', tuple(ids)) or []
+            titles = {}
+            for row in found:
+                _add_topic(idx, row)
+                titles[int(row['id'])] = row.get('title')
+            for missing in set(ids) - set(titles):
+                idx.remove('topic', missing)
+                idx.remove_where('post', topic_id=missing)
+            for key, meta in idx.docs.items():
+                if key[0] == 'post' and meta.get('topic_id') in titles:
+                    meta['title'] = titles[meta['topic_id']]
+        if upserts['post']:
+            ids = upserts['post']
+            found = await fetch_all('cms', f'SELECT p.id, p.topic_id, p.author_username, p.content, t.title AS topic_title FROM forum_posts p JOIN forum_topics t ON t.id = p.topic_id '
+                                           f'WHERE p.id IN ({", ".join(["%s"] * len(ids))})', tuple(ids)) or []
+            for row in found:
+                _add_post(idx, row)
+            for missing in set(ids) - {int(r['id']) for r in found}:
+                idx.remove('post', missing)
+
+    # ---------- index maintenance (no-op while FULLTEXT is used) ----------
+    def _active_index(self) -> Optional[InvertedIndex]:
+        return self.index if self.mode == 'memory' else None
+
+    def index_news(self, row: dict) -> None:
+        if row:
+            self._changed('news', row['id'])
+        idx = self._active_index()
+        if idx is not None and row:
+            _add_news(idx, row)
+
+    def remove_news(self, news_id: int) -> None:
+        self._changed('news', news_id, 'delete')
+        idx = self._active_index()
+        if idx is not None:
+            idx.remove('news', news_id)
+
+    def index_topic(self, row: dict) -> None:
+        if row:
+            self._changed('topic', row['id'])
+        idx = self._active_index()
+        if idx is None or not row:
+            return
+        _add_topic(idx, row)
+        # los posts muestran el título del topic
+        for key, meta in idx.docs.items():
+            if key[0] == 'post' and meta.get('topic_id') == row['id']:
+                meta['title'] = row.get('title')
+
+    def set_topic_category(self, topic_id: int, category_id: int) -> None:
+        self._changed('topic', topic_id)
+        idx = self._active_index()
+        meta = idx.docs.get(('topic', int(topic_id))) if idx is not None else None
+        if meta is not None:
+            meta['category_id'] = category_id
+
+    def remove_topic(self, topic_id: int) -> None:
+        self._changed('topic', topic_id, 'delete')
+        idx = self._active_index()
+        if idx is not None:
+            idx.remove('topic', topic_id)
+            idx.remove_where('post', topic_id=topic_id)
+
+    def remove_category(self, category_id: int) -> None:
+        self._changed('category', category_id, 'delete')
+        idx = self._active_index()
+        if idx is None:
+            return
+        topic_ids = [k[1] for k, meta in idx.docs.items() if k[0] == 'topic' and meta.get('category_id') == category_id]
+        for tid in topic_ids:
+            idx.remove('topic', tid)
+            idx.remove_where('post', topic_id=tid)
+
+    def index_post(self, row: dict, topic_title: Optional[str] = None) -> None:
+        if row:
+            self._changed('post', row['id'])
+        idx = self._active_index()
+        if idx is not None and row:
+            _add_post(idx, row, topic_title)
+
+    def remove_post(self, post_id: int) -> None:
+        self._changed('post', post_id, 'delete')
+        idx = self._active_index()
+        if idx is not None:
+            idx.remove('post', post_id)
+
+    # ---------- build ----------
+    async def _build_index(self) -> None:
+        """Build a fresh index and swap it in; searches keep using the old one meanwhile."""
+        # la posición del log se lee antes que las tablas: los cambios durante la carga se reaplican después
+        try:
+            row = await fetch_one('cms', 'SELECT COALESCE(MAX(id), 0) AS last_id FROM search_index_changes')
+            log_id = int(row.get('last_id') or 0) if row else 0
+        except Exception:
+            log_id = self.log_id
+        index = InvertedIndex()
+        for row in (await fetch_all('cms', 'SELECT id, title, slug, summary, content, is_published FROM news') or []):
+            _add_news(index, row)
+        for row in (await fetch_all('cms', 'SELECT id, title, category_id, author_username FROM forum_topics') or []):
+            _add_topic(index, row)
+        for row in (await fetch_all('cms', 'SELECT p.id, p.topic_id, p.author_username, p.content, t.title AS topic_title FROM forum_posts p JOIN forum_topics t ON t.id = p.topic_id') or []):
+            _add_post(index, row)
+        self.index = index
+        self.log_id = log_id
+        self._checked_at = self._synced_at = time.monotonic()
+
+    async def _use_memory(self) -> None:
+        async with self._lock:
+            self.mode = 'memory'
+            if self.index is None:
+                await self._build_index()
+
+    # ---------- search ----------
+    async def _fulltext(self, query: str, types: Tuple[str, ...], limit: int) -> List[dict]:
+        out = []
+        if 'news' in types:
+            rows = await fetch_all('cms', 'SELECT id, title, slug, summary, LEFT(content, %s) AS snippet, MATCH(title, summary, content) AGAINST (%s IN NATURAL LANGUAGE MODE) AS score '
+                                          'FROM news WHERE is_published = 1 AND MATCH(title, summary, content) AGAINST (%s IN NATURAL LANGUAGE MODE) '
+                                          'ORDER BY score DESC, id DESC LIMIT %s', (SNIPPET_LEN, query, query, limit))
+            for r in (rows or []):
+                out.append({'type': 'news', 'id': r['id'], 'title': r.get('title'), 'slug': r.get('slug'), 'snippet': r.get('summary') or r.get('snippet'), 'score': float(r.get('score') or 0)})
+        if 'topic' in types:
+            rows = await fetch_all('cms', 'SELECT id, category_id, title, author_username, MATCH(title) AGAINST (%s IN NATURAL LANGUAGE MODE) AS score '
+                                          'FROM forum_topics WHERE MATCH(title) AGAINST (%s IN NATURAL LANGUAGE MODE) '
+                                          'ORDER BY score DESC, id DESC LIMIT %s', (query, query, limit))
+            for r in (rows or []):
+                out.append({'type': 'topic', 'id': r['id'], 'title': r.get('title'), 'category_id': r.get('category_id'), 'author': r.get('author_username'), 'score': float(r.get('score') or 0)})
+        if 'post' in types:
+            rows = await fetch_all('cms', 'SELECT p.id, p.topic_id, t.title AS topic_title, p.author_username, LEFT(p.content, %s) AS snippet, MATCH(p.content) AGAINST (%s IN NATURAL LANGUAGE MODE) AS score '
+                                          'FROM forum_posts p JOIN forum_topics t ON t.id = p.topic_id WHERE MATCH(p.content) AGAINST (%s IN NATURAL LANGUAGE MODE) '
+                                          'ORDER BY score DESC, p.id DESC LIMIT %s', (SNIPPET_LEN, query, query, limit))
+            for r in (rows or []):
+                out.append({'type': 'post', 'id': r['id'], 'topic_id': r.get('topic_id'), 'title': r.get('topic_title'), 'author': r.get('author_username'), 'snippet': r.get('snippet'), 'score': float(r.get('score') or 0)})
+        out.sort(key=lambda x: (-x['score'], -x['id']))
+        return out
+
+    def _memory(self, query: str, types: Tuple[str, ...]) -> List[dict]:
+        out = []
+        for score, key in self.index.search(query, types):
+            meta = {k: v for k, v in self.index.docs[key].items() if k != 'visible'}
+            out.append({'type': key[0], **meta, 'score': round(score, 4)})
+        return out
+
+    async def search(self, query: str, types: Tuple[str, ...] = DOC_TYPES, page: int = 1, page_size: int = 20) -> dict:
+        end = page * page_size
+        if self.mode == 'fulltext':
+            try:
+                results = await self._fulltext(query, types, end + 1)
+            except aiomysql.OperationalError as e:
+                if not e.args or e.args[0] != ER_FT_MATCHING_KEY_NOT_FOUND or SEARCH_BACKEND == 'fulltext':
+                    raise
+                await self._use_memory()
+                results = self._memory(query, types)
+        else:
+            if self.index is None:
+                await self._use_memory()
+            else:
+                await self._sync()
+            results = self._memory(query, types)
+        items = results[end - page_size:end]
+        return {'items': items, 'pagination': {'page': page, 'page_size': page_size, 'has_more': len(results) > end}, 'backend': self.mode}
+
+
+search_service = SearchService()
@@ -0,0 +1,76 @@
+import asyncio
+from typing import Dict, Iterable, List, Optional
+
+from cache import VersionedCache
+from config import SHOP_CATALOG_TTL, SHOP_CATALOG_CHECK_INTERVAL
+from db import fetch_all
+
+
+class _Snapshot:
+    def __init__(self, categories: List[dict], items: List[dict]):
+        self.categories = categories
+        self.items_by_id: Dict[int, dict] = {it['id']: it for it in items}
+        realms = {it.get('realm_id') for it in items if it.get('realm_id') is not None}
+        # (category_id | None, realm_id | None) -> items visibles, id DESC como el listado original.
+        # realm None => sin filtro; un realm concreto => items de ese realm + globales
+        self._lists: Dict[tuple, List[dict]] = {}
+        ordered = sorted(items, key=lambda it: -it['id'])
+        for cat in [None, *(c['id'] for c in categories)]:
+            in_cat = [it for it in ordered if cat is None or it.get('category_id') == cat]
+            self._lists[(cat, None)] = in_cat
+            self._lists[(cat, 'global')] = [it for it in in_cat if it.get('realm_id') is None]
+            for realm_id in realms:
+                self._lists[(cat, realm_id)] = [it for it in in_cat if it.get('realm_id') in (None, realm_id)]
+
+    def items(self, category_id: Optional[int] = None, realm_id: Optional[int] = None) -> List[dict]:
+        lst = self._lists.get((category_id, realm_id))
+        if lst is None:
+            # categoría inexistente o realm sin items propios
+            lst = self._lists.get((category_id, 'global'), []) if realm_id is not None else []
+        return lst
+
+
+class ShopCatalog:
+    """Shop categories and enabled items held in memory, pre-indexed by category and realm.
+
+    Admin edits call `invalidate()`, which bumps the 'shop_catalog' version in
+    cms.cache_versions; every worker reloads the whole catalog (two queries) on its
+    next access after noticing the new version.
+    """
+
+    def __init__(self):
+        self._cache = VersionedCache('shop_catalog', maxsize=1, ttl=SHOP_CATALOG_TTL, check_interval=SHOP_CATALOG_CHECK_INTERVAL)
+        self._lock = asyncio.Lock()
+
+    async def _load(self) -> _Snapshot:
+        categories = await fetch_all('cms', 'SELECT * FROM shop_categories ORDER BY position ASC, id ASC') or []
+        items = await fetch_all('cms', 'SELECT * FROM shop_items WHERE is_enabled = 1') or []
+        return _Snapshot(list(categories), list(items))
+
+    async def snapshot(self) -> _Snapshot:
+        await self._cache.sync()
+        snap = self._cache.get('catalog')
+        if snap is None:
+            async with self._lock:
+                snap = self._cache.get('catalog')
+                if snap is None:
+                    snap = await self._load()
+                    self._cache.set('catalog', snap)
+        return snap
+
+    async def categories(self) -> List[dict]:
+        return (await self.snapshot()).categories
+
+    async def items(self, category_id: Optional[int] = None, realm_id: Optional[int] = None) -> List[dict]:
+        return (await self.snapshot()).items(category_id, realm_id)
+
+    async def get_items(self, ids: Iterable[int]) -> Dict[int, dict]:
+        """Enabled items by id (missing or disabled ids are left out)."""
+        by_id = (await self.snapshot()).items_by_id
+        return {int(i): by_id[int(i)] for i in ids if int(i) in by_id}
+
+    async def invalidate(self) -> None:
+        await self._cache.bump()
+
+
+shop_catalog = ShopCatalog()
@@ -0,0 +1,58 @@
+from typing import Dict, List
+
+from config import SHOP_LIMIT_COUNTERS
+from db import fetch_all, tx_execute, tx_fetch_all
+
+# Cantidades compradas por item: líneas de shop_purchase_items más las compras legacy
+# single-item (item_id en shop_purchases, sin líneas), todo en una consulta
+_BOUGHT_SQL = ("SELECT item_id, SUM(qty) AS bought FROM ("
+               " SELECT pi.shop_item_id AS item_id, pi.quantity AS qty FROM shop_purchase_items pi JOIN shop_purchases p ON p.id = pi.purchase_id"
+               " WHERE p.username = %s AND pi.shop_item_id IN ({ph})"
+               " UNION ALL"
+               " SELECT p.item_id, 1 FROM shop_purchases p WHERE p.username = %s AND p.item_id IN ({ph})"
+               " AND NOT EXISTS (SELECT 1 FROM shop_purchase_items pi WHERE pi.purchase_id = p.id)"
+               ") b GROUP BY item_id")
+_COUNTERS_SQL = 'SELECT shop_item_id AS item_id, quantity AS bought FROM shop_purchase_limits WHERE username = %s AND shop_item_id IN ({ph})'
+
+
+async def _fetch(conn, query: str, params: tuple) -> list:
+    if conn is not None:
+        return await tx_fetch_all(conn, query, params) or []
+    return await fetch_all('cms', query, params) or []
+
+
+async def bought_quantities(username: str, item_ids: List[int], conn=None) -> Dict[int, int]:
+    """Units of each item already bought by `username` (one query for the whole cart)."""
+    ids = sorted({int(i) for i in item_ids})
+    if not ids:
+        return {}
+    ph = ','.join(['%s'] * len(ids))
+    if SHOP_LIMIT_COUNTERS:
+        rows = await _fetch(conn, _COUNTERS_SQL.format(ph=ph), (username, *ids))
+    else:
+        rows = await _fetch(conn, _BOUGHT_SQL.format(ph=ph), (username, *ids, username, *ids))
+    return {int(r['item_id']): int(r.get('bought') or 0) for r in rows}
+
+
+async def exceeded_limits(username: str, cart: Dict[int, int], limits: Dict[int, int], conn=None) -> List[int]:
+    """Ids whose limit_per_account would be exceeded by buying `cart` (item_id -> units).
+
+    Inside the purchase transaction (after locking the account row) the result is
+    authoritative: concurrent purchases of the same user are serialized.
+    """
+    limited = [i for i in cart if limits.get(i)]
+    if not limited:
+        return []
+    bought = await bought_quantities(username, limited, conn=conn)
+    return [i for i in limited if bought.get(i, 0) + cart[i] > limits[i]]
+
+
+async def record_purchase(username: str, cart: Dict[int, int], limits: Dict[int, int], conn) -> None:
+    """Add the bought units of limited items to shop_purchase_limits (if SHOP_LIMIT_COUNTERS)."""
+    limited = [i for i in cart if limits.get(i)]
+    if not SHOP_LIMIT_COUNTERS or not limited:
+        return
+    values = ','.join(['(%s,%s,%s)'] * len(limited))
+    params = tuple(v for i in limited for v in (username, i, cart[i]))
+    await tx_execute(conn, f'INSERT INTO shop_purchase_limits (username, shop_item_id, quantity) VALUES {values} '
+                           'ON DUPLICATE KEY UPDATE quantity = quantity + VALUES(quantity)', params)
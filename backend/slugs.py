@@ -0,0 +1,68 @@
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import aiomysql
+
+from db import fetch_all
+
+T = TypeVar('T')
+
+# MySQL error 1062: Duplicate entry ... for key ...
+ER_DUP_ENTRY = 1062
+
+
+def _like_escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _with_suffix(base: str, n: int, max_len: Optional[int]) -> str:
+    suffix = f'-{n}'
+    if max_len and len(base) + len(suffix) > max_len:
+        # solo se recorta la base cuando el sufijo no cabe
+        base = base[:max(1, max_len - len(suffix))].rstrip('-') or base[:1]
+    return base + suffix
+
+
+async def next_free_slug(table: str, base: str, first_suffix: int = 2, max_len: Optional[int] = None) -> str:
+    """Next free slug for `base` in `table` with a single query.
+
+    Returns `base` if it is free, otherwise `base-N` with the lowest free N from
+    `first_suffix` up. Existing slugs such as `base-2024` only matter if N reaches
+    them, so unrelated slugs that happen to share the prefix do not inflate N.
+    """
+    if max_len:
+        base = base[:max_len].rstrip('-') or base[:1]
+        # la base recortada para el sufijo más largo razonable; el resto se compara en Python
+        prefix = base[:max(1, max_len - 11)]
+    else:
+        prefix = base + '-'
+    rows = await fetch_all('cms', f'SELECT slug FROM {table} WHERE slug = %s OR slug LIKE %s', (base, _like_escape(prefix) + '%')) or []
+    taken = {r.get('slug') for r in rows}
+    if base not in taken:
+        return base
+    n = first_suffix
+    while _with_suffix(base, n, max_len) in taken:
+        n += 1
+    return _with_suffix(base, n, max_len)
+
+
+def _is_duplicate_slug(exc: Exception) -> bool:
+    if not isinstance(exc, aiomysql.IntegrityError) or not exc.args:
+        return False
+    return exc.args[0] == ER_DUP_ENTRY and 'slug' in str(exc.args[-1]).lower()
+
+
+async def with_unique_slug(table: str, base: str, write: Callable[[str], Awaitable[T]], first_suffix: int = 2, max_len: Optional[int] = None, attempts: int = 5) -> T:
+    """Run `write(slug)` (the INSERT/UPDATE that stores the slug) with a free slug.
+
+    If a concurrent request took the same slug first, the unique key rejects the
+    write and a new slug is allocated and retried.
+    """
+    for attempt in range(attempts):
+        slug = await next_free_slug(table, base, first_suffix=first_suffix, max_len=max_len)
+        try:
+            return await write(slug)
+        except Exception as e:
+            if attempt + 1 < attempts and _is_duplicate_slug(e):
+                continue
+            raise
+    raise RuntimeError('No se pudo asignar un slug único')
@@ -0,0 +1,370 @@
+import asyncio
+import random
+import time
+from typing import Dict, List, Optional, Set
+
+import aiohttp
+
+from config import (
+    SOAP_DELIVERY_POLL_INTERVAL, SOAP_DELIVERY_BATCH, SOAP_DELIVERY_REALM_CONCURRENCY,
+    SOAP_DELIVERY_MAX_ATTEMPTS, SOAP_DELIVERY_BACKOFF_BASE, SOAP_DELIVERY_BACKOFF_MAX, SOAP_DELIVERY_STALE_AFTER,
+)
+from http_client import http_clients
+from world_items import get_stack_sizes
+from db import fetch_one, fetch_all, execute, begin_transaction, release_connection, tx_execute, tx_fetch_one, tx_fetch_all
+
+MAIL_MAX_ITEMS = 12  # AzerothCore soporta 12 attachments en 'send items'
+MAIL_SUBJECT = 'Compra Tienda'
+CLAIM_LOCK = 'soap_delivery_claim'
+
+_CLAIM_SQL = ("SELECT id, purchase_id, realm_id, attempts, mails_sent FROM soap_delivery_jobs "
+              "WHERE ((status = 'pending' AND next_attempt_at <= NOW()) OR (status = 'running' AND locked_at < NOW() - INTERVAL %s SECOND)){realm_filter} "
+              "ORDER BY next_attempt_at ASC, id ASC LIMIT %s FOR UPDATE SKIP LOCKED")
+
+
+class DeliveryError(Exception):
+    """Fallo de entrega; `permanent` => no se reintenta (dead letter directo)."""
+
+    def __init__(self, message: str, permanent: bool = False):
+        super().__init__(message)
+        self.permanent = permanent
+
+
+# --------------- SOAP ---------------
+async def _load_realm_soap_config(realm_id: int | None) -> dict | None:
+    """Obtiene configuración SOAP desde cms.realms.
+
+    Campos relevantes: soap_enabled, soap_endpoint, soap_user, soap_password, soap_timeout.
+    Usa realm_id (columna realm_id en tabla) y no id autoincrement.
+    """
+    if realm_id is None:
+        return None
+    row = await fetch_one('cms', 'SELECT soap_enabled, soap_endpoint, soap_user, soap_password, soap_timeout FROM realms WHERE realm_id = %s', (realm_id,))
+    if not row:
+        return None
+    return {
+        'enabled': bool(row.get('soap_enabled')),
+        'endpoint': row.get('soap_endpoint'),
+        'user': row.get('soap_user'),
+        'password': row.get('soap_password'),
+        'timeout': row.get('soap_timeout') or 30,
+        # compat keys para la función previa
+        'host': row.get('soap_endpoint') or '',
+        'port': 0,
+    }
+
+
+async def _soap_execute(cfg: dict, command: str) -> str:
+    """Ejecuta un comando SOAP simple usando HTTP POST estilo AzerothCore.
+    Si el core usa SOAP clásico PHP ext/Soap, esta versión HTTP puede necesitar adaptarse.
+    """
+    # Placeholder genérico usando aiohttp, esperando endpoint estilo http://host:port/ con basic auth (si se configurara).
+    # Muchos cores usan autenticación básica. Ajustar según entorno real.
+    url = cfg.get('endpoint') or f"http://{cfg['host']}:{cfg['port']}"
+    auth = aiohttp.BasicAuth(cfg['user'], cfg['password']) if cfg.get('user') else None
+    envelope = f'''<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" xmlns:ns1="urn:AC">
+  <SOAP-ENV:Body>
+    <ns1:executeCommand>
+      <command>{command}</command>
+    </ns1:executeCommand>
+  </SOAP-ENV:Body>
+</SOAP-ENV:Envelope>'''
+    headers = {'Content-Type': 'text/xml; charset=utf-8'}
+    timeout = aiohttp.ClientTimeout(total=cfg.get('timeout', 15))
+    # sesión compartida: los mails de una misma entrega reutilizan la conexión keep-alive
+    async with http_clients.get('soap').post(url, data=envelope.encode('utf-8'), auth=auth, headers=headers, timeout=timeout) as resp:
+        text = await resp.text()
+        if resp.status >= 400:
+            raise RuntimeError(f'Status {resp.status}: {text[:300]}')
+        return text
+
+
+async def _update_purchase_soap(purchase_id: int, success: bool, response: str):
+    try:
+        await execute('cms', 'UPDATE shop_purchases SET sent_via_soap = %s, soap_response = %s WHERE id = %s', (1 if success else 0, response, purchase_id))
+    except Exception:
+        pass
+
+
+async def purchase_items(purchase: dict) -> list:
+    """Items de una compra; las compras legacy single-item usan shop_purchases.item_id."""
+    items = await fetch_all('cms', 'SELECT * FROM shop_purchase_items WHERE purchase_id = %s', (purchase['id'],)) or []
+    if not items and purchase.get('item_id'):
+        legacy_item = await fetch_one('cms', 'SELECT id AS shop_item_id, world_item_entry FROM shop_items WHERE id = %s', (purchase.get('item_id'),))
+        if legacy_item:
+            items = [{'world_item_entry': legacy_item.get('world_item_entry'), 'quantity': 1}]
+    return items
+
+
+async def _build_mails(items: list) -> List[list]:
+    """Agrupa por entry, divide en stacks según item_template.stackable y reparte en
+    mails de MAIL_MAX_ITEMS. El resultado es determinista, así un reintento puede
+    saltarse los mails ya enviados."""
+    entry_counts: Dict[int, int] = {}
+    for it in items:
+        entry = it.get('world_item_entry')
+        qty = int(it.get('quantity') or 1)
+        entry_counts[entry] = entry_counts.get(entry, 0) + qty
+    # tamaño de stack desde el cache de item_template (una consulta IN solo para entries no cacheadas)
+    stack_sizes = await get_stack_sizes(entry_counts)
+    stacks = []  # lista de (entry, stack_qty)
+    for entry, total_qty in entry_counts.items():
+        max_stack = stack_sizes.get(int(entry), 1) if entry else 1
+        remaining = total_qty
+        while remaining > 0:
+            take = min(remaining, max_stack)
+            stacks.append((entry, take))
+            remaining -= take
+    return [stacks[i:i + MAIL_MAX_ITEMS] for i in range(0, len(stacks), MAIL_MAX_ITEMS)]
+
+
+# --------------- Cola ---------------
+async def enqueue_delivery(purchase_id: int, realm_id: Optional[int], conn=None) -> int:
+    """Crea el job de entrega. Con `conn` se inserta dentro de la transacción de la compra."""
+    q = 'INSERT INTO soap_delivery_jobs (purchase_id, realm_id) VALUES (%s, %s)'
+    if conn is not None:
+        _, job_id = await tx_execute(conn, q, (purchase_id, realm_id))
+    else:
+        _, job_id = await execute('cms', q, (purchase_id, realm_id))
+    return job_id
+
+
+def backoff_delay(attempts: int) -> float:
+    """Espera exponencial (base * 2^(n-1), con tope) y un 10% de jitter."""
+    delay = min(SOAP_DELIVERY_BACKOFF_BASE * (2 ** max(attempts - 1, 0)), SOAP_DELIVERY_BACKOFF_MAX)
+    return delay * random.uniform(0.9, 1.1)
+
+
+class SoapDeliveryWorker:
+    """Background worker for soap_delivery_jobs.
+
+    Jobs are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so several workers can
+    share the table; claims are serialized with a MySQL named lock and count the
+    'running' jobs of every process, so at most SOAP_DELIVERY_REALM_CONCURRENCY
+    commands per realm are in flight across all workers. Failures are retried with exponential backoff and
+    end up as dead letters ('dead') after SOAP_DELIVERY_MAX_ATTEMPTS.
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._jobs: Dict[int, asyncio.Task] = {}
+        self._in_flight: Dict[Optional[int], int] = {}
+        self._wake = asyncio.Event()
+        self.realms: Dict[Optional[int], dict] = {}
+        self.last_error: Optional[str] = None
+
+    def _realm(self, realm_id: Optional[int]) -> dict:
+        return self.realms.setdefault(realm_id, {'delivered': 0, 'retried': 0, 'dead': 0, 'mails': 0, 'last_delivery_at': None})
+
+    def notify(self) -> None:
+        """Despierta el loop (p.ej. tras encolar una compra) sin esperar al intervalo."""
+        self._wake.set()
+
+    async def _claim(self) -> list:
+        free = SOAP_DELIVERY_BATCH - len(self._jobs)
+        if free <= 0:
+            return []
+        conn, tx = await begin_transaction('cms')
+        locked = False
+        try:
+            # los claims se serializan entre procesos para que el tope por realm sea global
+            row = await tx_fetch_one(conn, 'SELECT GET_LOCK(%s, 0) AS got', (CLAIM_LOCK,))
+            locked = bool(row and row.get('got'))
+            if not locked:
+                # otro worker está reclamando; se reintenta en el próximo ciclo
+                await tx.rollback()
+                return []
+            # comandos en curso por realm en todas las instancias (los 'running' vencidos se pueden reclamar)
+            running = await tx_fetch_all(conn, "SELECT realm_id, COUNT(*) AS n FROM soap_delivery_jobs WHERE status = 'running' "
+                                               'AND locked_at >= NOW() - INTERVAL %s SECOND GROUP BY realm_id', (SOAP_DELIVERY_STALE_AFTER,))
+            slots = {r.get('realm_id'): int(r.get('n') or 0) for r in running}
+            full = [r for r, n in slots.items() if n >= SOAP_DELIVERY_REALM_CONCURRENCY]
+            realm_filter, params = '', [SOAP_DELIVERY_STALE_AFTER]
+            full_ids = [r for r in full if r is not None]
+            if full_ids:
+                realm_filter = f" AND (realm_id IS NULL OR realm_id NOT IN ({','.join(['%s'] * len(full_ids))}))"
+                params += full_ids
+            if None in full:
+                realm_filter += ' AND realm_id IS NOT NULL'
+            params.append(SOAP_DELIVERY_BATCH)
+            rows = await tx_fetch_all(conn, _CLAIM_SQL.format(realm_filter=realm_filter), tuple(params))
+            picked = []
+            for row in rows:
+                if len(picked) >= free:
+                    break
+                realm_id = row.get('realm_id')
+                if slots.get(realm_id, 0) >= SOAP_DELIVERY_REALM_CONCURRENCY:
+                    continue
+                slots[realm_id] = slots.get(realm_id, 0) + 1
+                picked.append(row)
+            if picked:
+                ids = [r['id'] for r in picked]
+                await tx_execute(conn, f"UPDATE soap_delivery_jobs SET status = 'running', locked_at = NOW() WHERE id IN ({','.join(['%s'] * len(ids))})", tuple(ids))
+            # las filas no elegidas se liberan con el commit
+            await tx.commit()
+        except Exception:
+            await tx.rollback()
+            raise
+        finally:
+            if locked:
+                try:
+                    await tx_execute(conn, 'SELECT RELEASE_LOCK(%s)', (CLAIM_LOCK,))
+                except Exception:
+                    pass
+            await release_connection('cms', conn)
+        return picked
+
+    async def _deliver(self, job: dict) -> str:
+        purchase = await fetch_one('cms', 'SELECT * FROM shop_purchases WHERE id = %s', (job['purchase_id'],))
+        if not purchase:
+            raise DeliveryError('Compra no encontrada', permanent=True)
+        character_name = purchase.get('character_name') or ''
+        if not character_name:
+            raise DeliveryError('Sin personaje destino', permanent=True)
+        items = await purchase_items(purchase)
+        if not items:
+            raise DeliveryError('Compra sin items asociados', permanent=True)
+        if purchase.get('realm_id') is None:
+            # sin realm nunca habrá config SOAP
+            raise DeliveryError('SOAP deshabilitado o config ausente (compra sin realm)', permanent=True)
+        soap_cfg = await _load_realm_soap_config(purchase.get('realm_id'))
+        if not soap_cfg or not soap_cfg.get('enabled'):
+            # puede habilitarse más tarde: se reintenta
+            raise DeliveryError('SOAP deshabilitado o config ausente')
+        body = f"Gracias por tu compra, {character_name}!"
+        mails = await _build_mails(items)
+        responses = []
+        for idx in range(int(job.get('mails_sent') or 0), len(mails)):
+            parts = ' '.join(f'{e}:{c}' for e, c in mails[idx])
+            command = f'send items {character_name} "{MAIL_SUBJECT}" "{body}" {parts}'
+            try:
+                resp_text = await _soap_execute(soap_cfg, command)
+            except Exception as e:
+                raise DeliveryError(f'Mail {idx + 1}/{len(mails)}: {e}')
+            responses.append(resp_text[:1000])
+            job['mails_sent'] = idx + 1
+            self._realm(job.get('realm_id'))['mails'] += 1
+            # progreso persistido tras cada mail (también el último): si el worker cae, el reintento no duplica mails
+            await execute('cms', 'UPDATE soap_delivery_jobs SET mails_sent = %s, locked_at = NOW() WHERE id = %s', (idx + 1, job['id']))
+        return '\n---\n'.join(responses)[:2000]
+
+    async def _heartbeat(self, job_id: int) -> None:
+        # mantiene locked_at reciente mientras el job corre, para que otro worker no lo reclame como caído
+        while True:
+            await asyncio.sleep(max(1.0, SOAP_DELIVERY_STALE_AFTER / 3))
+            try:
+                await execute('cms', "UPDATE soap_delivery_jobs SET locked_at = NOW() WHERE id = %s AND status = 'running'", (job_id,))
+            except Exception as e:
+                self.last_error = f'heartbeat job {job_id}: {e}'
+
+    async def _run(self, job: dict) -> None:
+        realm_id = job.get('realm_id')
+        stats = self._realm(realm_id)
+        attempts = int(job.get('attempts') or 0) + 1
+        heartbeat = asyncio.create_task(self._heartbeat(job['id']))
+        try:
+            response = await self._deliver(job)
+        except Exception as e:
+            error = str(e)[:2000]
+            dead = (isinstance(e, DeliveryError) and e.permanent) or attempts >= SOAP_DELIVERY_MAX_ATTEMPTS
+            if dead:
+                stats['dead'] += 1
+                await execute('cms', "UPDATE soap_delivery_jobs SET status = 'dead', attempts = %s, mails_sent = %s, last_error = %s, locked_at = NULL WHERE id = %s",
+                              (attempts, job.get('mails_sent') or 0, error, job['id']))
+            else:
+                stats['retried'] += 1
+                await execute('cms', "UPDATE soap_delivery_jobs SET status = 'pending', attempts = %s, mails_sent = %s, last_error = %s, locked_at = NULL, "
+                                     "next_attempt_at = NOW() + INTERVAL %s SECOND WHERE id = %s",
+                              (attempts, job.get('mails_sent') or 0, error, int(backoff_delay(attempts)), job['id']))
+            await _update_purchase_soap(job['purchase_id'], False, error)
+            return
+        finally:
+            heartbeat.cancel()
+        await execute('cms', "UPDATE soap_delivery_jobs SET status = 'done', attempts = %s, mails_sent = %s, last_error = NULL, locked_at = NULL WHERE id = %s",
+                      (attempts, job.get('mails_sent') or 0, job['id']))
+        await _update_purchase_soap(job['purchase_id'], True, response)
+        stats['delivered'] += 1
+        stats['last_delivery_at'] = time.time()
+
+    def _spawn(self, job: dict) -> None:
+        realm_id = job.get('realm_id')
+        self._in_flight[realm_id] = self._in_flight.get(realm_id, 0) + 1
+
+        async def _job():
+            try:
+                await self._run(job)
+            except Exception as e:
+                # si falla el UPDATE final el job queda 'running' y se reclama al vencer SOAP_DELIVERY_STALE_AFTER
+                self.last_error = f'job {job["id"]}: {e}'
+            finally:
+                self._in_flight[realm_id] -= 1
+                self._jobs.pop(job['id'], None)
+                self._wake.set()
+
+        self._jobs[job['id']] = asyncio.create_task(_job())
+
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=SOAP_DELIVERY_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                for job in await self._claim():
+                    self._spawn(job)
+            except Exception as e:
+                self.last_error = f'claim: {e}'
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self, timeout: float = 10.0):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        jobs = dict(self._jobs)
+        if not jobs:
+            return
+        # deja terminar los envíos en curso; los que no llegan se devuelven a la cola
+        await asyncio.wait(list(jobs.values()), timeout=timeout)
+        unfinished = [jid for jid, task in jobs.items() if not task.done()]
+        for jid in unfinished:
+            jobs[jid].cancel()
+        if unfinished:
+            try:
+                await execute('cms', f"UPDATE soap_delivery_jobs SET status = 'pending', locked_at = NULL WHERE status = 'running' AND id IN ({','.join(['%s'] * len(unfinished))})",
+                              tuple(unfinished))
+            except Exception as e:
+                self.last_error = f'stop: {e}'
+
+    async def retry(self, job_id: int) -> bool:
+        """Vuelve a encolar un dead letter (intentos a cero)."""
+        rowcount, _ = await execute('cms', "UPDATE soap_delivery_jobs SET status = 'pending', attempts = 0, next_attempt_at = NOW(), last_error = NULL WHERE id = %s AND status = 'dead'", (job_id,))
+        if rowcount:
+            self.notify()
+        return bool(rowcount)
+
+    async def queue_stats(self) -> List[dict]:
+        """Jobs por realm y estado según la tabla (todas las instancias)."""
+        rows = await fetch_all('cms', 'SELECT realm_id, status, COUNT(*) AS jobs, MIN(next_attempt_at) AS next_attempt_at FROM soap_delivery_jobs '
+                                      "WHERE status <> 'done' OR updated_at >= NOW() - INTERVAL 1 DAY GROUP BY realm_id, status ORDER BY realm_id, status") or []
+        return rows
+
+    def stats(self) -> dict:
+        realm_ids: Set[Optional[int]] = set(self.realms) | set(self._in_flight)
+        return {
+            'running': bool(self._task and not self._task.done()),
+            'in_flight': len(self._jobs),
+            'realm_concurrency': SOAP_DELIVERY_REALM_CONCURRENCY,
+            'realms': [{'realm_id': r, 'in_flight': self._in_flight.get(r, 0), **self._realm(r)} for r in sorted(realm_ids, key=lambda r: (r is None, r or 0))],
+            'last_error': self.last_error,
+        }
+
+
+soap_delivery = SoapDeliveryWorker()
@@ -104,17 +104,23 @@ CREATE TABLE IF NOT EXISTS `news` (
   `slug` VARCHAR(220) NOT NULL,
   `summary` VARCHAR(500) DEFAULT NULL,
   `content` MEDIUMTEXT NOT NULL,
+  `content_html` MEDIUMTEXT NULL, -- render.py; re-generado si cambia RENDERER_VERSION
+  `content_hash` CHAR(40) NULL,
+  `render_version` SMALLINT UNSIGNED NOT NULL DEFAULT 0,
   `realm_id` INT UNSIGNED DEFAULT NULL, -- null => global news
   `author_username` VARCHAR(32) NOT NULL,
   `is_published` TINYINT(1) NOT NULL DEFAULT 0,
   `published_at` DATETIME NULL DEFAULT NULL,
   `priority` INT NOT NULL DEFAULT 0,
+  `comments_count` INT UNSIGNED NOT NULL DEFAULT 0, -- denormalizado, mantenido por add/delete comment
   `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
   `updated_at` TIMESTAMP NULL DEFAULT NULL ON UPDATE CURRENT_TIMESTAMP,
   PRIMARY KEY (`id`),
   UNIQUE KEY `uq_news_slug` (`slug`),
   KEY `idx_news_published_at` (`published_at`),
   KEY `idx_news_realm_id` (`realm_id`),
+  KEY `idx_news_render_version` (`render_version`),
+  FULLTEXT KEY `ft_news_search` (`title`, `summary`, `content`),
   CONSTRAINT `fk_news_realm_id` FOREIGN KEY (`realm_id`) REFERENCES `realms`(`realm_id`) ON DELETE SET NULL ON UPDATE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
@@ -124,9 +130,13 @@ CREATE TABLE IF NOT EXISTS `news_comments` (
   `news_id` INT UNSIGNED NOT NULL,
   `author_username` VARCHAR(32) NOT NULL,
   `content` TEXT NOT NULL,
+  `content_html` MEDIUMTEXT NULL,
+  `content_hash` CHAR(40) NULL,
+  `render_version` SMALLINT UNSIGNED NOT NULL DEFAULT 0,
   `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
   PRIMARY KEY (`id`),
   KEY `idx_news_comments_news_id` (`news_id`),
+  KEY `idx_news_comments_render_version` (`render_version`),
   KEY `idx_news_comments_created_at` (`created_at`),
   KEY `idx_news_comments_author` (`author_username`),
   CONSTRAINT `fk_news_comments_news` FOREIGN KEY (`news_id`) REFERENCES `news`(`id`) ON DELETE CASCADE ON UPDATE CASCADE
@@ -139,6 +149,12 @@ CREATE TABLE IF NOT EXISTS `forum_categories` (
   `slug` VARCHAR(140) NOT NULL,
   `description` TEXT NULL,
   `position` INT NOT NULL DEFAULT 0,
+  `topics_count` INT UNSIGNED NOT NULL DEFAULT 0,
+  `posts_count` INT UNSIGNED NOT NULL DEFAULT 0,
+  `last_topic_id` INT UNSIGNED NULL DEFAULT NULL,
+  `last_topic_title` VARCHAR(200) NULL DEFAULT NULL,
+  `last_post_author` VARCHAR(32) NULL DEFAULT NULL,
+  `last_post_at` TIMESTAMP NULL DEFAULT NULL,
   `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
   `updated_at` TIMESTAMP NULL DEFAULT NULL ON UPDATE CURRENT_TIMESTAMP,
   PRIMARY KEY (`id`),
@@ -159,9 +175,10 @@ CREATE TABLE IF NOT EXISTS `forum_topics` (
   `is_locked` TINYINT(1) NOT NULL DEFAULT 0,
   `is_pinned` TINYINT(1) NOT NULL DEFAULT 0,
   PRIMARY KEY (`id`),
-  KEY `idx_forum_topics_category` (`category_id`),
+  KEY `idx_forum_topics_category_order` (`category_id`, `is_pinned`, `last_post_at`, `id`),
   KEY `idx_forum_topics_last_post_at` (`last_post_at`),
   KEY `idx_forum_topics_pinned` (`is_pinned`),
+  FULLTEXT KEY `ft_forum_topics_title` (`title`),
   CONSTRAINT `fk_forum_topics_category` FOREIGN KEY (`category_id`) REFERENCES `forum_categories`(`id`) ON DELETE CASCADE ON UPDATE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
@@ -171,14 +188,39 @@ CREATE TABLE IF NOT EXISTS `forum_posts` (
   `topic_id` INT UNSIGNED NOT NULL,
   `author_username` VARCHAR(32) NOT NULL,
   `content` MEDIUMTEXT NOT NULL,
+  `content_html` MEDIUMTEXT NULL,
+  `content_hash` CHAR(40) NULL,
+  `render_version` SMALLINT UNSIGNED NOT NULL DEFAULT 0,
   `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
   `updated_at` TIMESTAMP NULL DEFAULT NULL ON UPDATE CURRENT_TIMESTAMP,
   PRIMARY KEY (`id`),
-  KEY `idx_forum_posts_topic` (`topic_id`),
+  KEY `idx_forum_posts_topic_id` (`topic_id`, `id`),
+  KEY `idx_forum_posts_render_version` (`render_version`),
   KEY `idx_forum_posts_author` (`author_username`),
+  FULLTEXT KEY `ft_forum_posts_content` (`content`),
   CONSTRAINT `fk_forum_posts_topic` FOREIGN KEY (`topic_id`) REFERENCES `forum_topics`(`id`) ON DELETE CASCADE ON UPDATE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- Forum read state: per-category "read all before" watermark (category_id 0 = whole forum)
+CREATE TABLE IF NOT EXISTS `forum_read_categories` (
+  `username` VARCHAR(32) NOT NULL,
+  `category_id` INT UNSIGNED NOT NULL,
+  `read_before` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `read_before_post_id` INT UNSIGNED NOT NULL DEFAULT 0, -- último forum_posts.id existente al marcar
+  PRIMARY KEY (`username`, `category_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Forum read state: sparse per-topic overrides newer than the category watermark
+CREATE TABLE IF NOT EXISTS `forum_read_topics` (
+  `username` VARCHAR(32) NOT NULL,
+  `topic_id` INT UNSIGNED NOT NULL,
+  `last_read_post_id` INT UNSIGNED NOT NULL DEFAULT 0,
+  `read_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`username`, `topic_id`),
+  KEY `idx_forum_read_topics_topic` (`topic_id`),
+  CONSTRAINT `fk_forum_read_topics_topic` FOREIGN KEY (`topic_id`) REFERENCES `forum_topics`(`id`) ON DELETE CASCADE ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
 -- Password reset tokens (OTP) for account recovery
 CREATE TABLE IF NOT EXISTS `password_reset_tokens` (
   `id` INT UNSIGNED NOT NULL AUTO_INCREMENT,
@@ -278,6 +320,102 @@ CREATE TABLE IF NOT EXISTS `shop_purchase_items` (
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 
+-- Unidades compradas por (usuario, item) con límite por cuenta; solo con SHOP_LIMIT_COUNTERS=true
+CREATE TABLE IF NOT EXISTS `shop_purchase_limits` (
+  `username` VARCHAR(32) NOT NULL,
+  `shop_item_id` INT UNSIGNED NOT NULL,
+  `quantity` INT UNSIGNED NOT NULL DEFAULT 0,
+  PRIMARY KEY (`username`, `shop_item_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Cola persistente de entregas SOAP de compras (procesada por soap_delivery.py)
+CREATE TABLE IF NOT EXISTS `soap_delivery_jobs` (
+  `id` BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+  `purchase_id` BIGINT UNSIGNED NOT NULL,
+  `realm_id` INT UNSIGNED NULL,
+  `status` ENUM('pending','running','done','dead') NOT NULL DEFAULT 'pending',
+  `attempts` INT UNSIGNED NOT NULL DEFAULT 0,
+  `mails_sent` INT UNSIGNED NOT NULL DEFAULT 0, -- mails ya entregados (un reintento no los reenvía)
+  `next_attempt_at` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `locked_at` DATETIME NULL DEFAULT NULL,
+  `last_error` TEXT NULL,
+  `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `updated_at` TIMESTAMP NULL DEFAULT NULL ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  KEY `idx_soap_jobs_claim` (`status`, `next_attempt_at`),
+  KEY `idx_soap_jobs_purchase` (`purchase_id`),
+  KEY `idx_soap_jobs_realm_status` (`realm_id`, `status`),
+  CONSTRAINT `fk_soap_jobs_purchase` FOREIGN KEY (`purchase_id`) REFERENCES `shop_purchases`(`id`) ON DELETE CASCADE ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Visitas de noticias y topics (kind = 'news' | 'topic'); volcadas en lote por view_counter.py
+CREATE TABLE IF NOT EXISTS `content_views` (
+  `kind` VARCHAR(16) NOT NULL,
+  `content_id` INT UNSIGNED NOT NULL,
+  `views` BIGINT UNSIGNED NOT NULL DEFAULT 0,
+  PRIMARY KEY (`kind`, `content_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Log de cambios del índice de búsqueda en memoria (search.py, solo sin FULLTEXT); los workers lo aplican por id
+CREATE TABLE IF NOT EXISTS `search_index_changes` (
+  `id` BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+  `doc_type` VARCHAR(16) NOT NULL, -- 'news' | 'topic' | 'post' | 'category'
+  `doc_id` INT UNSIGNED NOT NULL,
+  `op` ENUM('upsert','delete') NOT NULL,
+  `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  KEY `idx_search_changes_created` (`created_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Contadores de versión para invalidar caches en memoria entre workers
+CREATE TABLE IF NOT EXISTS `cache_versions` (
+  `name` VARCHAR(64) NOT NULL,
+  `version` BIGINT UNSIGNED NOT NULL DEFAULT 0,
+  `updated_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+
+-- Migraciones para instalaciones existentes (ejecutar una vez):
+-- ALTER TABLE `news` ADD COLUMN `comments_count` INT UNSIGNED NOT NULL DEFAULT 0 AFTER `priority`;
+-- ALTER TABLE `news` ADD FULLTEXT KEY `ft_news_search` (`title`, `summary`, `content`);
+-- ALTER TABLE `forum_topics` ADD FULLTEXT KEY `ft_forum_topics_title` (`title`);
+-- ALTER TABLE `forum_posts` ADD FULLTEXT KEY `ft_forum_posts_content` (`content`);
+-- ALTER TABLE `forum_topics` ADD KEY `idx_forum_topics_category_order` (`category_id`, `is_pinned`, `last_post_at`, `id`), DROP KEY `idx_forum_topics_category`;
+-- ALTER TABLE `forum_posts` ADD KEY `idx_forum_posts_topic_id` (`topic_id`, `id`), DROP KEY `idx_forum_posts_topic`;
+-- UPDATE `forum_topics` SET last_post_at = created_at WHERE last_post_at IS NULL;
+-- ALTER TABLE `forum_categories` ADD COLUMN `topics_count` INT UNSIGNED NOT NULL DEFAULT 0 AFTER `position`,
+--   ADD COLUMN `posts_count` INT UNSIGNED NOT NULL DEFAULT 0 AFTER `topics_count`,
+--   ADD COLUMN `last_topic_id` INT UNSIGNED NULL DEFAULT NULL AFTER `posts_count`,
+--   ADD COLUMN `last_topic_title` VARCHAR(200) NULL DEFAULT NULL AFTER `last_topic_id`,
+--   ADD COLUMN `last_post_author` VARCHAR(32) NULL DEFAULT NULL AFTER `last_topic_title`,
+--   ADD COLUMN `last_post_at` TIMESTAMP NULL DEFAULT NULL AFTER `last_post_author`;
+-- (luego POST /forum/admin/counters/reconcile para rellenar los agregados de categoría)
+-- ALTER TABLE `news` ADD COLUMN `content_html` MEDIUMTEXT NULL AFTER `content`, ADD COLUMN `content_hash` CHAR(40) NULL AFTER `content_html`,
+--   ADD COLUMN `render_version` SMALLINT UNSIGNED NOT NULL DEFAULT 0 AFTER `content_hash`, ADD KEY `idx_news_render_version` (`render_version`);
+-- ALTER TABLE `news_comments` ADD COLUMN `content_html` MEDIUMTEXT NULL AFTER `content`, ADD COLUMN `content_hash` CHAR(40) NULL AFTER `content_html`,
+--   ADD COLUMN `render_version` SMALLINT UNSIGNED NOT NULL DEFAULT 0 AFTER `content_hash`, ADD KEY `idx_news_comments_render_version` (`render_version`);
+-- ALTER TABLE `forum_posts` ADD COLUMN `content_html` MEDIUMTEXT NULL AFTER `content`, ADD COLUMN `content_hash` CHAR(40) NULL AFTER `content_html`,
+--   ADD COLUMN `render_version` SMALLINT UNSIGNED NOT NULL DEFAULT 0 AFTER `content_hash`, ADD KEY `idx_forum_posts_render_version` (`render_version`);
+-- (el HTML de las filas existentes lo genera el job de re-render al arrancar)
+-- (cache_versions: ejecutar su CREATE TABLE de arriba; sin ella los caches entre workers solo expiran por TTL)
+-- (content_views: ejecutar su CREATE TABLE de arriba)
+-- (search_index_changes: ejecutar su CREATE TABLE de arriba; solo se usa con el índice de búsqueda en memoria)
+-- (forum_read_categories / forum_read_topics: ejecutar sus CREATE TABLE de arriba)
+-- Si forum_read_categories ya existía sin read_before_post_id:
+-- ALTER TABLE `forum_read_categories` ADD COLUMN `read_before_post_id` INT UNSIGNED NOT NULL DEFAULT 0 AFTER `read_before`;
+-- UPDATE `forum_read_categories` rc SET rc.read_before_post_id = (SELECT COALESCE(MAX(p.id), 0) FROM `forum_posts` p WHERE p.created_at <= rc.read_before);
+-- (soap_delivery_jobs: ejecutar su CREATE TABLE de arriba; requiere MySQL 8.0+ por SKIP LOCKED)
+-- (shop_purchase_limits: ejecutar su CREATE TABLE de arriba y rellenarlo antes de activar SHOP_LIMIT_COUNTERS)
+-- INSERT INTO `shop_purchase_limits` (username, shop_item_id, quantity)
+--   SELECT b.username, b.item_id, SUM(b.qty) FROM (
+--     SELECT p.username, pi.shop_item_id AS item_id, pi.quantity AS qty FROM `shop_purchase_items` pi JOIN `shop_purchases` p ON p.id = pi.purchase_id
+--     UNION ALL
+--     SELECT p.username, p.item_id, 1 FROM `shop_purchases` p WHERE p.item_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM `shop_purchase_items` pi WHERE pi.purchase_id = p.id)
+--   ) b JOIN `shop_items` i ON i.id = b.item_id WHERE i.limit_per_account IS NOT NULL GROUP BY b.username, b.item_id;
+-- UPDATE `news` n SET n.comments_count = (SELECT COUNT(*) FROM `news_comments` c WHERE c.news_id = n.id);
+
+
 -- Notes:
 -- 1) `session` is BINARY(40) to store the 40-byte session_key used by web sessions.
 -- 2) `role` gestiona permisos básicos: 0=guest (no se usa en DB), 1=logged (por defecto), 2=admin.
@@ -0,0 +1,81 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from render import RENDERER_VERSION, _is_stale, content_hash, render, rendered_fields  # noqa: E402
+
+
+def test_nul_markers_in_user_text_are_ignored():
+    assert render('a\x001\x00b') == 'a1b'
+
+
+def test_nul_markers_cannot_splice_code_blocks():
+    out = render('[code]<x>[/code] \x000\x00 \x001\x00')
+    assert out.count('<pre><code>') == 1
+    assert '&lt;x&gt;' in out
+    assert '\x00' not in out
+
+
+def test_code_blocks_are_escaped():
+    assert render('[code]<b>[/code]') == '<pre><code>&lt;b&gt;</code></pre>'
+
+
+def test_simple_tags():
+    assert render('[b]a[/b] [i]b[/i] [u]c[/u] [s]d[/s]') == '<strong>a</strong> <em>b</em> <u>c</u> <s>d</s>'
+
+
+def test_html_is_escaped():
+    assert render('<script>alert(1)</script>') == '&lt;script&gt;alert(1)&lt;/script&gt;'
+
+
+def test_urls():
+    assert render('[url]https://example.com/a?b=1&c=2[/url]') == (
+        '<a href="https://example.com/a?b=1&amp;c=2" rel="nofollow noopener" target="_blank">https://example.com/a?b=1&amp;c=2</a>')
+    assert render('[url=https://example.com]sitio[/url]') == '<a href="https://example.com" rel="nofollow noopener" target="_blank">sitio</a>'
+
+
+def test_unsafe_urls_are_not_linked():
+    assert 'href' not in render('[url]javascript:alert(1)[/url]')
+    assert render('[url=javascript:alert(1)]x[/url]') == 'x'
+    assert '<img' not in render('[img]data:image/png;base64,AAAA[/img]')
+
+
+def test_img_and_color():
+    assert render('[img]https://example.com/a.png[/img]') == '<img src="https://example.com/a.png" alt="" loading="lazy">'
+    assert render('[color=#ff0000]x[/color]') == '<span style="color:#ff0000">x</span>'
+    assert '<span' not in render('[color=red;background:url(x)]x[/color]')
+
+
+def test_nested_quotes():
+    assert render('[quote=Ana]a [quote]b[/quote][/quote]') == '<blockquote><cite>Ana</cite>a <blockquote>b</blockquote></blockquote>'
+
+
+def test_list():
+    assert render('[list][*]uno[*]dos[/list]') == '<ul><li>uno</li><li>dos</li></ul>'
+
+
+def test_newlines():
+    assert render('a\r\nb') == 'a<br>\nb'
+    assert render(None) == ''
+
+
+def test_rendered_fields():
+    html, digest, version = rendered_fields('[b]x[/b]')
+    assert html == '<strong>x</strong>'
+    assert digest == content_hash('[b]x[/b]')
+    assert version == RENDERER_VERSION
+
+
+def test_content_hash_changes_with_content():
+    assert content_hash('a') != content_hash('b')
+    assert content_hash(None) == content_hash('')
+
+
+def test_is_stale():
+    html, digest, version = rendered_fields('x')
+    row = {'content': 'x', 'content_html': html, 'content_hash': digest, 'render_version': version}
+    assert not _is_stale(row)
+    assert _is_stale({**row, 'render_version': version - 1})
+    assert _is_stale({**row, 'content_html': None})
+    assert _is_stale({**row, 'content': 'y'})
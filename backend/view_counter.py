@@ -0,0 +1,95 @@
+import asyncio
+from typing import Dict, Optional, Tuple
+
+from config import VIEW_COUNTER_FLUSH_INTERVAL
+from db import execute
+
+FLUSH_CHUNK = 500
+
+
+def views_subquery(kind: str, id_column: str) -> str:
+    """SQL expression with the stored view count of each row (for list projections)."""
+    return f"COALESCE((SELECT cv.views FROM content_views cv WHERE cv.kind = '{kind}' AND cv.content_id = {id_column}), 0)"
+
+
+class ViewCounter:
+    """Write-behind page view counter for news and forum topics.
+
+    Reads only bump an in-memory counter; every VIEW_COUNTER_FLUSH_INTERVAL seconds the
+    pending increments are added to cms.content_views with a batched
+    INSERT ... ON DUPLICATE KEY UPDATE, so hot pages never take a row lock on read.
+    """
+
+    def __init__(self):
+        # (kind, id) -> vistas pendientes de volcar
+        self._pending: Dict[Tuple[str, int], int] = {}
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.flushed_views = 0
+        self.last_error: Optional[str] = None
+
+    def add(self, kind: str, content_id: int, n: int = 1) -> None:
+        key = (kind, int(content_id))
+        self._pending[key] = self._pending.get(key, 0) + n
+
+    def pending(self, kind: str, content_id: int) -> int:
+        return self._pending.get((kind, int(content_id)), 0)
+
+    def discard(self, kind: str, content_id: int) -> None:
+        self._pending.pop((kind, int(content_id)), None)
+
+    async def flush(self) -> int:
+        async with self._lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+            items = list(pending.items())
+            done = 0
+            try:
+                for i in range(0, len(items), FLUSH_CHUNK):
+                    chunk = items[i:i + FLUSH_CHUNK]
+                    values = ','.join(['(%s,%s,%s)'] * len(chunk))
+                    params = [v for (kind, cid), n in chunk for v in (kind, cid, n)]
+                    await execute('cms', f'INSERT INTO content_views (kind, content_id, views) VALUES {values} '
+                                         'ON DUPLICATE KEY UPDATE views = views + VALUES(views)', tuple(params))
+                    done += len(chunk)
+            except Exception:
+                # lo no volcado vuelve a la cola
+                for (kind, cid), n in items[done:]:
+                    self.add(kind, cid, n)
+                raise
+            self.flushes += 1
+            self.flushed_views += sum(n for _, n in items)
+            return len(items)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(VIEW_COUNTER_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception as e:
+                self.last_error = str(e)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            self.last_error = str(e)
+
+    def stats(self) -> dict:
+        return {'pending': len(self._pending), 'flushes': self.flushes, 'flushed_views': self.flushed_views, 'last_error': self.last_error}
+
+
+view_counter = ViewCounter()
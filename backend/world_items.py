@@ -0,0 +1,103 @@
+import asyncio
+from typing import Dict, Iterable, Optional
+
+from cache import TTLCache
+from config import WORLD_ITEM_CACHE_MAXSIZE, WORLD_ITEM_CACHE_TTL, WORLD_ITEM_PRELOAD_SHOP
+from db import fetch_all
+
+# entries por consulta `IN (...)`
+LOOKUP_BATCH = 1000
+# referencia a la precarga en curso (evita que el task se recolecte antes de terminar)
+_preload_task: Optional[asyncio.Task] = None
+
+
+# entry -> dict | False (False = entry inexistente, evita reconsultar)
+_template_cache = TTLCache(maxsize=WORLD_ITEM_CACHE_MAXSIZE, ttl=WORLD_ITEM_CACHE_TTL)
+
+
+def _serialize_template(row: dict) -> dict:
+    return {
+        'entry': row.get('entry'),
+        'name': row.get('name'),
+        'quality': row.get('Quality'),
+        'item_level': row.get('ItemLevel'),
+        'inventory_type': row.get('InventoryType'),
+        'stackable': row.get('stackable'),
+    }
+
+
+async def get_item_templates(entries: Iterable[int]) -> Dict[int, dict]:
+    """Resolve item_template rows by entry using the in-process LRU.
+
+    Only the entries missing from the cache are loaded, with a single
+    `WHERE entry IN (...)` query against the world pool.
+    """
+    wanted = {int(e) for e in entries if e}
+    found: Dict[int, dict] = {}
+    missing = []
+    for entry in wanted:
+        cached = _template_cache.get(entry)
+        if cached is None:
+            missing.append(entry)
+        elif cached:
+            found[entry] = cached
+    for i in range(0, len(missing), LOOKUP_BATCH):
+        batch = missing[i:i + LOOKUP_BATCH]
+        placeholders = ','.join(['%s'] * len(batch))
+        rows = await fetch_all('world', f'SELECT entry, name, Quality, ItemLevel, InventoryType, stackable FROM item_template WHERE entry IN ({placeholders})', tuple(batch)) or []
+        for row in rows:
+            tpl = _serialize_template(row)
+            _template_cache.set(int(row['entry']), tpl)
+            found[int(row['entry'])] = tpl
+        for entry in batch:
+            if entry not in found:
+                _template_cache.set(entry, False)
+    return found
+
+
+async def get_stack_sizes(entries: Iterable[int]) -> Dict[int, int]:
+    """Max stack size per entry (1 for unknown entries or non-stackable items)."""
+    wanted = {int(e) for e in entries if e}
+    templates = await get_item_templates(wanted)
+    out: Dict[int, int] = {}
+    for entry in wanted:
+        tpl = templates.get(entry)
+        out[entry] = max(int((tpl or {}).get('stackable') or 1), 1)
+    return out
+
+
+async def preload_shop_items() -> Optional[int]:
+    """Load the templates of every item sold in the shop (few queries at startup)."""
+    rows = await fetch_all('cms', 'SELECT DISTINCT world_item_entry FROM shop_items') or []
+    entries = [r['world_item_entry'] for r in rows if r.get('world_item_entry')]
+    return len(await get_item_templates(entries))
+
+
+async def _preload_quietly() -> None:
+    try:
+        await preload_shop_items()
+    except Exception:
+        # sin world DB al arrancar: las entries se cargarán en la primera entrega
+        pass
+
+
+def start_preload() -> None:
+    """Preload en background (no retrasa el arranque) si WORLD_ITEM_PRELOAD_SHOP está activo."""
+    global _preload_task
+    if WORLD_ITEM_PRELOAD_SHOP and (_preload_task is None or _preload_task.done()):
+        _preload_task = asyncio.create_task(_preload_quietly())
+
+
+async def stop_preload() -> None:
+    global _preload_task
+    if _preload_task and not _preload_task.done():
+        _preload_task.cancel()
+        try:
+            await _preload_task
+        except asyncio.CancelledError:
+            pass
+    _preload_task = None
+
+
+def clear_item_cache() -> None:
+    _template_cache.clear()
@@ -21,9 +21,10 @@ import { AuthService } from '../auth.service';
     <div class="posts">
       <div class="post" *ngFor="let p of posts()">
         <div class="meta">{{ p.author_username }} • {{ formatDate(p.created_at) }}</div>
-        <div class="content">{{ p.content }}</div>
+        <div class="content" [innerHTML]="p.content_html"></div>
       </div>
       <div *ngIf="!posts().length" class="empty">Sin posts todavía.</div>
+      <button *ngIf="nextCursor()" class="more" (click)="loadMore()" [disabled]="loadingMore()">{{ loadingMore()? 'Cargando...' : 'Cargar más' }}</button>
     </div>
     <form *ngIf="canPost() && !t.is_locked" class="new-post" (ngSubmit)="submitPost(); $event.preventDefault();">
       <textarea rows="4" [(ngModel)]="postContent" name="content" placeholder="Escribe una respuesta..." required></textarea>
@@ -46,7 +47,8 @@ import { AuthService } from '../auth.service';
     .posts { margin:1rem 0; display:flex; flex-direction:column; gap:.8rem; }
     .post { background:#1d2329; border:1px solid #273038; padding:.6rem .8rem .7rem; border-radius:8px; }
     .post .meta { font-size:.6rem; text-transform:uppercase; letter-spacing:.5px; color:#81919e; margin-bottom:.35rem; }
-    .post .content { white-space:pre-line; font-size:.8rem; line-height:1.1rem; }
+    .post .content { font-size:.8rem; line-height:1.1rem; }
+    .more { align-self:center; }
     .new-post { display:flex; flex-direction:column; gap:.6rem; }
     textarea { background:#1e252b; border:1px solid #2a333c; border-radius:6px; padding:.55rem .6rem; resize:vertical; color:#e4eaef; font-size:.75rem; font-family:inherit; }
     textarea:focus { outline:none; border-color:#4d6fff; }
@@ -67,6 +69,8 @@ export class ForumTopicDetailComponent implements OnChanges {
   loading = signal(false);
   topic = signal<any|null>(null);
   posts = signal<ForumPost[]>([]);
+  nextCursor = signal<number|null>(null);
+  loadingMore = signal(false);
   postContent = '';
   posting = signal(false);
   error = signal('');
@@ -81,10 +85,23 @@ export class ForumTopicDetailComponent implements OnChanges {
       const data:any = await this.forum.fetchTopic(this.topicId);
       this.topic.set(data);
       this.posts.set(data.posts || []);
+      this.nextCursor.set(data.posts_next_cursor ?? null);
     } catch(e:any){ this.error.set(e?.error?.detail || 'Error cargando topic'); }
     finally { this.loading.set(false); }
   }
 
+  async loadMore(){
+    const cursor = this.nextCursor();
+    if(!this.topicId || !cursor) return;
+    this.loadingMore.set(true);
+    try {
+      const data:any = await this.forum.fetchPosts(this.topicId, cursor);
+      this.posts.update(list => [...list, ...(data.items || [])]);
+      this.nextCursor.set(data.pagination?.next_cursor ?? null);
+    } catch(e:any){ this.error.set(e?.error?.detail || 'Error cargando posts'); }
+    finally { this.loadingMore.set(false); }
+  }
+
   ngOnChanges(ch:SimpleChanges){
     if(ch['topicId'] && this.topicId){ this.load(); }
   }
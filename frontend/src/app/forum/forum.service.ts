@@ -5,7 +5,7 @@ import { environment } from '../environments';
 export interface ForumCategory { id:number; name:string; description:string; position:number; }
 export interface ForumTopic { id:number; title:string; author_username:string; created_at:string; updated_at:string; last_post_at:string; posts_count:number; is_locked:number; is_pinned:number; }
 export interface ForumTopicsResponse { items:ForumTopic[]; pagination:{ page:number; page_size:number; total:number; }; }
-export interface ForumPost { id:number; topic_id:number; author_username:string; content:string; created_at:string; }
+export interface ForumPost { id:number; topic_id:number; author_username:string; content:string; content_html?:string|null; created_at:string; }
 
 const API = environment.apiBase + '/forum';
 
@@ -33,6 +33,10 @@ export class ForumService {
     return this.http.get(`${API}/topics/${topicId}`).toPromise();
   }
 
+  async fetchPosts(topicId:number, cursor:number, pageSize=50):Promise<any>{
+    return this.http.get(`${API}/topics/${topicId}/posts?cursor=${cursor}&page_size=${pageSize}`).toPromise();
+  }
+
   async createTopic(categoryId:number, title:string, content:string){
     return this.http.post(`${API}/categories/${categoryId}/topics`, { title, content }).toPromise();
   }
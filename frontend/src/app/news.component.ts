@@ -33,16 +33,17 @@ import { AuthService } from './auth.service';
       <button class="back" (click)="closeDetail()">← Volver</button>
       <h2>{{ c.title }}</h2>
       <p class="meta">{{ c.author }} • {{ formatDate(c.published_at || c.created_at) }}</p>
-      <div class="body" [innerHTML]="renderContent(c.content)"></div>
+      <div class="body" [innerHTML]="c.content_html"></div>
       <section class="comments">
-        <h3>Comentarios ({{ comments().length }})</h3>
+        <h3>Comentarios ({{ c.comments_count ?? comments().length }})</h3>
         <div class="comment" *ngFor="let cm of comments()">
           <div class="c-head">
             <span class="c-author">{{ cm.author }}</span>
             <span class="c-date">{{ formatDate(cm.created_at) }}</span>
           </div>
-            <div class="c-body">{{ cm.content }}</div>
+            <div class="c-body" [innerHTML]="cm.content_html"></div>
         </div>
+        <button *ngIf="commentsCursor()" class="more" (click)="loadMoreComments()" [disabled]="loadingMore()">{{ loadingMore()? 'Cargando...' : 'Cargar más' }}</button>
         <div *ngIf="isLogged()" class="comment-form">
           <textarea [(ngModel)]="newComment" rows="3" placeholder="Escribe un comentario..." ></textarea>
           <div class="c-actions">
@@ -70,13 +71,14 @@ import { AuthService } from './auth.service';
     .detail { margin-top:1.5rem; background:#1a2026; border:1px solid #273039; padding:1.1rem 1.25rem 1.4rem; border-radius:12px; }
     .detail h2 { margin:.2rem 0 .6rem; }
     .back { background:none; border:none; color:#8fb5ff; cursor:pointer; padding:0; margin:0 0 .65rem; font-size:.85rem; }
-    .body { white-space:pre-line; line-height:1.3rem; font-size:.9rem; }
+    .body { line-height:1.3rem; font-size:.9rem; }
     .comments { margin-top:1.5rem; }
     .comments h3 { margin:0 0 .8rem; font-size:1rem; }
     .comment { border-top:1px solid #2a333c; padding:.55rem 0 .6rem; }
     .comment:first-of-type { border-top:none; }
     .c-head { display:flex; gap:.6rem; font-size:.65rem; letter-spacing:.5px; text-transform:uppercase; color:#6f7c88; }
-    .c-body { font-size:.8rem; line-height:1.15rem; color:#d2d9df; margin-top:.25rem; white-space:pre-line; }
+    .c-body { font-size:.8rem; line-height:1.15rem; color:#d2d9df; margin-top:.25rem; }
+    .more { margin-top:.6rem; background:#262f3a; border:1px solid #394552; padding:.35rem .8rem; border-radius:4px; cursor:pointer; color:#cfd8e0; font-size:.75rem; }
     .comment-form { margin-top:1rem; display:flex; flex-direction:column; gap:.5rem; }
     textarea { resize:vertical; background:#1f252b; border:1px solid #2d3741; padding:.55rem .6rem; color:#e4ebf3; font-family:inherit; border-radius:6px; font-size:.8rem; }
     textarea:focus { outline:none; border-color:#4d6fff; }
@@ -93,6 +95,8 @@ export class NewsComponent {
   loading = signal(false);
   current = signal<NewsItem | null>(null);
   comments = signal<NewsComment[]>([]);
+  commentsCursor = signal<number|null>(null);
+  loadingMore = signal(false);
   commentLoading = signal(false);
   commentError = signal('');
   newComment = '';
@@ -117,17 +121,30 @@ export class NewsComponent {
   }
 
   formatDate(dt?:string|null){ if(!dt) return ''; return dt.split('T')[0]; }
-  renderContent(html:string){ return (html||'').replace(/\n/g,'<br/>'); }
 
   async open(n:NewsItem){
     try {
       const full = await this.api.get(n.slug || String(n.id));
       this.current.set(full);
-      // comments vienen dentro (full.comments) ya, pero permitimos recarga futura
+      // el detalle trae los comentarios más recientes; el resto se pide con cursor
       this.comments.set(full.comments || []);
+      this.commentsCursor.set(full.comments_next_cursor ?? null);
     } catch(e:any){ /* manejar error */ }
   }
-  closeDetail(){ this.current.set(null); }
+
+  async loadMoreComments(){
+    const c = this.current();
+    const cursor = this.commentsCursor();
+    if(!c || !cursor) return;
+    this.loadingMore.set(true);
+    try {
+      const res = await this.api.fetchComments(c.id, cursor);
+      this.comments.update(list => [...list, ...(res.items || [])]);
+      this.commentsCursor.set(res.pagination?.next_cursor ?? null);
+    } catch(e:any){ this.commentError.set(e?.error?.detail || 'Error cargando comentarios'); }
+    finally { this.loadingMore.set(false); }
+  }
+  closeDetail(){ this.current.set(null); this.commentsCursor.set(null); }
   prevPage(){ if(this.pagination().page>1){ this.pagination.update(p=>({...p,page:p.page-1})); this.load(); } }
   nextPage(){ if(this.pagination().page<this.totalPages()){ this.pagination.update(p=>({...p,page:p.page+1})); this.load(); } }
 
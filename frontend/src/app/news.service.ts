@@ -5,9 +5,9 @@ import { environment } from './environments';
 
 export interface NewsListResponse { items: NewsItem[]; pagination: { page:number; page_size:number; total:number }; }
 export interface NewsItem {
-  id:number; title:string; slug:string; summary?:string; content:string; realm_id?:number|null; author:string; is_published:boolean; published_at?:string|null; created_at?:string|null; updated_at?:string|null; priority?:number; comments?:NewsComment[]; comments_count?:number;
+  id:number; title:string; slug:string; summary?:string; content:string; content_html?:string|null; realm_id?:number|null; author:string; is_published:boolean; published_at?:string|null; created_at?:string|null; updated_at?:string|null; priority?:number; comments?:NewsComment[]; comments_count?:number; comments_next_cursor?:number|null;
 }
-export interface NewsComment { id:number; author:string; content:string; created_at:string; }
+export interface NewsComment { id:number; author:string; content:string; content_html?:string|null; created_at:string; }
 
 const BASE = environment.apiBase + '/news';
 
@@ -38,4 +38,9 @@ export class NewsService {
     this.lastError.set(undefined);
     return await firstValueFrom(this.http.get<{ items:NewsComment[]; pagination:any }>(`${BASE}/${newsId}/comments?page=${page}&page_size=${page_size}`));
   }
+
+  async fetchComments(newsId: number, cursor: number, page_size=30){
+    this.lastError.set(undefined);
+    return await firstValueFrom(this.http.get<{ items:NewsComment[]; pagination:any }>(`${BASE}/${newsId}/comments?cursor=${cursor}&page_size=${page_size}`));
+  }
 }